@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Byte-budgeted, adaptive batch sizing.
+
+A fixed row count makes batch memory depend on document size: 50000 Merged_API documents with
+their request payloads hold hundreds of MB in Python, while 50000 small third-party rows fill a
+fraction of an insert round trip. A BatchSizer instead gives the reader the row limit for the
+next batch from a byte budget and the average document size seen so far:
+
+- the budget shrinks when inserting a batch takes longer than target_insert_seconds and grows
+  back (up to batch_bytes) while inserts stay well under it;
+- rows per batch stay between min_rows and max_rows (the job's batch_size);
+- with a MemoryCeiling, the job's in-flight bytes (source documents read but not yet written, by
+  their BSON size, across every source and shard of the job) stay under its max_rss_mb: a reader
+  reserves room for its next batch before reading it, takes fewer rows when there is little room
+  and blocks while there is none, until the job's writers have drained enough.
+
+The ceiling is per job and counts only the job's own batches, so jobs sharing a daemon process do
+not hold each other up. Decoded documents take several times their BSON size in Python; the
+ceiling is on the BSON bytes, which is what can be measured without decoding.
+"""
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+SIZE_SAMPLE = 32  # Documents encoded per batch to estimate the average size of decoded documents
+SMOOTHING = 0.3  # Weight of the latest batch in the running average document size
+MIN_BUDGET_FRACTION = 1 / 16  # The budget never shrinks below this fraction of batch_bytes
+CEILING_WARNING_SECONDS = 30  # A reader blocked this long by the memory ceiling says so
+
+
+def current_rss_bytes():
+    """Resident set size of this process; the peak so far where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, KiB elsewhere
+
+
+def average_size(docs):
+    """Average BSON size of docs: exact for raw documents, from an evenly spaced sample otherwise."""
+    if isinstance(docs[0], RawBSONDocument):
+        return sum(len(doc.raw) for doc in docs) / len(docs)
+    sample = docs[::max(1, len(docs) // SIZE_SAMPLE)]
+    return sum(len(bson.encode(doc)) for doc in sample) / len(sample)
+
+
+class MemoryCeiling:
+    """
+    In-flight bytes of one job, across all its sources and shards, held under max_bytes. Readers
+    reserve room before reading a batch and wait while there is none; writers release it.
+    """
+
+    def __init__(self, max_bytes, logger=None):
+        self.max_bytes = max_bytes
+        self.logger = logger or logging.getLogger()
+        self.in_flight = 0
+        self.doc_bytes = None  # Latest average document size seen by any of the job's readers
+        self._changed = threading.Condition()
+
+    def reserve(self, rows, doc_bytes):
+        """
+        Wait until the job has room, then reserve it for up to rows documents of doc_bytes each
+        (None before the size is known). Returns (rows, bytes reserved); at least one row goes
+        ahead once nothing else is in flight, however large.
+        """
+        waiting_since = time.monotonic()
+        warned = False
+        with self._changed:
+            while self.in_flight and self.in_flight + (doc_bytes or 1) > self.max_bytes:
+                if not warned and time.monotonic() - waiting_since >= CEILING_WARNING_SECONDS:
+                    self.logger.warning(
+                        f"{self.in_flight / 2 ** 20:.0f} MiB in flight is at the {self.max_bytes / 2 ** 20:.0f} MiB "
+                        f"ceiling; waiting for batches to be written before reading more"
+                    )
+                    warned = True
+                self._changed.wait(timeout=1.0)
+            if doc_bytes:
+                rows = max(1, min(rows, int((self.max_bytes - self.in_flight) / doc_bytes)))
+            reserved = rows * (doc_bytes or 0)
+            self.in_flight += reserved
+            return rows, reserved
+
+    def adjust(self, num_bytes):
+        """Add num_bytes to the job's in-flight bytes (negative to release them)."""
+        with self._changed:
+            self.in_flight = max(0, self.in_flight + num_bytes)
+            if num_bytes < 0:
+                self._changed.notify_all()
+
+
+class BatchSizer:
+    """
+    Row limit for each batch of one source (call the sizer for it), from a byte budget adapted to
+    the observed document size and insert latency, within the job's ceiling (a MemoryCeiling, or
+    None); see the module docstring. close() releases whatever the source still holds.
+    """
+
+    def __init__(self, batch_bytes, max_rows, min_rows=1000, target_insert_seconds=2.0, ceiling=None,
+                 logger=None):
+        self.batch_bytes = batch_bytes
+        self.max_rows = max_rows
+        self.min_rows = min(min_rows, max_rows)
+        self.target_insert_seconds = target_insert_seconds
+        self.ceiling = ceiling
+        self.logger = logger or logging.getLogger()
+        self.budget = batch_bytes
+        self.doc_bytes = None  # Running average BSON size per source document
+        self.in_flight = 0  # Documents read but not yet written
+        self.in_flight_bytes = 0  # ...and their BSON size, as counted against the ceiling
+        self._reserved = {}  # Reader thread -> bytes reserved for the batch it is reading
+        self._lock = threading.Lock()  # A sharded source's pipelines share the sizer
+
+    def __call__(self):
+        with self._lock:
+            doc_bytes = self.doc_bytes
+            if doc_bytes is None:
+                rows = self.min_rows  # A small first batch to learn the document size
+            else:
+                rows = max(self.min_rows, min(self.max_rows, int(self.budget / doc_bytes)))
+            if self.ceiling is None:
+                return rows
+            self.ceiling.adjust(-self._reserved.pop(threading.get_ident(), 0))  # A reservation that read nothing
+        # Outside the lock, as it may wait; a source's first batch is sized by what the job's other sources have seen
+        rows, reserved = self.ceiling.reserve(rows, doc_bytes or self.ceiling.doc_bytes)
+        with self._lock:
+            self._reserved[threading.get_ident()] = reserved
+        return rows
+
+    def observe_read(self, docs):
+        """Record a batch handed to the pipeline."""
+        if not docs:
+            return
+        size = average_size(docs)
+        with self._lock:
+            self.doc_bytes = size if self.doc_bytes is None else (1 - SMOOTHING) * self.doc_bytes + SMOOTHING * size
+            self.in_flight += len(docs)
+            self.in_flight_bytes += size * len(docs)
+            if self.ceiling is not None:
+                self.ceiling.doc_bytes = size
+                self.ceiling.adjust(size * len(docs) - self._reserved.pop(threading.get_ident(), 0))
+
+    def observe_write(self, num_docs, insert_seconds):
+        """
+        Record a written batch of num_docs source documents; insert_seconds is how long its target
+        insert took, or None when nothing was inserted.
+        """
+        with self._lock:
+            if insert_seconds is not None:
+                if insert_seconds > self.target_insert_seconds:
+                    self.budget *= max(0.5, self.target_insert_seconds / insert_seconds)
+                elif insert_seconds < self.target_insert_seconds / 2:
+                    self.budget *= 1.25
+                self.budget = max(self.batch_bytes * MIN_BUDGET_FRACTION, min(self.batch_bytes, self.budget))
+            # Batches are written in the order they were read only within one pipeline, so release
+            # the average size of what is in flight; it comes to exactly zero once all is written
+            released = self.in_flight_bytes * min(1, num_docs / self.in_flight) if self.in_flight else 0
+            self.in_flight = max(0, self.in_flight - num_docs)
+            self.in_flight_bytes -= released
+            if self.ceiling is not None:
+                self.ceiling.adjust(-released)
+
+    def close(self):
+        """Release everything this source still holds against the ceiling (after it finished or failed)."""
+        with self._lock:
+            held = self.in_flight_bytes + sum(self._reserved.values())
+            self.in_flight = self.in_flight_bytes = 0
+            self._reserved.clear()
+        if self.ceiling is not None:
+            self.ceiling.adjust(-held)
+
+    def sized(self, batches):
+        """Pass batches through unchanged, recording each one as read."""
+        for batch in batches:
+            self.observe_read(batch)
+            yield batch
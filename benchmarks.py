@@ -0,0 +1,961 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmarks for the ETL jobs. Results are printed as JSON.
+
+    python benchmarks.py pagination --uri mongodb://localhost:27017/ --docs 500000
+    python benchmarks.py jobs --docs 50000 --sink memory > baseline.json
+    python benchmarks.py jobs Merged_API_Airline --sink mongo --uri mongodb://localhost:27017/
+    python benchmarks.py jobs --compare baseline.json    # exits 1 if a job got slower
+    python benchmarks.py jobs --raw-bson on              # every job with lazy raw-BSON batches
+    python benchmarks.py sketches --docs 1000000         # exits 1 if a percentile misses its bound
+    python benchmarks.py dates --docs 500000            # exits 1 if a travelDate parses differently
+    python benchmarks.py layouts Merged_API_Airline --uri mongodb://localhost:27017/ --docs 200000
+    python benchmarks.py layouts Processed_Thirdpary --offline      # client-side costs only, no server
+    python benchmarks.py leases                          # exits 1 if two engines share a source
+    python benchmarks.py leases --uri mongodb://localhost:27017/   # ...against a server
+    python benchmarks.py shards                          # exits 1 if a shared batch sizer leaks bytes
+    python benchmarks.py shards --uri mongodb://localhost:27017/   # ...or a failed shard's rows are skipped
+    python benchmarks.py parity                          # exits 1 if compiled shaping differs
+    python benchmarks.py parity --uri mongodb://localhost:27017/   # ...or server-side shaping does
+"""
+
+import argparse
+import copy
+import json
+import statistics
+import logging
+import math
+import multiprocessing
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import bson
+import pymongo
+import pytz
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+from batching import MIN_BUDGET_FRACTION, BatchSizer, MemoryCeiling
+from checkpoints import CHECKPOINT_COLLECTION
+from etl_common import benchmark_transforms, check_shaping_parity, iter_batches, iter_chunks, run_pipeline
+from layouts import LAYOUTS, MAX_BUCKET_BYTES, PER_RUN_FIELDS, StorageLayout, chunks_by_bytes
+from rollups import truncate
+from sketches import ALPHA, DDSketch
+
+BENCH_DATABASE_NAME = "ETLBenchmarks"
+RAW_BSON_CHOICES = {"job": None, "on": True, "off": False}
+
+
+def seed_time_collection(collection, num_docs, time_field="InsertOn", chunk_size=10000):
+    """Fill a scratch collection with num_docs log-like documents spread over one hour, indexed on time_field."""
+    collection.drop()
+    collection.create_index([(time_field, pymongo.ASCENDING)])
+    start_time = datetime.now(pytz.UTC).replace(microsecond=0) - timedelta(hours=1)
+    step = timedelta(hours=1) / num_docs
+    for offset in range(0, num_docs, chunk_size):
+        collection.insert_many([
+            {time_field: start_time + step * i, "level": "INFO", "Message": {"elapsed_time": i % 5000}}
+            for i in range(offset, min(offset + chunk_size, num_docs))
+        ])
+    return start_time, start_time + timedelta(hours=1)
+
+
+def time_skip_limit(collection, query, batch_size):
+    """Per-batch latency of the old count + skip/limit paging."""
+    latencies = []
+    num_batches = -(-collection.count_documents(query) // batch_size)
+    for batch in range(num_batches):
+        started = time.perf_counter()
+        list(collection.find(query).skip(batch * batch_size).limit(batch_size))
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def time_keyset(collection, time_field, start_time, end_time, batch_size):
+    """Per-batch latency of iter_batches."""
+    latencies = []
+    batches = iter_batches(collection, time_field, start_time, end_time, batch_size)
+    while True:
+        started = time.perf_counter()
+        if next(batches, None) is None:
+            break
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def bench_pagination(args):
+    """Compare skip/limit against range-cursor paging over the same window."""
+    client = MongoClient(args.uri)
+    collection = client[BENCH_DATABASE_NAME]["bench_pagination"]
+    try:
+        start_time, end_time = seed_time_collection(collection, args.docs)
+        # Open the window slightly before the first document so it is included
+        start_time -= timedelta(seconds=1)
+        query = {"InsertOn": {"$gt": start_time, "$lte": end_time}}
+        results = {}
+        for name, run in (
+            ("skip_limit", lambda: time_skip_limit(collection, query, args.batch_size)),
+            ("keyset", lambda: time_keyset(collection, "InsertOn", start_time, end_time, args.batch_size)),
+        ):
+            latencies = run()
+            results[name] = {
+                "batches": len(latencies),
+                "total_seconds": round(sum(latencies), 4),
+                "first_batch_seconds": round(latencies[0], 4) if latencies else None,
+                "last_batch_seconds": round(latencies[-1], 4) if latencies else None,
+                "per_batch_seconds": [round(latency, 4) for latency in latencies],
+            }
+        return {"benchmark": "pagination", "docs": args.docs, "batch_size": args.batch_size, "results": results}
+    finally:
+        collection.drop()
+        client.close()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # Bytes on macOS, KiB elsewhere
+
+
+def cpu_seconds():
+    """User plus system CPU time of this process (all threads) so far."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def job_args(spec, processing_time):
+    """transform_args for a five-minute window ending at processing_time, like a daemon run."""
+    return spec.transform_args(spec.sources[0], processing_time - timedelta(minutes=5), processing_time, processing_time)
+
+
+def time_job_transform(spec, docs):
+    """docs/sec of the job's transform alone, as the engine calls it."""
+    from etl_engine import apply_transform
+    args = job_args(spec, datetime.now(pytz.UTC))
+    started = time.perf_counter()
+    results = [apply_transform(spec, doc, args) for doc in docs]
+    elapsed = time.perf_counter() - started
+    return {
+        "docs_per_sec": round(len(docs) / elapsed, 1) if elapsed else None,
+        "seconds": round(elapsed, 4),
+        "skipped": sum(result is None for result in results),
+        "issues": sum(1 for result in results if result is not None and not result[1]),
+    }
+
+
+def time_job_memory(spec, docs):
+    """
+    End to end through run_pipeline with an in-memory source and sink: the read stage decodes raw
+    BSON batches and the write stage encodes the output, which is the driver's share of a real run.
+    Source documents are not projected, so jobs with large unextracted fields pay for them here.
+    With spec.raw_bson the batches stay raw and are decoded and encoded a document at a time, as
+    the engine does; with spec.batch_bytes they are cut to the byte budget (insert latency plays
+    no part, there being no inserts).
+    """
+    from etl_engine import RAW_BSON_OPTIONS, apply_transform, bson_size, decode_source, encode_target
+    batches = iter_chunks(docs, spec.batch_size)
+    if spec.batch_bytes:
+        sizer = BatchSizer(spec.batch_bytes, spec.batch_size, spec.min_batch_size)
+        batches = sizer.sized(iter_chunks(docs, sizer))
+    raw_batches = [bson.encode({"docs": batch}) for batch in batches]
+    args = job_args(spec, datetime.now(pytz.UTC))
+    sink = {"docs": 0, "bytes": 0}
+
+    def read():
+        for raw in raw_batches:
+            yield bson.decode(raw, RAW_BSON_OPTIONS)["docs"] if spec.raw_bson else bson.decode(raw)["docs"]
+
+    def transform_batch(batch):
+        target_docs = []
+        for doc in batch:
+            result = apply_transform(spec, decode_source(doc), args)
+            if result is not None:
+                target_docs.append(encode_target(result[0]) if spec.raw_bson else result[0])
+        return target_docs
+
+    def write_batch(target_docs):
+        sink["docs"] += len(target_docs)
+        sink["bytes"] += bson_size(target_docs)
+
+    cpu_started = cpu_seconds()
+    started = time.perf_counter()
+    stages = run_pipeline(read(), transform_batch, write_batch, queue_depth=spec.queue_depth, label=spec.name)
+    elapsed = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_started
+    return {
+        "docs_per_sec": round(len(docs) / elapsed, 1) if elapsed else None,
+        "cpu_us_per_doc": round(cpu / len(docs) * 1e6, 2) if docs else None,
+        "seconds": round(elapsed, 4),
+        "batches": len(raw_batches),
+        "written": sink["docs"],
+        "bytes_in": sum(len(raw) for raw in raw_batches),
+        "bytes_out": sink["bytes"],
+        "stages": stages,
+    }
+
+
+def time_job_mongo(spec, docs, uri):
+    """
+    End to end through Engine.run against scratch collections on uri, seeded with docs. The
+    job's own source and target are never touched.
+    """
+    from etl_engine import Engine
+    bench_spec = copy.copy(spec)
+    bench_spec.source_uri = bench_spec.target_uri = uri
+    bench_spec.source_db = bench_spec.target_db = BENCH_DATABASE_NAME
+    bench_spec.sources = [f"bench_{spec.name}_source"]
+    bench_spec.target = f"bench_{spec.name}_target"
+    bench_spec.issue_target = f"bench_{spec.name}_issues" if spec.issue_target else None
+
+    client = MongoClient(uri)
+    db = client[BENCH_DATABASE_NAME]
+    scratch = [bench_spec.sources[0], bench_spec.target, bench_spec.issue_target]
+    engine = Engine()
+    try:
+        for name in scratch:
+            if name:
+                db.drop_collection(name)
+        db[CHECKPOINT_COLLECTION].delete_many({"job": spec.name})
+        source = db[bench_spec.sources[0]]
+        for keys in spec.source_indexes:
+            source.create_index(keys)
+        for chunk in iter_chunks(docs, 10000):
+            source.insert_many(chunk)
+
+        started = time.perf_counter()
+        totals = engine.run(bench_spec)
+        elapsed = time.perf_counter() - started
+        return {
+            "docs_per_sec": round(len(docs) / elapsed, 1) if elapsed else None,
+            "seconds": round(elapsed, 4),
+            "written": totals["written"],
+            "issues": totals["issues"],
+            "skipped": totals["skipped"],
+            "stages": totals["stages"][bench_spec.sources[0]],
+        }
+    finally:
+        engine.close()
+        for name in scratch:
+            if name:
+                db.drop_collection(name)
+        db[CHECKPOINT_COLLECTION].delete_many({"job": spec.name})
+        client.close()
+
+
+def bench_one_job(name, num_docs, sink, uri, raw_bson=None):
+    """
+    Transform and end-to-end results for one job; run in a fresh process so peak RSS is the job's
+    own. raw_bson overrides the job's own setting when given.
+    """
+    from etl_engine import load_jobs
+    spec = load_jobs()[name]
+    if raw_bson is not None:
+        spec = copy.copy(spec)
+        spec.raw_bson = raw_bson
+    # Records are still created, but not written to the terminal or the job's log file
+    job_logger = logging.getLogger(f"etl.{name}")
+    job_logger.addHandler(logging.NullHandler())
+    job_logger.propagate = False
+    docs = spec.synthetic_docs(num_docs)
+    result = {"transform": time_job_transform(spec, docs)}
+    if sink == "mongo":
+        result["end_to_end"] = time_job_mongo(spec, docs, uri)
+    else:
+        result["end_to_end"] = time_job_memory(spec, docs)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Jobs whose docs/sec fell more than tolerance (a fraction) below the baseline run."""
+    regressions = []
+    for name, result in results.items():
+        for path in ("transform", "end_to_end"):
+            before = baseline.get("results", {}).get(name, {}).get(path, {}).get("docs_per_sec")
+            after = result[path]["docs_per_sec"]
+            if before and after and after < before * (1 - tolerance):
+                regressions.append({"job": name, "path": path, "baseline_docs_per_sec": before, "docs_per_sec": after})
+    return regressions
+
+
+def bench_jobs(args):
+    """Every job's transform and end-to-end path on its synthetic documents."""
+    from etl_engine import load_jobs
+    jobs = load_jobs()
+    names = args.jobs or [name for name, spec in jobs.items() if spec.synthetic_docs]
+    unknown = [name for name in names if name not in jobs or not jobs[name].synthetic_docs]
+    if unknown:
+        raise SystemExit(f"no synthetic documents for job(s): {', '.join(unknown)}")
+
+    results = {}
+    for name in names:
+        # One process per job: peak RSS is never shared and earlier jobs cannot warm later ones
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results[name] = executor.submit(
+                bench_one_job, name, args.docs, args.sink, args.uri, RAW_BSON_CHOICES[args.raw_bson]
+            ).result()
+    report = {"benchmark": "jobs", "docs": args.docs, "sink": args.sink, "raw_bson": args.raw_bson, "results": results}
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            report["regressions"] = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+    return report
+
+
+def layout_dashboard_pipeline(layout, time_field, group_field, start_time, end_time):
+    """Rows and mean elapsed_time per group over a time range: the dashboard's typical query, per layout."""
+    if layout == "buckets":
+        numeric = {"$filter": {"input": "$elapsed_time", "cond": {"$isNumber": "$$this"}}}
+        return [
+            {"$match": {"minute": {"$gte": truncate(start_time, "Minute"), "$lte": end_time}}},
+            {"$group": {
+                "_id": f"${group_field}", "rows": {"$sum": "$count"},
+                "total": {"$sum": {"$sum": "$elapsed_time"}}, "measured": {"$sum": {"$size": numeric}},
+            }},
+            {"$project": {"rows": 1, "mean": {"$cond": [
+                {"$eq": ["$measured", 0]}, None, {"$divide": ["$total", "$measured"]}
+            ]}}},
+        ]
+    group_path = f"$meta.{group_field}" if layout == "timeseries" else f"${group_field}"
+    return [
+        {"$match": {time_field: {"$gte": start_time, "$lte": end_time}}},
+        {"$group": {"_id": group_path, "rows": {"$sum": 1}, "mean": {"$avg": "$elapsed_time"}}},
+    ]
+
+
+def bucket_documents(storage, rows):
+    """The bucket documents storage (a "buckets" StorageLayout) would store for rows written into an empty target."""
+    buckets = {}
+    for row in rows:
+        key = tuple(row.get(field) for field in storage.meta_fields) + (truncate(row[storage.time_field], "Minute"),)
+        buckets.setdefault(key, []).append(row)
+    documents = []
+    for key, key_rows in buckets.items():
+        for bucket_rows, sizes in chunks_by_bytes(key_rows, MAX_BUCKET_BYTES):
+            document = dict(zip(storage.meta_fields, key[:-1]), _id=bson.ObjectId(), minute=key[-1])
+            document.update(count=len(bucket_rows), bytes=sum(sizes))
+            processing_times = [row["Processing_Time"] for row in bucket_rows if row.get("Processing_Time")]
+            document["Processing_Time"] = max(processing_times, default=None)
+            document["time_ranges"] = sorted({row["time_range"] for row in bucket_rows if row.get("time_range")})
+            columns = []
+            for row in bucket_rows:
+                columns.extend(field for field in row if field not in columns + storage.meta_fields + list(PER_RUN_FIELDS))
+            for field in columns:
+                document["_ids" if field == "_id" else field] = [row.get(field) for row in bucket_rows]
+            documents.append(document)
+    return documents
+
+
+def layout_client_costs(spec, rows, layout):
+    """
+    What a layout costs before the server is involved: seconds to build and BSON-encode the writes
+    for rows, bytes sent and stored (uncompressed) per row, and documents and index entries
+    stored. Time-series storage is compressed by the server, so only its writes are measured here.
+    """
+    storage = StorageLayout(layout, spec.time_field, spec.layout_meta_fields) if layout != "flat" else None
+    started = time.perf_counter()
+    if layout == "flat":
+        writes = [bson.encode(row) for row in rows]
+    elif layout == "timeseries":
+        writes = [bson.encode(storage._timeseries_doc(row)) for row in rows]
+    else:
+        # The update statements as the bulk write sends them
+        writes = [bson.encode({"q": update._filter, "u": update._doc}) for update in storage._bucket_updates(rows)]
+    encode_seconds = time.perf_counter() - started
+    costs = {
+        "encode_seconds": round(encode_seconds, 3),
+        "wire_bytes_per_row": round(sum(map(len, writes)) / len(rows), 1),
+        "stored_bytes_per_row": None, "documents": None, "largest_document_bytes": None, "index_entries": None,
+    }
+    if layout == "flat":
+        stored = writes
+        costs["index_entries"] = len(rows) * (1 + len(spec.target_indexes))  # _id and the target indexes
+    elif layout == "buckets":
+        stored = [bson.encode(document) for document in bucket_documents(storage, rows)]
+        # One _ids (multikey) entry per row; _id, meta + minute, minute and Processing_Time per bucket
+        costs["index_entries"] = len(rows) + len(stored) * 4
+    else:
+        return costs
+    costs.update(
+        stored_bytes_per_row=round(sum(map(len, stored)) / len(rows), 1), documents=len(stored),
+        largest_document_bytes=max(map(len, stored)),
+    )
+    return costs
+
+
+def bench_layouts(args):
+    """
+    Flat vs time-series vs bucket documents for one job's target rows: the client-side cost of each
+    layout's writes and, unless offline, write throughput, storage and index size and latency of a
+    dashboard aggregation, in scratch collections on uri.
+    """
+    from etl_engine import apply_transform, load_jobs
+    spec = load_jobs()[args.job]
+    if not spec.layout_meta_fields or not spec.synthetic_docs:
+        raise SystemExit(f"{args.job} declares no layout_meta_fields or synthetic documents")
+    transform_arguments = job_args(spec, datetime.now(pytz.UTC))
+    results = (apply_transform(spec, doc, transform_arguments) for doc in spec.synthetic_docs(args.docs))
+    rows = [result[0] for result in results if result is not None and result[1]]
+    times = [row[spec.time_field] for row in rows]
+    start_time, end_time = min(times), max(times)
+    group_field = spec.layout_meta_fields[0]
+
+    report = {"benchmark": "layouts", "job": spec.name, "rows": len(rows), "results": {}}
+    for layout in ("flat",) + LAYOUTS:
+        report["results"][layout] = {"client": layout_client_costs(spec, rows, layout)}
+    if args.offline:
+        return report
+    client = MongoClient(args.uri)
+    db = client[BENCH_DATABASE_NAME]
+    try:
+        for layout in ("flat",) + LAYOUTS:
+            name = f"bench_layout_{spec.name}_{layout}"
+            db.drop_collection(name)
+            collection = db[name]
+            batches = list(iter_chunks(rows, spec.batch_size))
+            started = time.perf_counter()
+            if layout == "flat":
+                # The current target indexes plus the dashboard's filters, so queries are compared fairly
+                for keys in spec.target_indexes:
+                    collection.create_index(keys)
+                collection.create_index([(field, 1) for field in spec.layout_meta_fields] + [(spec.time_field, 1)])
+                for batch in batches:
+                    collection.insert_many(batch, ordered=False)
+            else:
+                storage = StorageLayout(layout, spec.time_field, spec.layout_meta_fields)
+                storage.prepare(db, name)
+                for batch in batches:
+                    storage.insert(collection, batch)
+            write_seconds = time.perf_counter() - started
+
+            stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+            pipeline = layout_dashboard_pipeline(layout, spec.time_field, group_field, start_time, end_time)
+            latencies = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                groups = list(collection.aggregate(pipeline))
+                latencies.append(time.perf_counter() - started)
+            report["results"][layout].update({
+                "write_docs_per_sec": round(len(rows) / write_seconds, 1) if write_seconds else None,
+                "documents": stats.get("count"),
+                "storage_bytes": stats.get("storageSize"),
+                "index_bytes": stats.get("totalIndexSize"),
+                "query_median_seconds": round(statistics.median(latencies), 4),
+                "rows_counted": sum(group["rows"] for group in groups),
+            })
+        report["consistent"] = len({result["rows_counted"] for result in report["results"].values()}) == 1
+        return report
+    finally:
+        for layout in ("flat",) + LAYOUTS:
+            db.drop_collection(f"bench_layout_{spec.name}_{layout}")
+        client.close()
+
+
+def synthetic_latencies(num_values, seed=0):
+    """Latencies in seconds shaped like airline calls: a lognormal body, a slow tail and some exact zeros."""
+    rng = random.Random(seed)
+    values = []
+    for i in range(num_values):
+        if i % 200 == 0:
+            values.append(0.0)  # Cache hits logged as 0 ms
+        elif i % 50 == 0:
+            values.append(rng.lognormvariate(math.log(20.0), 0.8))  # Timeouts and retries
+        else:
+            values.append(rng.lognormvariate(math.log(0.8), 0.6))
+    return values
+
+
+def bench_sketches(args):
+    """
+    Percentiles from per-bucket sketches, serialised and merged as the engine stores them, against
+    exact percentiles of the same values. Every value must be within ALPHA relative error.
+    """
+    values = synthetic_latencies(args.docs, args.seed)
+    buckets = [values[i::args.buckets] for i in range(args.buckets)]
+    started = time.perf_counter()
+    blobs = []
+    for bucket in buckets:
+        sketch = DDSketch()
+        for value in bucket:
+            sketch.add(value)
+        blobs.append(sketch.to_bytes())
+    build_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    merged = DDSketch()
+    for blob in blobs:
+        merged.merge(DDSketch.from_bytes(blob))
+    merge_seconds = time.perf_counter() - started
+
+    ordered = sorted(values)
+    percentiles = {}
+    failures = []
+    for q in (0.5, 0.9, 0.95, 0.99, 0.999):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        estimate = merged.quantile(q)
+        error = abs(estimate - exact) / exact if exact else abs(estimate)
+        percentiles[f"p{q * 100:g}"] = {"exact": exact, "sketch": estimate, "relative_error": round(error, 6)}
+        if error > ALPHA + 1e-9:
+            failures.append(f"p{q * 100:g}")
+    return {
+        "benchmark": "sketches", "docs": args.docs, "buckets": args.buckets, "alpha": ALPHA,
+        "avg_blob_bytes": round(sum(len(blob) for blob in blobs) / len(blobs), 1),
+        "build_docs_per_sec": round(args.docs / build_seconds, 1) if build_seconds else None,
+        "merge_seconds": round(merge_seconds, 4),
+        "percentiles": percentiles,
+        "regressions": failures,
+    }
+
+
+def synthetic_travel_dates(num_docs, distinct_days, seed):
+    """travelDate strings over distinct_days days, each in a random front-end format."""
+    rng = random.Random(seed)
+    first = datetime(2025, 1, 1)
+    renderers = [
+        lambda day: day.strftime("%a-%d%b%Y"),
+        lambda day: f"{day.month}/{day.day}/{day.year} 12:00:00 AM",
+        lambda day: day.strftime("%a %b %d 00:00:00 GMT+05:30 %Y"),
+        lambda day: day.strftime("%Y-%m-%d"),
+        lambda day: day.strftime("%m-%d-%Y"),
+        lambda day: day.strftime("%d-%m-%Y"),
+    ]
+    return [
+        rng.choice(renderers)(first + timedelta(days=rng.randrange(distinct_days))) for _ in range(num_docs)
+    ]
+
+
+def bench_dates(args):
+    """ECOM travelDate standardisation: shape-dispatched and cached vs every format in turn."""
+    from job_ecom import reference_standardize_date, standardize_date
+    values = synthetic_travel_dates(args.docs, args.days, args.seed)
+    timings = {}
+    outputs = {}
+    for name, parse in (("reference", reference_standardize_date), ("standardizer", standardize_date)):
+        started = time.perf_counter()
+        outputs[name] = [parse(value) for value in values]
+        timings[name] = time.perf_counter() - started
+    mismatches = [
+        value for value, expected, actual in zip(values, outputs["reference"], outputs["standardizer"])
+        if expected != actual
+    ]
+    cache = standardize_date.cache_info()
+    return {
+        "benchmark": "dates", "docs": args.docs, "distinct_values": len(set(values)),
+        "reference_docs_per_sec": round(args.docs / timings["reference"], 1),
+        "standardizer_docs_per_sec": round(args.docs / timings["standardizer"], 1),
+        "speedup": round(timings["reference"] / timings["standardizer"], 1),
+        "cache_hit_ratio": round(cache.hits / (cache.hits + cache.misses), 4),
+        "formats": standardize_date.format_counts(),
+        "regressions": sorted(set(mismatches))[:20],
+    }
+
+
+class FakeLeaseCollection:
+    """
+    Just enough of a collection, in memory, for a LeaseStore: equality, $or and $expr filters and
+    $set pipeline updates, with $$NOW taken from the local clock as a server would from its own.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, **options):
+        pass
+
+    def _value(self, doc, expression, now):
+        if expression == "$$NOW":
+            return now
+        if isinstance(expression, str) and expression.startswith("$"):
+            return doc.get(expression[1:])
+        if isinstance(expression, dict):
+            (operator, operands), = expression.items()
+            values = [self._value(doc, operand, now) for operand in operands]
+            if operator == "$cond":
+                return values[1] if values[0] else values[2]
+            if operator == "$add":
+                return values[0] + timedelta(milliseconds=values[1])
+            return {"$eq": lambda a, b: a == b, "$lt": lambda a, b: a < b, "$gt": lambda a, b: a > b}[operator](
+                *values
+            ) if None not in values else False
+        return expression
+
+    def _matches(self, doc, query, now):
+        for field, condition in query.items():
+            if field == "$or":
+                if not any(self._matches(doc, branch, now) for branch in condition):
+                    return False
+            elif field == "$expr":
+                if not self._value(doc, condition, now):
+                    return False
+            elif doc.get(field) != condition:
+                return False
+        return True
+
+    def _update(self, doc, pipeline, now):
+        updated = dict(doc)
+        for stage in pipeline:
+            updated.update((field, self._value(doc, value, now)) for field, value in stage["$set"].items())
+        return updated
+
+    def find_one_and_update(self, query, pipeline, upsert=False, return_document=None):
+        now = datetime.utcnow()
+        with self._lock:
+            doc = self.docs.get(query["_id"])
+            if doc is not None and not self._matches(doc, query, now):
+                if upsert:
+                    raise DuplicateKeyError(f"E11000 duplicate key: {query['_id']}")
+                return None
+            if doc is None and not upsert:
+                return None
+            self.docs[query["_id"]] = self._update(doc or {"_id": query["_id"]}, pipeline, now)
+            return doc
+
+    def update_one(self, query, pipeline):
+        now = datetime.utcnow()
+        with self._lock:
+            doc = self.docs.get(query["_id"])
+            matched = doc is not None and self._matches(doc, query, now)
+            if matched:
+                self.docs[query["_id"]] = self._update(doc, pipeline, now)
+        return pymongo.results.UpdateResult({"n": int(matched)}, acknowledged=True)
+
+    def delete_one(self, query):
+        with self._lock:
+            doc = self.docs.get(query["_id"])
+            if doc is not None and self._matches(doc, query, datetime.utcnow()):
+                del self.docs[query["_id"]]
+
+    def find(self, query, projection=None):
+        with self._lock:
+            return [dict(doc) for doc in self.docs.values() if self._matches(doc, query, datetime.utcnow())]
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+
+def check_leases(args):
+    """
+    Two engines competing for one job's sources, with a short lease TTL: only one holds a source at
+    a time, heartbeats keep a lease past its TTL, a worker whose heartbeats stop loses its leases to
+    the other once they expire (and notices on its next beat), a release hands them over at once,
+    and two live workers end up with one source each. In memory, or on uri in a scratch database.
+    """
+    from etl_engine import Engine, load_jobs
+    from leases import LEASE_COLLECTION, LeaseStore
+    ttl = timedelta(seconds=args.ttl)
+    spec = copy.copy(load_jobs()["Processed_Thirdpary"])
+    spec.name = "bench_leases"
+    spec.sources = ["bench_leases_1", "bench_leases_2"]
+    spec.log_file = None
+    client = MongoClient(args.uri) if args.uri else None
+    if client:
+        db = client[BENCH_DATABASE_NAME]
+        db[LEASE_COLLECTION].delete_many({"job": spec.name})
+    else:
+        db = {LEASE_COLLECTION: FakeLeaseCollection()}
+    logger = logging.getLogger()
+    engines = []
+    for _ in range(2):
+        engine = Engine()
+        engine.sources = lambda _spec: _spec.sources  # No source database to list
+        engine._leases[(spec.target_uri, spec.target_db)] = LeaseStore(db, engine.owner, ttl=ttl, logger=logger)
+        engines.append(engine)
+    first, second = engines
+    first_leases, second_leases = (engine.leases(spec) for engine in engines)
+    keys = [LeaseStore.source_key(spec.name, source) for source in spec.sources]
+    phases = {}
+    try:
+        phases["one_holder"] = first.acquire(spec, logger) and not second.acquire(spec, logger)
+
+        time.sleep(ttl.total_seconds() * 2.5)
+        phases["heartbeat_keeps_leases"] = (
+            all(first_leases.holds(key) for key in keys) and not second.acquire(spec, logger)
+        )
+
+        with first_leases._lock:  # Stalls the heartbeat, as a paused or partitioned worker would
+            time.sleep(ttl.total_seconds() * 1.5)
+            taken_over = second.acquire(spec, logger)
+        time.sleep(ttl.total_seconds() / 3 * 2)  # The stalled worker's next beats find the leases gone
+        phases["takeover_after_expiry"] = taken_over and not any(first_leases.holds(key) for key in keys)
+        phases["loser_stays_out"] = not first.acquire(spec, logger)
+
+        second.release(spec, logger)
+        phases["release_hands_over"] = first.acquire(spec, logger)
+
+        first.release(spec, logger)
+        for engine in (first, second, first, second):  # Both live: the first gives back what is above its share
+            engine.claim_sources(spec, spec.sources, logger)
+        shares = [engine.leases(spec).held("source", spec.name) for engine in engines]
+        phases["one_source_each"] = [len(share) for share in shares] == [1, 1] and set(shares[0] + shares[1]) == set(keys)
+    finally:
+        for engine in engines:
+            engine.close()
+        if client:
+            db[LEASE_COLLECTION].delete_many({"job": spec.name})
+            client.close()
+    return {
+        "benchmark": "leases", "server": bool(args.uri), "ttl_seconds": args.ttl, "phases": phases,
+        "regressions": [phase for phase, ok in phases.items() if not ok],
+    }
+
+
+def shared_sizer_phases(num_pipelines, batches=200):
+    """
+    num_pipelines threads sharing one BatchSizer and MemoryCeiling, as a sharded source's pipelines
+    do, each reading a batch while its previous one is written: the budget stays in bounds, the
+    ceiling holds, and everything read is handed back once all is written.
+    """
+    ceiling = MemoryCeiling(4 * 1024 * 1024)
+    sizer = BatchSizer(1024 * 1024, max_rows=5000, min_rows=10, ceiling=ceiling)
+    doc = {"payload": "x" * 200}
+    peak = [0]
+
+    def pipeline(seed):
+        rng = random.Random(seed)
+        pending = 0
+        for _ in range(batches):
+            rows = sizer()
+            sizer.observe_read([doc] * rows)
+            peak[0] = max(peak[0], ceiling.in_flight)
+            if pending:
+                sizer.observe_write(pending, rng.uniform(0.1, 4.0))
+            pending = rows
+        sizer.observe_write(pending, rng.uniform(0.1, 4.0))
+
+    threads = [threading.Thread(target=pipeline, args=(seed,)) for seed in range(num_pipelines)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "sizer_budget_in_bounds": sizer.batch_bytes * MIN_BUDGET_FRACTION <= sizer.budget <= sizer.batch_bytes,
+        "ceiling_held": peak[0] <= ceiling.max_bytes,
+        "sizer_released_everything": (
+            sizer.in_flight == 0 and abs(sizer.in_flight_bytes) < 1 and ceiling.in_flight < 1
+        ),
+    }
+
+
+def failed_shard_phases(uri, num_docs):
+    """
+    Processed_Thirdpary's source window read as four time shards, on scratch collections on uri,
+    with the third shard's transform failing: the source fails, the fourth shard is still written,
+    the checkpoint stops at the end of the second, and a retry from it writes the rest.
+    """
+    from etl_engine import Engine, load_jobs
+    from leases import LEASE_COLLECTION
+    from shards import time_bounds
+    spec = copy.copy(load_jobs()["Processed_Thirdpary"])
+    spec.name = "bench_shards"
+    spec.source_uri = spec.target_uri = uri
+    spec.source_db = spec.target_db = BENCH_DATABASE_NAME
+    spec.sources = ["bench_shards_source"]
+    spec.target = "bench_shards_target"
+    spec.rollup = spec.latency_sketches = None
+    spec.log_file = None
+    spec.shards, spec.shard_split, spec.shard_min_docs = 4, "time", 1
+    spec.batch_size = spec.min_batch_size = max(1, num_docs // 40)
+    docs = spec.synthetic_docs(num_docs)
+    start_time = pytz.UTC.localize(docs[0][spec.time_field] - timedelta(milliseconds=1))
+    end_time = pytz.UTC.localize(docs[-1][spec.time_field])
+    failed_start, failed_end = time_bounds(start_time, end_time, spec.shards)[2]
+    transform = spec.transform
+
+    def failing_transform(doc, *args):
+        if failed_start < pytz.UTC.localize(doc[spec.time_field]) <= failed_end:
+            raise RuntimeError("injected shard failure")
+        return transform(doc, *args)
+
+    client = MongoClient(uri)
+    db = client[BENCH_DATABASE_NAME]
+    scratch = [spec.sources[0], spec.target]
+    engine = Engine()
+    logger = logging.getLogger()
+    phases = {}
+    try:
+        for name in scratch:
+            db.drop_collection(name)
+        db[CHECKPOINT_COLLECTION].delete_many({"job": spec.name})
+        db[LEASE_COLLECTION].delete_many({"job": spec.name})
+        db[spec.sources[0]].create_index(spec.time_field)
+        for chunk in iter_chunks(docs, 10000):
+            db[spec.sources[0]].insert_many(chunk)
+        # As stored, to the millisecond: the last row of the second shard
+        second_last = db[spec.sources[0]].find_one(
+            {spec.time_field: {"$lte": failed_start}}, sort=[(spec.time_field, pymongo.DESCENDING)]
+        )[spec.time_field]
+        engine.prepare(spec)
+        engine.acquire(spec, logger)
+
+        spec.transform = failing_transform
+        try:
+            engine.process_source(spec, spec.sources[0], start_time, end_time, end_time, None, logger)
+            phases["failed_shard_fails_source"] = False
+        except RuntimeError:
+            phases["failed_shard_fails_source"] = True
+        target = db[spec.target]
+        phases["later_shard_written"] = target.count_documents({"_id": docs[-1]["_id"]}) == 1
+        checkpoint = db[CHECKPOINT_COLLECTION].find_one({"_id": f"{spec.name}:{spec.sources[0]}"}) or {}
+        checkpointed = checkpoint.get("last_time")
+        phases["checkpoint_stops_before_failed_shard"] = (
+            checkpointed is not None and checkpointed == second_last
+        )
+
+        spec.transform = transform
+        if checkpointed is not None:
+            engine.process_source(
+                spec, spec.sources[0], pytz.UTC.localize(checkpointed), end_time, end_time, None, logger
+            )
+        phases["retry_writes_the_rest"] = target.count_documents({}) == num_docs
+    finally:
+        engine.close()
+        for name in scratch:
+            db.drop_collection(name)
+        db[CHECKPOINT_COLLECTION].delete_many({"job": spec.name})
+        db[LEASE_COLLECTION].delete_many({"job": spec.name})
+        client.close()
+    return phases
+
+
+def check_shards(args):
+    """
+    A sharded source's pipelines sharing one batch sizer, in memory; with uri, also a sharded
+    window whose middle shard fails, end to end.
+    """
+    phases = shared_sizer_phases(args.pipelines)
+    if args.uri:
+        phases.update(failed_shard_phases(args.uri, args.docs))
+    return {
+        "benchmark": "shards", "server": bool(args.uri), "phases": phases,
+        "regressions": [phase for phase, ok in phases.items() if not ok],
+    }
+
+
+def parity_one_job(spec, docs, uri=None):
+    """
+    A job's compiled transform and, given a server uri, its aggregation pipeline against its
+    reference transform (the original process_document) on docs. The pipeline runs over docs
+    seeded into a scratch collection; nothing of the job's own is touched.
+    """
+    args = job_args(spec, datetime.now(pytz.UTC))
+    compiled = benchmark_transforms(spec.reference_transform, spec.transform, docs, *args)
+    result = {"compiled_mismatches": compiled["mismatches"]}
+    if not uri or spec.aggregation_pipeline is None:
+        return result
+    client = MongoClient(uri)
+    collection = client[BENCH_DATABASE_NAME][f"bench_{spec.name}_parity"]
+    try:
+        collection.drop()
+        for chunk in iter_chunks(docs, 10000):
+            collection.insert_many(chunk)
+        result["aggregation"] = check_shaping_parity(
+            collection, {}, spec.projection,
+            lambda sample_query, sort: spec.aggregation_pipeline(sample_query, *args, sort=sort),
+            spec.reference_transform, *args, sample_size=len(docs)
+        )
+        return result
+    finally:
+        collection.drop()
+        client.close()
+
+
+def bench_parity(args):
+    """
+    Every job with a reference transform: compiled shaping (offline) and, with --uri, server-side
+    shaping against the reference, on synthetic documents.
+    """
+    from etl_engine import load_jobs
+    jobs = load_jobs()
+    names = args.jobs or [name for name, spec in jobs.items() if spec.reference_transform and spec.synthetic_docs]
+    unknown = [
+        name for name in names if name not in jobs or not (jobs[name].reference_transform and jobs[name].synthetic_docs)
+    ]
+    if unknown:
+        raise SystemExit(f"no reference transform or synthetic documents for job(s): {', '.join(unknown)}")
+    results = {name: parity_one_job(jobs[name], jobs[name].synthetic_docs(args.docs), args.uri) for name in names}
+    regressions = [
+        {"job": name, "compiled_mismatches": result["compiled_mismatches"],
+         "aggregation_mismatches": result.get("aggregation", {}).get("mismatches", 0),
+         "first_mismatch": result.get("aggregation", {}).get("first_mismatch")}
+        for name, result in results.items()
+        if result["compiled_mismatches"] or result.get("aggregation", {}).get("mismatches")
+    ]
+    return {
+        "benchmark": "parity", "docs": args.docs, "server": bool(args.uri), "results": results,
+        "regressions": regressions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    pagination = subparsers.add_parser("pagination", help="skip/limit vs range-cursor paging")
+    pagination.add_argument("--uri", default="mongodb://localhost:27017/")
+    pagination.add_argument("--docs", type=int, default=500000)
+    pagination.add_argument("--batch-size", type=int, default=50000)
+    pagination.set_defaults(run=bench_pagination)
+
+    jobs = subparsers.add_parser("jobs", help="each job's transform and end-to-end path on synthetic documents")
+    jobs.add_argument("jobs", nargs="*", help="job names (default: every job with synthetic documents)")
+    jobs.add_argument("--docs", type=int, default=50000)
+    jobs.add_argument("--sink", choices=["memory", "mongo"], default="memory")
+    jobs.add_argument("--uri", default="mongodb://localhost:27017/")
+    jobs.add_argument("--compare", help="earlier `jobs` output; exit 1 if docs/sec regressed")
+    jobs.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional drop in docs/sec")
+    jobs.add_argument("--raw-bson", choices=list(RAW_BSON_CHOICES), default="job",
+                      help="override each job's raw_bson setting")
+    jobs.set_defaults(run=bench_jobs)
+
+    sketches = subparsers.add_parser("sketches", help="merged sketch percentiles vs exact percentiles")
+    sketches.add_argument("--docs", type=int, default=1000000)
+    sketches.add_argument("--buckets", type=int, default=1440, help="sketches merged, e.g. a day of minutes")
+    sketches.add_argument("--seed", type=int, default=0)
+    sketches.set_defaults(run=bench_sketches)
+
+    dates = subparsers.add_parser("dates", help="cached, shape-dispatched travelDate parsing vs the format loop")
+    dates.add_argument("--docs", type=int, default=500000)
+    dates.add_argument("--days", type=int, default=365, help="distinct travel days")
+    dates.add_argument("--seed", type=int, default=0)
+    dates.set_defaults(run=bench_dates)
+
+    layouts = subparsers.add_parser("layouts", help="flat vs time-series vs bucket storage for a job's target")
+    layouts.add_argument("job")
+    layouts.add_argument("--uri", default="mongodb://localhost:27017/")
+    layouts.add_argument("--docs", type=int, default=200000)
+    layouts.add_argument("--repeat", type=int, default=5, help="runs of the dashboard query")
+    layouts.add_argument("--offline", action="store_true", help="only the client-side costs; no server needed")
+    layouts.set_defaults(run=bench_layouts)
+
+    leases = subparsers.add_parser("leases", help="two engines competing for a job's sources")
+    leases.add_argument("--uri", help="MongoDB to hold the leases (default: in memory)")
+    leases.add_argument("--ttl", type=float, default=1.5, help="lease TTL in seconds")
+    leases.set_defaults(run=check_leases)
+
+    shards = subparsers.add_parser("shards", help="concurrent shard pipelines: shared batch sizing and failed shards")
+    shards.add_argument("--uri", help="MongoDB for the failed-shard run (default: the batch sizer check only)")
+    shards.add_argument("--docs", type=int, default=20000)
+    shards.add_argument("--pipelines", type=int, default=8, help="threads sharing the batch sizer")
+    shards.set_defaults(run=check_shards)
+
+    parity = subparsers.add_parser("parity", help="server-side and compiled shaping vs the reference transform")
+    parity.add_argument("jobs", nargs="*", help="job names (default: every job with a reference transform)")
+    parity.add_argument("--uri", help="MongoDB to run the aggregation pipelines on (default: compiled check only)")
+    parity.add_argument("--docs", type=int, default=5000)
+    parity.set_defaults(run=bench_parity)
+
+    args = parser.parse_args()
+    report = args.run(args)
+    print(json.dumps(report, indent=2, default=str))
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
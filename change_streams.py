@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Change-stream tailing: apply a job's transform to source documents as soon as they are inserted.
+
+Inserts are collected into micro-batches (max_batch events or max_wait seconds, whichever comes
+first). The stream's resume token is saved only after a micro-batch has been written, so a restart
+continues exactly where the last write stopped. When there is no token yet, or the server no
+longer has the oplog history a token points to, a fresh stream is opened first and the job's
+windowed scan catches up behind it. Target documents are keyed by source _id, so the overlap
+between the two is harmless.
+
+Change streams need a replica set. A local single-node one is enough for testing:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+"""
+
+import logging
+import time
+
+import pymongo
+
+RESUME_TOKEN_COLLECTION = "ETL_ResumeTokens"
+
+# The token points before the oldest oplog entry: CappedPositionLost, ChangeStreamFatalError,
+# ChangeStreamHistoryLost
+HISTORY_LOST_CODES = {136, 280, 286}
+
+# How often an idle stream's advancing token is saved, so a quiet source does not age out
+IDLE_TOKEN_SAVE_SECONDS = 30
+
+
+class ResumeTokenStore:
+    """Last change-stream resume token written by a job, one document per (job, source)."""
+
+    def __init__(self, db, collection_name=RESUME_TOKEN_COLLECTION):
+        self.collection = db[collection_name]
+
+    @staticmethod
+    def _key(job, source):
+        return f"{job}:{source}"
+
+    def load(self, job, source):
+        doc = self.collection.find_one({"_id": self._key(job, source)})
+        return doc.get("token") if doc else None
+
+    def save(self, job, source, token):
+        self.collection.update_one(
+            {"_id": self._key(job, source)},
+            {"$set": {"job": job, "source": source, "token": token}, "$currentDate": {"updated_at": True}},
+            upsert=True,
+        )
+
+
+def insert_pipeline(projection=None, collections=None):
+    """
+    Change-stream pipeline that keeps only inserts, optionally only into the named collections
+    (for a database-wide stream), with fullDocument trimmed to a find() projection.
+    """
+    match = {"operationType": "insert"}
+    if collections is not None:
+        match["ns.coll"] = {"$in": list(collections)}
+    pipeline = [{"$match": match}]
+    if projection:
+        fields = {"ns": 1, "documentKey": 1, "fullDocument._id": 1}
+        fields.update({f"fullDocument.{field}": 1 for field in projection})
+        pipeline.append({"$project": fields})
+    return pipeline
+
+
+def _drain(stream, job, source, tokens, handle_batch, stop_event, max_batch, max_wait):
+    events = []
+    flushed_at = saved_at = time.monotonic()
+    saved_token = stream.resume_token
+    while True:
+        stopping = stop_event.is_set()
+        if not stopping:
+            change = stream.try_next()
+            if change is not None:
+                events.append(change)
+        now = time.monotonic()
+        if stopping or len(events) >= max_batch or now - flushed_at >= max_wait:
+            token = stream.resume_token
+            if events:
+                handle_batch(events)
+            if token is not None and token != saved_token and (events or stopping or now - saved_at >= IDLE_TOKEN_SAVE_SECONDS):
+                tokens.save(job, source, token)
+                saved_token, saved_at = token, now
+            events = []
+            flushed_at = now
+        if stopping:
+            return
+
+
+def follow(watchable, pipeline, tokens, job, source, handle_batch, catch_up, stop_event,
+           max_batch=1000, max_wait=1.0, logger=None):
+    """
+    Tail inserts on watchable (a collection or a database) until stop_event is set.
+
+    handle_batch(changes) must write a micro-batch of change events before returning. catch_up()
+    runs the job's windowed scan; it is called whenever the stream starts without a usable token.
+    """
+    logger = logger or logging.getLogger()
+    token = tokens.load(job, source)
+    while not stop_event.is_set():
+        try:
+            with watchable.watch(pipeline, resume_after=token, max_await_time_ms=int(max_wait * 1000)) as stream:
+                if token is None:
+                    # Open the stream before scanning so nothing inserted during the scan is missed
+                    logger.info(f"{job}: no usable resume token for {source}; catching up with the windowed scan")
+                    catch_up()
+                    if stream.resume_token is not None:
+                        tokens.save(job, source, stream.resume_token)
+                logger.info(f"{job}: following inserts on {source}")
+                _drain(stream, job, source, tokens, handle_batch, stop_event, max_batch, max_wait)
+                token = stream.resume_token
+        except pymongo.errors.OperationFailure as e:
+            if e.code not in HISTORY_LOST_CODES:
+                raise
+            logger.warning(f"{job}: resume token for {source} has expired ({e.code}); falling back to the windowed scan")
+            token = None
+    logger.info(f"{job}: stopped following {source}")
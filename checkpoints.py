@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Per-source checkpoints: how far into each source collection a job has committed its writes."""
+
+from datetime import timedelta
+
+import pytz
+
+CHECKPOINT_COLLECTION = "ETL_Checkpoints"
+
+# BSON dates have millisecond precision, so this is the smallest useful overlap
+MIN_LOOKBACK = timedelta(milliseconds=1)
+
+
+class CheckpointStore:
+    """High-water marks of committed source documents, one document per (job, source collection)."""
+
+    def __init__(self, db, collection_name=CHECKPOINT_COLLECTION):
+        self.collection = db[collection_name]
+
+    @staticmethod
+    def _key(job, source):
+        return f"{job}:{source}"
+
+    @staticmethod
+    def _resume_point(doc):
+        last_time = doc["last_time"]
+        if last_time.tzinfo is None:
+            last_time = last_time.replace(tzinfo=pytz.UTC)
+        return last_time, doc.get("last_id")
+
+    def load_all(self, job):
+        """Return {source: (last_time, last_id)} for every source the job has committed, in one query."""
+        return {
+            doc["source"]: self._resume_point(doc)
+            for doc in self.collection.find({"job": job, "last_time": {"$exists": True}})
+        }
+
+    def load_retry_points(self, job):
+        """Return {source: lower key} of every source whose last KeyWindow was not fully written."""
+        return {
+            doc["source"]: tuple(doc["retry_from"])
+            for doc in self.collection.find({"job": job, "retry_from": {"$exists": True}})
+        }
+
+    def set_retry_point(self, job, source, lower):
+        """
+        Record that source's KeyWindow from lower on may be missing from the target. The window
+        watermark comes from the target, so it moves past such rows once any later ones are written;
+        the next window for source starts at lower instead.
+        """
+        self.collection.update_one(
+            {"_id": self._key(job, source)},
+            {"$set": {"job": job, "source": source, "retry_from": list(lower)}},
+            upsert=True,
+        )
+
+    def clear_retry_point(self, job, source):
+        self.collection.update_one({"_id": self._key(job, source)}, {"$unset": {"retry_from": ""}})
+
+    def advance(self, job, source, last_time, last_id):
+        """
+        Record that everything up to (last_time, last_id) in source has been written.
+
+        The stored mark only ever moves forward, so re-reading an overlap that ends before the
+        current mark leaves it untouched.
+        """
+        is_ahead = {"$or": [
+            {"$eq": [{"$type": "$last_time"}, "missing"]},
+            {"$gt": [{"$literal": last_time}, "$last_time"]},
+            {"$and": [
+                {"$eq": [{"$literal": last_time}, "$last_time"]},
+                {"$gt": [{"$literal": last_id}, "$last_id"]},
+            ]},
+        ]}
+        self.collection.update_one(
+            {"_id": self._key(job, source)},
+            [{"$set": {
+                "job": job,
+                "source": source,
+                "last_time": {"$cond": [is_ahead, {"$literal": last_time}, "$last_time"]},
+                "last_id": {"$cond": [is_ahead, {"$literal": last_id}, "$last_id"]},
+                "updated_at": "$$NOW",
+            }}],
+            upsert=True,
+        )
+
+
+def resume_time(checkpoint, lookback):
+    """
+    Lower bound (exclusive) for the next window: the checkpoint time minus the lookback overlap,
+    or the checkpoint time itself for a zero lookback (jobs that cannot reject re-read rows).
+    """
+    last_time, _ = checkpoint
+    if not lookback:
+        return last_time
+    return last_time - max(lookback, MIN_LOOKBACK)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Date normalisation for fields that arrive in several front-end formats, such as ECOM travelDate.
+
+Trying strptime formats in turn raises and catches a ValueError for every format that does not
+match, on every document. A DateStandardizer instead picks the candidate formats from a cheap
+look at the string's shape, and caches results by raw string in a bounded LRU: a batch holds only
+a few hundred distinct travel dates, so nearly every call is a dictionary lookup.
+
+Every call is counted in etl_date_formats_total by the format that parsed it ("unparsed" for
+strings no format matches); the first few distinct unparsed strings are kept in .unparsed.
+"""
+
+import logging
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+from metrics import REGISTRY
+
+CACHE_SIZE = 4096
+MAX_UNPARSED_SAMPLES = 100
+UNPARSED = "unparsed"
+
+
+class DateStandardizer:
+    """
+    Callable turning a date string into output_format. shapes is a list of (test, formats):
+    the formats of the first test that accepts the string are tried in order, and strings no
+    test accepts try every format. Unparseable strings are returned unchanged.
+    """
+
+    def __init__(self, name, shapes, output_format="%d-%m-%Y", cache_size=CACHE_SIZE, registry=REGISTRY,
+                 logger=None):
+        self.name = name
+        self.shapes = [(test, list(formats)) for test, formats in shapes]
+        self.all_formats = list(dict.fromkeys(fmt for _, formats in self.shapes for fmt in formats))
+        self.output_format = output_format
+        self.logger = logger or logging.getLogger()
+        self.unparsed = set()  # Sample of distinct strings no format matched
+        self._counter = registry.counter(
+            "etl_date_formats_total", "Dates standardised, by the format that parsed them", ("parser", "format"))
+        self._lock = threading.Lock()
+        self._parse = lru_cache(maxsize=cache_size)(self._parse_uncached)
+
+    def __call__(self, date_str):
+        if not date_str:
+            return None
+        if not isinstance(date_str, str):
+            self._counter.inc(parser=self.name, format=UNPARSED)
+            return date_str
+        standardized, fmt = self._parse(date_str)
+        self._counter.inc(parser=self.name, format=fmt)
+        return standardized
+
+    def candidates(self, date_str):
+        for test, formats in self.shapes:
+            if test(date_str):
+                return formats
+        return self.all_formats
+
+    def _parse_uncached(self, date_str):
+        """(standardized string, format name) for one raw string; each distinct string parses once."""
+        for fmt in self.candidates(date_str):
+            try:
+                return datetime.strptime(date_str, fmt).strftime(self.output_format), fmt
+            except ValueError:
+                continue
+        with self._lock:
+            if len(self.unparsed) < MAX_UNPARSED_SAMPLES:
+                self.unparsed.add(date_str)
+        self.logger.warning(f"Unable to parse date: {date_str}")
+        return date_str, UNPARSED
+
+    def cache_info(self):
+        return self._parse.cache_info()
+
+    def format_counts(self):
+        """{format: calls} for this parser since the process started."""
+        counts = {fmt: self._counter.value(parser=self.name, format=fmt) for fmt in self.all_formats + [UNPARSED]}
+        return {fmt: count for fmt, count in counts.items() if count}
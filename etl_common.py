@@ -0,0 +1,548 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Helpers shared by the ETL engine and the job modules (job_*.py)."""
+
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import bson
+import pymongo
+
+# Marks the end of a pipeline stream
+_END = object()
+
+
+def iter_batches(collection, time_field, start_time, end_time, batch_size, projection=None):
+    """
+    Stream documents with start_time < time_field <= end_time in batches, ordered by time_field.
+
+    Uses a range cursor instead of skip/limit: every batch resumes from the last time_field
+    value seen and excludes the _ids already returned at that instant, so the server only
+    walks the existing time index from where the previous batch stopped.
+
+    batch_size is a row count, or a callable returning the row limit for each next batch.
+    """
+    lower_bound = {"$gt": start_time}
+    boundary_ids = []  # _ids already returned whose time_field equals the current lower bound
+
+    while True:
+        query = {time_field: {**lower_bound, "$lte": end_time}}
+        if boundary_ids:
+            query["_id"] = {"$nin": boundary_ids}
+
+        limit = batch_size() if callable(batch_size) else batch_size
+        docs = list(
+            collection.find(query, projection)
+            .sort(time_field, pymongo.ASCENDING)
+            .limit(limit)
+        )
+        if not docs:
+            return
+
+        # Resume key: the last timestamp seen plus every _id returned at that timestamp
+        last_time = docs[-1][time_field]
+        same_time_ids = []
+        for doc in reversed(docs):
+            if doc[time_field] != last_time:
+                break
+            same_time_ids.append(doc["_id"])
+        if lower_bound.get("$gte") == last_time:
+            boundary_ids.extend(same_time_ids)  # The whole batch shared one timestamp
+        else:
+            boundary_ids = same_time_ids
+        lower_bound = {"$gte": last_time}
+
+        yield docs
+
+        if len(docs) < limit:
+            return
+
+
+def build_projection(fields_to_extract, message_field="Message"):
+    """
+    Build a find() projection from a job's FIELDS_TO_EXTRACT.
+
+    Message fields become dotted paths, which MongoDB applies to every element when Message
+    is a list of subdocuments (as in the third-party logs), so the job's flattening code
+    sees the same shapes it did without a projection.
+    """
+    projection = {field: 1 for field in fields_to_extract["root"]}
+    for field in fields_to_extract["message"]:
+        projection[f"{message_field}.{field}"] = 1
+    return projection
+
+
+@lru_cache(maxsize=1024)
+def format_record_date(day):
+    """strftime("%Y-%m-%d") of a date, cached because a batch only spans a handful of days."""
+    return day.strftime("%Y-%m-%d")
+
+
+def _missing_message_get(field):
+    return None
+
+
+def _remember(table, value, normalised, max_size):
+    if len(table) >= max_size:
+        table.clear()  # Bounded by starting over; low-cardinality fields refill it within a batch
+    table[value] = normalised
+    return normalised
+
+
+def compile_cleaner(columns, defaults, upper_fields=(), cached_fields=(), cache_size=1024):
+    """
+    Generate a function doc -> dict that cleans columns in one pass, in columns order: a missing
+    or empty value becomes defaults.get(field), strings are stripped and lowercased (any value in
+    upper_fields is str()'d, stripped and uppercased) and other values are kept.
+
+    String values of cached_fields are normalised once and then looked up in a per-field dict of
+    at most cache_size entries, so every document shares one string object per distinct value.
+    """
+    namespace = {"_remember": _remember}
+    lines = ["def clean(doc):", "    get = doc.get"]
+    items = []
+    for index, field in enumerate(columns):
+        namespace[f"_default_{index}"] = defaults.get(field)
+        if field in upper_fields:
+            normalised = "str(v).strip().upper()"
+        else:
+            normalised = "(v.strip().lower() if isinstance(v, str) else v)"
+        lines.append(f"    v = get({field!r})")
+        if field in cached_fields:
+            namespace[f"_cache_{index}"] = {}
+            lines += [
+                "    if v is None or v == '':",
+                f"        v{index} = _default_{index}",
+                "    elif type(v) is str:",
+                f"        v{index} = _cache_{index}.get(v)",
+                f"        if v{index} is None:",
+                f"            v{index} = _remember(_cache_{index}, v, {normalised}, {cache_size})",
+                "    else:",
+                f"        v{index} = {normalised}",
+            ]
+        else:
+            lines.append(f"    v{index} = _default_{index} if v is None or v == '' else {normalised}")
+        items.append(f"{field!r}: v{index}")
+    lines.append("    return {" + ", ".join(items) + "}")
+
+    exec("\n".join(lines), namespace)
+    return namespace["clean"]
+
+
+def compile_extractor(fields_to_extract, converters=None, message_shape="dict", message_field="Message"):
+    """
+    Generate a function doc -> dict that flattens a job's FIELDS_TO_EXTRACT in one expression.
+
+    The generated code builds the output as a single dict literal (root fields first, then
+    Message fields, in FIELDS_TO_EXTRACT order), so it produces the same keys in the same
+    order as the jobs' field-by-field loops without interpreting the field list per document.
+    converters maps a field name to a callable(value, doc) applied to that field's value.
+
+    message_shape "dict" reads Message with doc.get("Message", {}) and lets a non-dict
+    Message raise, like the Merged_API and Reprice loops. "dict_or_list" accepts a dict or a
+    non-empty list (using its first element) and yields None for anything else, like the
+    third-party loop.
+    """
+    converters = converters or {}
+    namespace = {"_missing_message_get": _missing_message_get}
+    items = []
+    for field in fields_to_extract["root"]:
+        items.append(f"{field!r}: get({field!r})")
+    for index, field in enumerate(fields_to_extract["message"]):
+        value = f"message_get({field!r})"
+        if field in converters:
+            namespace[f"_convert_{index}"] = converters[field]
+            value = f"_convert_{index}({value}, doc)"
+        items.append(f"{field!r}: {value}")
+
+    lines = ["def extract(doc):", "    get = doc.get"]
+    if message_shape == "dict":
+        lines.append(f"    message_get = get({message_field!r}, {{}}).get")
+    elif message_shape == "dict_or_list":
+        lines += [
+            f"    message = get({message_field!r})",
+            "    if isinstance(message, dict):",
+            "        message_get = message.get",
+            "    elif isinstance(message, list) and message:",
+            "        message_get = message[0].get",
+            "    else:",
+            "        message_get = _missing_message_get",
+        ]
+    else:
+        raise ValueError(f"Unknown message_shape: {message_shape}")
+    lines.append("    return {" + ", ".join(items) + "}")
+
+    exec("\n".join(lines), namespace)
+    return namespace["extract"]
+
+
+def build_shaping_pipeline(query, projection, fields_to_extract, extra_fields, converters=None,
+                           field_types=None, message_shape="dict", message_field="Message",
+                           sort=None, keep_id=False, merge_into=None, passthrough_only=False):
+    """
+    Aggregation pipeline that performs a job's flattening on the source server.
+
+    Shaped documents come out exactly as the Python transform builds them: FIELDS_TO_EXTRACT
+    in order (missing values as null), converters applied, then extra_fields appended in order.
+    converters maps a Message field to a function(expression) -> expression, and extra_fields
+    maps a name to an expression over the shaped fields. Documents the server cannot shape
+    identically (message_shape or field_types not matching what the Python code accepts) are
+    passed through as {"_raw": <source document>} for the Python transform to handle.
+
+    keep_id puts the source _id first in each shaped document. merge_into={"db": ..., "coll": ...}
+    writes the shaped documents with $merge (skipping _ids already in the target) instead of
+    returning them; passthrough_only returns only the {"_raw": ...} documents.
+    """
+    converters = converters or {}
+    field_types = field_types or {}
+
+    if message_shape == "dict":
+        message = f"${message_field}"
+        shapeable = [{"$in": [{"$type": f"${message_field}"}, ["object", "missing"]]}]
+    elif message_shape == "dict_or_list":
+        message = {"$cond": [
+            {"$isArray": f"${message_field}"}, {"$arrayElemAt": [f"${message_field}", 0]}, f"${message_field}"
+        ]}
+        shapeable = [{"$or": [
+            {"$not": [{"$isArray": f"${message_field}"}]},
+            {"$in": [{"$type": "$$message"}, ["object", "missing"]]},
+        ]}]
+    else:
+        raise ValueError(f"Unknown message_shape: {message_shape}")
+    for field, types in field_types.items():
+        shapeable.append({"$in": [{"$type": f"$$message.{field}"}, types]})
+
+    shaped = {"_id": "$_id"} if keep_id else {}
+    for field in fields_to_extract["root"]:
+        shaped[field] = {"$ifNull": [f"${field}", None]}
+    for field in fields_to_extract["message"]:
+        value = {"$ifNull": [f"$$message.{field}", None]}
+        shaped[field] = converters[field](value) if field in converters else value
+
+    pipeline = [{"$match": query}]
+    if sort:
+        pipeline.append({"$sort": sort})
+    pipeline += [
+        {"$project": projection},
+        {"$replaceRoot": {"newRoot": {"$let": {
+            "vars": {"message": message},
+            "in": {"$cond": [{"$and": shapeable}, shaped, {"_raw": "$$ROOT"}]},
+        }}}},
+    ]
+    if passthrough_only:
+        return pipeline + [{"$match": {"_raw": {"$exists": True}}}]
+
+    pipeline.append({"$replaceRoot": {"newRoot": {"$cond": [
+        {"$eq": [{"$type": "$_raw"}, "missing"]}, {"$mergeObjects": ["$$ROOT", extra_fields]}, "$$ROOT"
+    ]}}})
+    if merge_into:
+        pipeline += [
+            {"$match": {"_raw": {"$exists": False}}},
+            {"$merge": {"into": merge_into, "whenMatched": "keepExisting", "whenNotMatched": "insert"}},
+        ]
+    return pipeline
+
+
+def check_shaping_parity(collection, query, projection, build_pipeline, transform, *args, sample_size=1000):
+    """
+    Run the same sample of source documents through transform(doc, *args) and through
+    build_pipeline(query, sort) on the server, and compare the BSON of every shaped result.
+    """
+    docs = list(collection.find(query, projection).sort("_id", pymongo.ASCENDING).limit(sample_size))
+    sample_query = {"_id": {"$in": [doc["_id"] for doc in docs]}}
+    shaped_docs = list(collection.aggregate(build_pipeline(sample_query, {"_id": pymongo.ASCENDING})))
+
+    results = {"sampled": len(docs), "server_shaped": 0, "passed_through": 0, "mismatches": 0}
+    for doc, shaped in zip(docs, shaped_docs):
+        if "_raw" in shaped:
+            results["passed_through"] += 1
+            continue
+        results["server_shaped"] += 1
+        expected = transform(doc, *args)
+        if isinstance(expected, tuple):  # (document, success) pairs
+            expected = expected[0]
+        if expected is None or bson.encode(expected) != bson.encode(shaped):  # None: Python skips the document
+            results["mismatches"] += 1
+            results.setdefault("first_mismatch", {"_id": str(doc["_id"]), "python": expected, "server": shaped})
+    return results
+
+
+def benchmark_transforms(reference, compiled, docs, *args):
+    """
+    Time reference(doc, *args) against compiled(doc, *args) over docs and check that both
+    produce byte-for-byte identical BSON. Returns docs/sec for each and the speedup.
+    """
+    results = {}
+    for name, transform in (("reference", reference), ("compiled", compiled)):
+        started = time.perf_counter()
+        outputs = [transform(doc, *args) for doc in docs]
+        elapsed = time.perf_counter() - started
+        results[name] = {"outputs": outputs, "docs_per_sec": round(len(docs) / elapsed, 1) if elapsed else None}
+
+    mismatches = 0
+    for expected, actual in zip(results["reference"].pop("outputs"), results["compiled"].pop("outputs")):
+        if expected is None or actual is None:  # A skipped document matches only another skip
+            if expected is not actual:
+                mismatches += 1
+            continue
+        if isinstance(expected, tuple):  # (document, success) pairs
+            expected, actual = {"doc": expected[0], "ok": expected[1]}, {"doc": actual[0], "ok": actual[1]}
+        if bson.encode(expected) != bson.encode(actual):
+            mismatches += 1
+
+    results["docs"] = len(docs)
+    results["mismatches"] = mismatches
+    if results["reference"]["docs_per_sec"] and results["compiled"]["docs_per_sec"]:
+        results["speedup"] = round(results["compiled"]["docs_per_sec"] / results["reference"]["docs_per_sec"], 2)
+    return results
+
+
+def report_transfer_bytes(collection, batches, logger=None):
+    """
+    Pass batches read with a projection through unchanged, logging per batch the bytes
+    received against the size of the full source documents.
+
+    The full size is computed server-side with $bsonSize, so measuring it does not pull the
+    unprojected documents over the network. Costs one extra aggregation per batch.
+    """
+    logger = logger or logging.getLogger()
+    for docs in batches:
+        projected_bytes = sum(len(bson.encode(doc)) for doc in docs)
+        result = list(collection.aggregate([
+            {"$match": {"_id": {"$in": [doc["_id"] for doc in docs]}}},
+            {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}},
+        ]))
+        full_bytes = result[0]["bytes"] if result else 0
+        saved = 100.0 * (1 - projected_bytes / full_bytes) if full_bytes else 0.0
+        logger.info(
+            f"{collection.name}: batch of {len(docs)} documents transferred {projected_bytes} bytes "
+            f"with projection vs {full_bytes} bytes without ({saved:.1f}% saved)"
+        )
+        yield docs
+
+
+def estimate_window_count(collection, time_field, start_time, end_time, probe=timedelta(minutes=1), limit=100000):
+    """
+    Rough number of documents with start_time < time_field <= end_time, for progress reporting.
+
+    Counts only the most recent probe interval of the window (a short range of the time index,
+    capped at limit keys) and scales it by the window length, instead of counting the window.
+    """
+    window = end_time - start_time
+    probe_start = max(start_time, end_time - probe)
+    probe_count = collection.count_documents({time_field: {"$gt": probe_start, "$lte": end_time}}, limit=limit)
+    return int(probe_count * (window / (end_time - probe_start))) if end_time > probe_start else 0
+
+
+def format_time_range(start_time, end_time):
+    """The jobs' IST display string for a UTC window, e.g. "10:00:00 - 10:05:00 (IST)"."""
+    ist_start_time = start_time + timedelta(hours=5, minutes=30)
+    ist_end_time = end_time + timedelta(hours=5, minutes=30)
+    return f"{ist_start_time.strftime('%H:%M:%S')} - {ist_end_time.strftime('%H:%M:%S')} (IST)"
+
+
+def format_progress(label, done, estimate=None):
+    """Progress line from the counters a job already keeps, with a percentage when an estimate is known."""
+    if estimate:
+        return f"{label}: {done} documents processed so far (~{min(100.0, 100.0 * done / estimate):.0f}% of ~{estimate})"
+    return f"{label}: {done} documents processed so far"
+
+
+def resume_key(docs, time_field):
+    """(time_field, _id) of the last source document in a batch, looking inside {"_raw": ...} pass-throughs."""
+    last = docs[-1]
+    last = last.get("_raw", last)
+    return last[time_field], last["_id"]
+
+
+def latest_key(docs, time_field):
+    """Largest (time_field, _id) among docs that have a datetime time_field, or None; docs may be in any order."""
+    keys = [(doc[time_field], doc["_id"]) for doc in docs if isinstance(doc.get(time_field), datetime)]
+    return max(keys) if keys else None
+
+
+def synthetic_timestamps(num_docs, span=timedelta(minutes=5)):
+    """num_docs naive UTC datetimes spread evenly over the last span, for the synthetic document generators."""
+    start_time = datetime.utcnow() - span
+    step = span / max(num_docs, 1)
+    return [start_time + step * i for i in range(num_docs)]
+
+
+def synthetic_payload(tag, size):
+    """A repetitive XML-like string of about size bytes, standing in for a logged request or response body."""
+    element = f"<{tag} org=\"DEL\" des=\"BOM\" fare=\"4521.00\" cabin=\"Y\"/>"
+    return f"<{tag}s>" + element * max(1, size // len(element)) + f"</{tag}s>"
+
+
+def insert_new_docs(collection, docs):
+    """
+    insert_many that skips documents whose _id is already in the collection, so re-reading an
+    overlap never duplicates rows. Returns the documents actually inserted.
+    """
+    try:
+        collection.insert_many(docs, ordered=False)
+        return docs
+    except pymongo.errors.BulkWriteError as bwe:
+        write_errors = bwe.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in write_errors):
+            raise
+        duplicates = {error["index"] for error in write_errors}
+        return [doc for index, doc in enumerate(docs) if index not in duplicates]
+
+
+def iter_chunks(cursor, chunk_size):
+    """
+    Group the documents of a cursor into lists of at most chunk_size documents; chunk_size may be
+    a callable returning the size of each next chunk.
+    """
+    size_of_next = chunk_size if callable(chunk_size) else lambda: chunk_size
+    chunk = []
+    limit = size_of_next()
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= limit:
+            yield chunk
+            chunk = []
+            limit = size_of_next()
+    if chunk:
+        yield chunk
+
+
+def run_pipeline(batches, transform, write, queue_depth=2, label="pipeline", logger=None):
+    """
+    Run read -> transform -> write with each stage in its own thread, connected by bounded queues.
+
+    batches is any iterable of source batches (it is consumed in the reader thread), transform
+    maps a source batch to whatever write expects, and write runs in the calling thread. While
+    batch N is being written, batch N+1 is transformed and batch N+2 read. The first exception
+    raised by any stage stops the others and is re-raised here.
+
+    Returns per-stage busy seconds and batch counts plus average/max queue depths, which are
+    also logged (to logger, default the root logger) so the bottleneck stage is visible.
+    """
+    read_queue = queue.Queue(maxsize=queue_depth)
+    write_queue = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    errors = []
+    stats = {stage: {"busy_seconds": 0.0, "batches": 0} for stage in ("read", "transform", "write")}
+    depths = {"read_queue": [], "write_queue": []}
+
+    def put(q, name, item):
+        """Block until item is queued; give up if another stage failed."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            depths[name].append(q.qsize())
+            return True
+        return False
+
+    def get(q):
+        """Block for the next item; return _END if another stage failed."""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def reader():
+        try:
+            iterator = iter(batches)
+            while True:
+                started = time.perf_counter()
+                batch = next(iterator, _END)
+                if batch is _END:
+                    break
+                stats["read"]["busy_seconds"] += time.perf_counter() - started
+                stats["read"]["batches"] += 1
+                if not put(read_queue, "read_queue", batch):
+                    return
+            put(read_queue, "read_queue", _END)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def transformer():
+        try:
+            while True:
+                batch = get(read_queue)
+                if batch is _END:
+                    break
+                started = time.perf_counter()
+                result = transform(batch)
+                stats["transform"]["busy_seconds"] += time.perf_counter() - started
+                stats["transform"]["batches"] += 1
+                if not put(write_queue, "write_queue", result):
+                    return
+            put(write_queue, "write_queue", _END)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [
+        threading.Thread(target=reader, name=f"{label}-read", daemon=True),
+        threading.Thread(target=transformer, name=f"{label}-transform", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            result = get(write_queue)
+            if result is _END:
+                break
+            started = time.perf_counter()
+            write(result)
+            stats["write"]["busy_seconds"] += time.perf_counter() - started
+            stats["write"]["batches"] += 1
+    except Exception as e:
+        errors.append(e)
+    finally:
+        # Upstream stages have already finished on success; otherwise this releases them
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    for name, samples in depths.items():
+        stats[name] = {
+            "avg_depth": round(sum(samples) / len(samples), 2) if samples else 0.0,
+            "max_depth": max(samples, default=0),
+            "capacity": queue_depth,
+        }
+
+    (logger or logging.getLogger()).info(
+        f"{label} pipeline: read {stats['read']['busy_seconds']:.2f}s, "
+        f"transform {stats['transform']['busy_seconds']:.2f}s, "
+        f"write {stats['write']['busy_seconds']:.2f}s busy over {stats['write']['batches']} batches; "
+        f"read queue avg {stats['read_queue']['avg_depth']}/{queue_depth}, "
+        f"write queue avg {stats['write_queue']['avg_depth']}/{queue_depth}"
+    )
+
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def combine_pipeline_stats(stats_list):
+    """One run_pipeline result for pipelines that ran side by side: busy seconds and batches add up."""
+    combined = {
+        stage: {
+            "busy_seconds": sum(stats[stage]["busy_seconds"] for stats in stats_list),
+            "batches": sum(stats[stage]["batches"] for stats in stats_list),
+        }
+        for stage in ("read", "transform", "write")
+    }
+    for name in ("read_queue", "write_queue"):
+        combined[name] = {
+            "avg_depth": round(sum(stats[name]["avg_depth"] for stats in stats_list) / len(stats_list), 2),
+            "max_depth": max(stats[name]["max_depth"] for stats in stats_list),
+            "capacity": stats_list[0][name]["capacity"],
+        }
+    return combined
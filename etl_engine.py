@@ -0,0 +1,1176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Declarative ETL engine: every job is a JobSpec (declared in the job_*.py modules and registered in
+jobs.py) and runs on the same reader/transform/writer core, checkpoints and scheduler. One process
+can host any number of jobs; they share one pooled MongoClient per server.
+
+    python etl_engine.py list
+    python etl_engine.py run Merged_API_Airline Processed_Thirdpary
+    python etl_engine.py daemon                       # every job, each on its own interval
+    python etl_engine.py follow Processed_Repricing   # change-stream tailing
+    python etl_engine.py benchmark-transform Processed_Thirdpary
+    python etl_engine.py check-aggregation-parity Merged_API_Airline
+    python etl_engine.py daemon --metrics-port 9108   # Prometheus metrics at :9108/metrics
+    python etl_engine.py rebuild-rollups Merged_API_Airline --hours 24
+    python etl_engine.py index-report Processed_Thirdpary
+    python etl_engine.py percentiles Merged_API_Airline elapsed_time --by org des --group org=DEL des=BOM
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import bson
+import pymongo
+import pytz
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+
+import indexes
+import rollups
+import sketches
+from batching import BatchSizer, MemoryCeiling, current_rss_bytes
+from layouts import StorageLayout
+from change_streams import ResumeTokenStore, follow, insert_pipeline
+from checkpoints import CheckpointStore, resume_time
+from etl_common import (
+    benchmark_transforms, check_shaping_parity, combine_pipeline_stats, estimate_window_count, format_progress,
+    format_time_range, insert_new_docs, iter_batches, iter_chunks, latest_key, report_transfer_bytes, resume_key,
+    run_pipeline
+)
+from leases import LeaseStore, worker_id
+from metrics import REGISTRY, ETLMetrics, serve, timed_batches, write_textfile_every
+from scheduler import Scheduler, refresh_every, run_mode, stop_on_signals
+from shards import SHARD_SPLITS, clock_key_windows, count_window, index_time_bounds, splits_in_time, time_bounds
+from windows import KeyWindow, event_time
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+MAX_POOL_SIZE = 16  # Connections per server, shared by every job and worker thread in the process
+LIST_COLLECTIONS_TTL = 600  # Seconds between re-listing a source database's collections
+METRICS_FILE_INTERVAL = 15  # Seconds between rewrites of --metrics-file
+LOOKBACK_FRACTION = 12  # Default checkpoint_lookback: this fraction of the interval (10 s of two minutes)
+
+
+class JobSpec:
+    """
+    Everything that is specific to one job; the engine supplies reading, batching, writing,
+    checkpoints and scheduling.
+
+    transform(doc, *transform_args(source, start_time, end_time, processing_time)) returns the
+    target document, a (document, success) pair (failures go to issue_target), or None to skip
+    the source document. Jobs with a time_field read keyset batches and resume from per-source
+    checkpoints; jobs without one supply window(target, processing_time, logger) -> (query,
+    start_time) instead, where query is a filter or a windows.KeyWindow (one index range).
+
+    dedup "source_id" keys every target document by its source _id so re-reads are rejected by the
+    target's unique _id index on insert (and counted as duplicates); "existing_ids" looks up each
+    batch's _ids in the target and skips those already there before transforming. Either way the
+    source is read once and memory does not grow with the window. Each window re-reads
+    checkpoint_lookback (by default a twelfth of the interval) behind the checkpoint to catch late
+    rows, so a job with dedup None must set it to zero and resumes strictly after its checkpoint.
+
+    rollup (a rollups.Rollup) keeps per-minute and per-hour aggregates of the target up to date
+    from the documents each batch actually inserted; latency_sketches (a sketches.LatencySketches)
+    does the same for percentile sketches. storage_layout "timeseries" or "buckets" stores target
+    rows bucketed by layout_meta_fields instead of one document per row (see layouts.py).
+
+    target_indexes are built in the background on first use; source_indexes are only checked.
+    The first windowed query on each source is explained, and plan_check decides whether a
+    COLLSCAN, an unbounded index scan or a scan of an index other than the window's is logged
+    ("warn"), fails the source ("fail") or goes unchecked ("off").
+
+    raw_bson reads batches as RawBSONDocuments (undecoded bytes; the projection already limits
+    them to the extracted fields), decodes each document only as the transform reaches it and
+    encodes each output straight back to BSON, so neither a decoded source batch nor a batch of
+    output dicts is ever held in memory; insert_many sends the encoded bytes as they are.
+
+    batch_bytes sizes batches by a byte budget instead of a fixed row count, adapted to the
+    observed document size and insert latency; max_rss_mb caps the job's in-flight source bytes,
+    across all its sources and shards, and readers block at the cap (see batching.py).
+
+    shards > 1 splits each source's window, once it holds at least 2 * shard_min_docs documents,
+    into disjoint sub-ranges read, transformed and written concurrently (see shards.py). Progress is
+    logged per shard. Once every shard has finished, the checkpoint advances over the leading shards
+    that were written in full, up to the first that failed; a window job instead keeps the first
+    failed shard's lower key (the whole window's, unsharded) as the source's retry point, and its
+    next window starts there. max_workers * shards pipelines must fit in the connection pool
+    (MAX_POOL_SIZE per server).
+
+    Workers coordinate through leases in the target database (see leases.py): each run processes
+    only the sources this worker holds a lease on, up to its share among the job's live workers.
+    """
+
+    def __init__(self, name, source_uri, source_db, sources, target_uri, target_db, target,
+                 transform, transform_args, time_field=None, window=None, projection=None,
+                 issue_target=None, dedup="source_id", reference_transform=None,
+                 aggregation_pipeline=None, synthetic_docs=None, log_file=None,
+                 target_indexes=([("Processing_Time", pymongo.DESCENDING)],), batch_size=50000,
+                 cursor_batch_size=None, queue_depth=2, max_workers=1,
+                 checkpoint_lookback=None, measure_transfer_bytes=False,
+                 aggregation_mode=False, estimate_progress=False, interval=timedelta(minutes=2),
+                 follow_max_batch=1000, follow_max_wait=1.0, measure_bytes=False, rollup=None,
+                 latency_sketches=None, storage_layout="flat", layout_meta_fields=(), source_indexes=None,
+                 plan_check="warn", raw_bson=False, batch_bytes=None, min_batch_size=1000,
+                 target_insert_seconds=2.0, max_rss_mb=None, shards=1, shard_split="index", shard_min_docs=100000):
+        if time_field is None and window is None:
+            raise ValueError(f"{name}: a job needs a time_field or a window function")
+        if dedup not in (None, "source_id", "existing_ids"):
+            raise ValueError(f"{name}: unknown dedup policy {dedup!r}")
+        if checkpoint_lookback is None:
+            checkpoint_lookback = interval / LOOKBACK_FRACTION
+        if dedup is None and checkpoint_lookback > timedelta(0):
+            raise ValueError(f"{name}: checkpoint_lookback re-reads rows already written; it needs a dedup policy")
+        if plan_check not in indexes.PLAN_CHECKS:
+            raise ValueError(f"{name}: unknown plan_check {plan_check!r}")
+        if aggregation_mode and (aggregation_pipeline is None or time_field is None):
+            raise ValueError(f"{name}: aggregation_mode needs an aggregation_pipeline and a time_field")
+        if storage_layout != "flat" and (time_field is None or (aggregation_mode and source_uri == target_uri)):
+            raise ValueError(f"{name}: a {storage_layout} layout needs a time_field and rows written from Python")
+        if latency_sketches and aggregation_mode and source_uri == target_uri:
+            raise ValueError(f"{name}: documents merged server-side never reach the latency sketches; drop one of them")
+        if raw_bson and (aggregation_mode or storage_layout != "flat"):
+            raise ValueError(f"{name}: raw_bson applies to plain reads into a flat target only")
+        if max_rss_mb and not batch_bytes:
+            raise ValueError(f"{name}: max_rss_mb is enforced by adaptive batch sizing; set batch_bytes too")
+        if shard_split not in SHARD_SPLITS:
+            raise ValueError(f"{name}: unknown shard_split {shard_split!r}")
+        if shards > 1 and aggregation_mode:
+            raise ValueError(f"{name}: shards apply to plain reads; aggregation_mode reads each window in one pipeline")
+        # Each concurrent pipeline holds a reader and a writer connection, from one pool when both are one server
+        connections = max_workers * shards * (2 if source_uri == target_uri else 1)
+        if connections > MAX_POOL_SIZE:
+            raise ValueError(
+                f"{name}: max_workers * shards pipelines need {connections} connections to a server, "
+                f"more than the pool's {MAX_POOL_SIZE}"
+            )
+        self.name = name
+        self.source_uri = source_uri
+        self.source_db = source_db
+        self.sources = list(sources)
+        self.target_uri = target_uri
+        self.target_db = target_db
+        self.target = target
+        self.transform = transform
+        self.transform_args = transform_args
+        self.time_field = time_field
+        self.window = window
+        self.projection = projection
+        self.issue_target = issue_target
+        self.dedup = dedup
+        self.reference_transform = reference_transform  # Slow, obviously-correct transform for benchmarks
+        self.aggregation_pipeline = aggregation_pipeline  # Server-side equivalent of transform
+        self.synthetic_docs = synthetic_docs  # num_docs -> list of realistic source documents
+        self.log_file = log_file
+        self.target_indexes = target_indexes
+        self.batch_size = batch_size
+        self.cursor_batch_size = cursor_batch_size
+        self.queue_depth = queue_depth  # Batches buffered between the read, transform and write stages
+        self.max_workers = max_workers  # Source collections processed concurrently
+        self.checkpoint_lookback = checkpoint_lookback  # Re-read this far behind the checkpoint to catch late rows
+        self.measure_transfer_bytes = measure_transfer_bytes  # Log projected vs full bytes per batch
+        self.aggregation_mode = aggregation_mode  # Flatten documents on the source server instead of in Python
+        self.estimate_progress = estimate_progress  # Estimate window size to report progress as a percentage
+        self.interval = interval  # Time between run starts in daemon mode
+        self.follow_max_batch = follow_max_batch  # In follow mode, write after this many inserts...
+        self.follow_max_wait = follow_max_wait  # ...or after this many seconds, whichever comes first
+        self.measure_bytes = measure_bytes  # Count BSON bytes in and out for the metrics (one encode per document)
+        self.rollup = rollup  # rollups.Rollup maintained from every document inserted into target
+        self.latency_sketches = latency_sketches  # sketches.LatencySketches, likewise
+        # "flat" (one document per row), or "timeseries"/"buckets" grouped by layout_meta_fields
+        self.storage_layout = None if storage_layout == "flat" else StorageLayout(
+            storage_layout, time_field, layout_meta_fields
+        )
+        self.layout_meta_fields = list(layout_meta_fields)
+        # Indexes the windowed query needs on every source (checked, never created), by default time_field
+        if source_indexes is None:
+            source_indexes = [[(time_field, pymongo.ASCENDING)]] if time_field else []
+        self.source_indexes = [list(keys) for keys in source_indexes]
+        self.plan_check = plan_check  # "warn" or "fail" when a source's windowed query plan is wrong
+        self.raw_bson = raw_bson  # Hold batches as raw BSON; decode one document at a time, write pre-encoded
+        # Size batches by bytes instead of rows (batch_size becomes the row cap); see batching.py
+        self.batch_bytes = batch_bytes
+        self.min_batch_size = min_batch_size
+        self.target_insert_seconds = target_insert_seconds  # Batches shrink when a target insert takes longer
+        self.max_rss_mb = max_rss_mb  # Ceiling on the job's in-flight batches; readers block while it is reached
+        # Split a source's window into up to shards concurrent sub-ranges of at least shard_min_docs each
+        self.shards = shards
+        self.shard_split = shard_split
+        self.shard_min_docs = shard_min_docs
+
+
+def job_logger(spec):
+    """The job's logger, appending to spec.log_file as well as the console."""
+    logger = logging.getLogger(f"etl.{spec.name}")
+    logger.setLevel(logging.INFO)
+    if spec.log_file and not logger.handlers:
+        file_handler = logging.FileHandler(spec.log_file, mode="a")
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(file_handler)
+    return logger
+
+
+def apply_transform(spec, source_doc, args):
+    """Run spec.transform on one source document; returns (document, success) or None to skip it."""
+    result = spec.transform(source_doc, *args)
+    if result is None:
+        return None
+    new_doc, success = result if isinstance(result, tuple) else (result, True)
+    if spec.dedup == "source_id":
+        new_doc["_id"] = source_doc["_id"]  # Keyed by the source _id so re-reads are skipped
+    return new_doc, success
+
+
+def stored_ids(collection, ids):
+    """The subset of ids (one batch's worth) already present as _ids in collection."""
+    return {doc["_id"] for doc in collection.find({"_id": {"$in": ids}}, {"_id": 1})}
+
+
+def bson_size(docs):
+    return sum(len(doc.raw) if isinstance(doc, RawBSONDocument) else len(bson.encode(doc)) for doc in docs)
+
+
+RAW_BSON_OPTIONS = bson.CodecOptions(document_class=RawBSONDocument)
+
+
+def decode_source(doc):
+    """A source document as the transforms expect it: raw BSON is decoded to nested dicts, once."""
+    return bson.decode(doc.raw) if isinstance(doc, RawBSONDocument) else doc
+
+
+def encode_target(doc):
+    """An output document encoded once, here, so insert_many sends its bytes without re-encoding."""
+    return RawBSONDocument(bson.encode(doc))
+
+
+def derived_fields(spec):
+    """Target fields the job's rollups and latency sketches read, so they can be kept past encoding."""
+    fields = set()
+    if spec.rollup:
+        fields.update(spec.rollup.fields())
+    if spec.latency_sketches:
+        fields.update([spec.latency_sketches.time_field] + spec.latency_sketches.fields)
+        fields.update(dimension for grouping in spec.latency_sketches.groupings for dimension in grouping)
+    return sorted(fields)
+
+
+def lag_seconds(last_time):
+    """Seconds between now and a source timestamp (naive datetimes are UTC, as PyMongo returns them)."""
+    if last_time.tzinfo is None:
+        last_time = last_time.replace(tzinfo=pytz.UTC)
+    return (datetime.now(pytz.UTC) - last_time).total_seconds()
+
+
+class Engine:
+    """Runs JobSpecs. Every job in the process shares one pooled MongoClient per server URI."""
+
+    def __init__(self, max_pool_size=MAX_POOL_SIZE, metrics=None):
+        self.max_pool_size = max_pool_size
+        self.metrics = metrics or ETLMetrics()
+        self.completed_until = {}  # job -> {source: end of the last window fully written}
+        self._clients = {}
+        self._collection_listers = {}
+        self._prepared = set()
+        self._plans_checked = set()
+        self._leases = {}
+        self._ceilings = {}
+        self._lock = threading.RLock()
+        self.owner = worker_id()
+
+    def client(self, uri):
+        with self._lock:
+            if uri not in self._clients:
+                self._clients[uri] = MongoClient(uri, maxPoolSize=self.max_pool_size)
+            return self._clients[uri]
+
+    def source_db(self, spec):
+        return self.client(spec.source_uri)[spec.source_db]
+
+    def target_db(self, spec):
+        return self.client(spec.target_uri)[spec.target_db]
+
+    def checkpoints(self, spec):
+        return CheckpointStore(self.target_db(spec))
+
+    def leases(self, spec):
+        """The LeaseStore of the job's target database, shared by every job writing there."""
+        key = (spec.target_uri, spec.target_db)
+        with self._lock:
+            if key not in self._leases:
+                self._leases[key] = LeaseStore(self.target_db(spec), self.owner)
+            return self._leases[key]
+
+    def memory_ceiling(self, spec, logger):
+        """The job's MemoryCeiling, shared by all its sources and shards, or None without max_rss_mb."""
+        if not spec.max_rss_mb:
+            return None
+        with self._lock:
+            if spec.name not in self._ceilings:
+                self._ceilings[spec.name] = MemoryCeiling(spec.max_rss_mb * 1024 * 1024, logger)
+            return self._ceilings[spec.name]
+
+    def close(self):
+        with self._lock:
+            for leases in self._leases.values():
+                leases.close()
+            self._leases.clear()
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+            self._collection_listers.clear()
+
+    def prepare(self, spec):
+        """
+        One-time setup per job and process: start building missing target indexes, create the
+        rollup and sketch indexes, and warn about sources missing the indexes their query needs.
+        """
+        if spec.name in self._prepared:
+            return
+        logger = job_logger(spec)
+        target = self.target_db(spec)[spec.target]
+        if spec.storage_layout:
+            spec.storage_layout.prepare(self.target_db(spec), spec.target)
+        else:
+            indexes.create_in_background(target, spec.target_indexes, logger)
+        for source in self.sources(spec):
+            for keys in indexes.missing_indexes(self.source_db(spec)[source], spec.source_indexes):
+                logger.warning(f"{source} has no index on {indexes.key_fields(keys)}; its windowed reads will scan")
+        if spec.rollup:
+            rollups.prepare(spec.rollup, self.target_db(spec), spec.target)
+        if spec.latency_sketches:
+            sketches.prepare(spec.latency_sketches, self.target_db(spec), spec.target)
+        self._prepared.add(spec.name)
+
+    def sources(self, spec):
+        """spec.sources that exist in the source database, re-listed at most every LIST_COLLECTIONS_TTL seconds."""
+        key = (spec.source_uri, spec.source_db)
+        with self._lock:
+            if key not in self._collection_listers:
+                self._collection_listers[key] = refresh_every(LIST_COLLECTIONS_TTL)(
+                    self.client(spec.source_uri)[spec.source_db].list_collection_names
+                )
+            list_collections = self._collection_listers[key]
+        existing = set(list_collections())
+        return [source for source in spec.sources if source in existing]
+
+    def freshness(self, spec):
+        """Time up to which every source of the job has been written (the slowest source wins)."""
+        return min(self.completed_until.get(spec.name, {}).values(), default=None)
+
+    def acquire(self, spec, logger):
+        """Lease every source of the job, as change-stream following needs; False when another worker holds one."""
+        if not self.leases(spec).claim_all(spec.name, self.sources(spec)):
+            logger.info("Another worker holds some of this job's sources. Exiting.")
+            return False
+        logger.info(f"Leased every source as {self.owner}")
+        return True
+
+    def release(self, spec, logger):
+        """Hand back the job's leases so other workers can take its sources at once."""
+        self.leases(spec).release_job(spec.name)
+        logger.info("Leases released")
+
+    def claim_sources(self, spec, sources, logger):
+        """The sources this run should process: this worker's share of them, by lease."""
+        claimed = self.leases(spec).claim_sources(spec.name, sources)
+        self.metrics.sources_claimed.set(len(claimed), job=spec.name)
+        if len(claimed) < len(sources):
+            logger.info(f"Processing {len(claimed)} of {len(sources)} source collections; other workers hold the rest")
+        return claimed
+
+    def start_times(self, spec, sources, processing_time, logger):
+        """
+        Start of each source's window: its checkpoint minus the lookback, or for sources without a
+        checkpoint the latest Processing_Time in the target (the last 10 minutes on a first run).
+        """
+        resume_points = self.checkpoints(spec).load_all(spec.name)
+        start_times = {
+            source: resume_time(resume_points[source], spec.checkpoint_lookback)
+            for source in sources if source in resume_points
+        }
+        if len(start_times) < len(sources):
+            target = self.target_db(spec)[spec.target]
+            if spec.storage_layout:
+                latest_time = spec.storage_layout.latest_processing_time(target)
+            else:
+                latest_doc = target.find_one(sort=[("Processing_Time", pymongo.DESCENDING)])
+                latest_time = latest_doc.get("Processing_Time") if latest_doc else None
+            if latest_time:
+                default_start_time = latest_time.replace(tzinfo=pytz.UTC)
+                logger.info(f"Latest Processing_Time found: {default_start_time.isoformat()}")
+            else:
+                default_start_time = processing_time - timedelta(minutes=10)
+                logger.info(f"No previous documents found in {spec.target}, using default 10-minute range")
+            for source in sources:
+                start_times.setdefault(source, default_start_time)
+        return start_times
+
+    def run(self, spec, sources=None):
+        """
+        One windowed run: everything each source received since it was last written. Returns the
+        document totals and each source's stage timings; raises if a source failed. sources, when
+        given, are already leased by the caller (a follower catching up) and are processed as they
+        are; otherwise this worker claims its share of the job's sources.
+        """
+        logger = job_logger(spec)
+        self.prepare(spec)
+        started = time.perf_counter()
+        processing_time = datetime.now(pytz.UTC)
+        logger.info(f"--- Start of Run at {processing_time.strftime('%Y-%m-%d %H:%M:%S UTC')} ---")
+        end_time = processing_time
+
+        if sources is None:
+            sources = self.claim_sources(spec, self.sources(spec), logger)
+        if not sources:
+            logger.info("--- Nothing to do: every source collection is leased by another worker ---")
+            return {"written": 0, "issues": 0, "skipped": 0, "stages": {}}
+        retry_points = {}  # source -> lower key of a KeyWindow it last failed to write
+        if spec.time_field:
+            start_times = self.start_times(spec, sources, processing_time, logger)
+            queries = {source: None for source in sources}
+        else:
+            query, start_time = spec.window(self.target_db(spec)[spec.target], processing_time, logger)
+            start_times = {source: start_time for source in sources}
+            queries = {source: query for source in sources}
+            if isinstance(query, KeyWindow):
+                # The next window starts past whatever any source wrote, so a source whose last window
+                # failed restarts from the first key it may be missing
+                retry_points = self.checkpoints(spec).load_retry_points(spec.name)
+                for source in sources:
+                    lower = retry_points.get(source)
+                    if lower is not None and lower[:2] < query.lower[:2]:
+                        queries[source] = KeyWindow(query.index, lower, query.upper)
+                        start_times[source] = pytz.UTC.localize(event_time(*lower[:2]))
+                        logger.info(f"{source}: retrying from {lower[0]} {lower[1]} (IST), where its last window failed")
+
+        # Adjust for IST (UTC+5:30) for display
+        ist_tz = pytz.timezone("Asia/Kolkata")
+        earliest = min((start for start in start_times.values() if start is not None), default=None)
+        if earliest is not None:
+            logger.info(
+                f"Time range for query: {earliest.astimezone(ist_tz).isoformat()} to "
+                f"{end_time.astimezone(ist_tz).isoformat()} (IST)"
+            )
+
+        # Process sources concurrently; counts are merged here, in the calling thread
+        totals = {"written": 0, "issues": 0, "skipped": 0}
+        stages = {}  # source -> run_pipeline stage timings
+        failed = []
+        unwritten = {}  # source -> lower key of the first shard a sharded KeyWindow read left unwritten
+        completed_until = self.completed_until.setdefault(spec.name, {})
+        with ThreadPoolExecutor(max_workers=spec.max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self.process_source, spec, source, start_times[source], end_time, processing_time,
+                    queries[source], logger, unwritten
+                ): source
+                for source in sources
+            }
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    counts = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to process collection {source}: {str(e)}")
+                    self.metrics.source_failures.inc(job=spec.name, source=source)
+                    completed_until.setdefault(source, start_times[source] or processing_time)
+                    failed.append(source)
+                    if isinstance(queries[source], KeyWindow):
+                        self.checkpoints(spec).set_retry_point(
+                            spec.name, source, unwritten.get(source, queries[source].lower)
+                        )
+                    continue
+                completed_until[source] = end_time
+                if source in retry_points:
+                    self.checkpoints(spec).clear_retry_point(spec.name, source)
+                for key in ("written", "issues", "skipped"):
+                    totals[key] += counts[key]
+                stages[source] = counts["stages"]
+
+        logger.info("Processing complete!")
+        logger.info(f"Total documents processed (stored in {spec.target}): {totals['written']}")
+        if spec.issue_target:
+            logger.info(f"Total documents not processed (stored in {spec.issue_target}): {totals['issues']}")
+        if totals["skipped"]:
+            logger.info(f"Total documents skipped: {totals['skipped']}")
+        logger.info(f"--- End of Run at {datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S UTC')} ---")
+        self.metrics.run_seconds.observe(time.perf_counter() - started, job=spec.name)
+        self.metrics.runs.inc(job=spec.name, status="failed" if failed else "ok")
+        if failed:
+            raise RuntimeError(f"{spec.name}: {len(failed)} source collection(s) failed: {', '.join(sorted(failed))}")
+        totals["stages"] = stages
+        return totals
+
+    def process_source(self, spec, source, start_time, end_time, processing_time, query, logger, unwritten=None):
+        """
+        Read, transform and write one source collection's window; returns the document counts and
+        stage timings. When some shards of a KeyWindow fail, unwritten[source] is set to the lower
+        key of the first of them.
+        """
+        collection = self.source_db(spec)[source]
+        target = self.target_db(spec)[spec.target]
+        issue_target = self.target_db(spec)[spec.issue_target] if spec.issue_target else None
+        checkpoints = self.checkpoints(spec)
+        leases = self.leases(spec)
+        lease = leases.source_key(spec.name, source)
+        metrics = self.metrics
+        labels = {"job": spec.name, "source": source}
+        if spec.time_field:
+            query = {spec.time_field: {"$gt": start_time, "$lte": end_time}}  # $gt: the start was already written
+        args = spec.transform_args(source, start_time, end_time, processing_time)
+
+        # Stream until the cursor is exhausted; the size of the window is only ever estimated
+        time_range = format_time_range(start_time, end_time) if start_time else "since last record"
+        estimate = None
+        if spec.estimate_progress and spec.time_field:
+            estimate = estimate_window_count(collection, spec.time_field, start_time, end_time)
+        estimate_note = f", ~{estimate} documents" if estimate is not None else ""
+        logger.info(f"Processing collection: {source} (Time Range: {time_range}{estimate_note})")
+
+        if isinstance(query, KeyWindow) and not query.usable(collection):
+            logger.warning(f"{source}: no index {query.index}; reading the window with a filter instead")
+            query = query.as_query()
+        self.check_plan(spec, collection, query, logger)
+
+        counts = {"read": 0, "written": 0, "issues": 0, "skipped": 0, "duplicates": 0}
+        sizer = BatchSizer(
+            spec.batch_bytes, spec.batch_size, spec.min_batch_size, spec.target_insert_seconds,
+            self.memory_ceiling(spec, logger), logger=logger,
+        ) if spec.batch_bytes else None
+        batch_size = sizer or spec.batch_size
+        kept_fields = derived_fields(spec) if spec.raw_bson else None
+
+        def transform_batch(docs):
+            started = time.perf_counter()
+            target_docs = []
+            issue_docs = []
+            derived_docs = [] if kept_fields else None  # What rollups and sketches read of each encoded target doc
+            skipped = 0
+            existing_ids = None
+            if spec.dedup == "existing_ids":
+                existing_ids = stored_ids(target, [doc.get("_raw", doc)["_id"] for doc in docs])
+            for doc in docs:
+                if spec.aggregation_mode and "_raw" not in doc:
+                    target_docs.append(doc)  # Already shaped by the source server
+                    continue
+                source_doc = doc.get("_raw", doc) if spec.aggregation_mode else decode_source(doc)
+                if existing_ids is not None and source_doc["_id"] in existing_ids:
+                    skipped += 1
+                    continue
+                result = apply_transform(spec, source_doc, args)
+                if result is None:
+                    skipped += 1
+                elif not result[1]:
+                    issue_docs.append(result[0])
+                elif spec.raw_bson:
+                    target_docs.append(encode_target(result[0]))
+                    if kept_fields:
+                        derived_docs.append({field: result[0].get(field) for field in kept_fields})
+                else:
+                    target_docs.append(result[0])
+            metrics.transform_seconds_per_doc.observe((time.perf_counter() - started) / len(docs), **labels)
+            metrics.batch_documents.observe(len(docs), **labels)
+            if spec.measure_bytes:
+                metrics.bytes_read.inc(bson_size(docs), **labels)
+            last_key = resume_key(docs, spec.time_field) if spec.time_field else None
+            return target_docs, issue_docs, skipped, last_key, derived_docs
+
+        def writer(progress, label, progress_estimate=None, commit=True, sketch_buffer=None):
+            """
+            write_batch for one pipeline, adding to progress (counts for the whole window or one of its
+            shards); commit advances the checkpoint after each batch, otherwise the last key is kept.
+            Shards collect their latency sketches in sketch_buffer instead of storing them per batch.
+            """
+            def write_batch(result):
+                target_docs, issue_docs, skipped, last_key, derived_docs = result
+                if not leases.holds(lease):
+                    raise RuntimeError(f"{source}: lease lost to another worker; stopping before writing more")
+
+                # Bulk insert, skipping rows already written
+                started = time.perf_counter()
+                written = len(self.insert(
+                    spec, target, target_docs, labels, is_target=True, derived_docs=derived_docs,
+                    sketch_buffer=sketch_buffer,
+                ))
+                insert_seconds = time.perf_counter() - started
+                issues = len(self.insert(spec, issue_target, issue_docs, labels))
+
+                # Only advance the checkpoint once the batch is safely written
+                if last_key and commit:
+                    checkpoints.advance(spec.name, source, *last_key)
+                    metrics.watermark_lag.set(lag_seconds(last_key[0]), **labels)
+                elif last_key:
+                    progress["last_key"] = last_key
+
+                progress["written"] += written
+                progress["issues"] += issues
+                progress["skipped"] += skipped
+                progress["duplicates"] += len(target_docs) - written
+                progress["read"] += len(target_docs) + len(issue_docs) + skipped
+                metrics.documents_written.inc(written, **labels)
+                metrics.issue_documents.inc(issues, **labels)
+                metrics.skipped_documents.inc(skipped, **labels)
+                metrics.duplicate_documents.inc(len(target_docs) - written, **labels)
+                metrics.documents_read.inc(len(target_docs) + len(issue_docs) + skipped, **labels)
+                if sizer:
+                    sizer.observe_write(len(target_docs) + len(issue_docs) + skipped, insert_seconds if target_docs else None)
+                    metrics.batch_budget_bytes.set(sizer.budget, **labels)
+                    metrics.rss_bytes.set(current_rss_bytes(), job=spec.name)
+                logger.info(format_progress(label, progress["read"], progress_estimate))
+
+            return write_batch
+
+        def read_batches(range_start, range_end, range_query):
+            """Batches of one plain (not aggregation_mode) read of the window or one of its shards."""
+            reader = collection.with_options(codec_options=RAW_BSON_OPTIONS) if spec.raw_bson else collection
+            if spec.time_field:
+                # Keyset batches, resuming each read from the last (time_field, _id) seen
+                batches = iter_batches(
+                    reader, spec.time_field, range_start, range_end, batch_size, projection=spec.projection
+                )
+                if spec.measure_transfer_bytes:
+                    batches = report_transfer_bytes(collection, batches, logger)
+            else:
+                if isinstance(range_query, KeyWindow):
+                    cursor = range_query.find(reader, spec.projection)
+                else:
+                    cursor = reader.find(range_query, spec.projection)
+                cursor = cursor.batch_size(spec.cursor_batch_size or spec.batch_size)
+                batches = iter_chunks(cursor, batch_size)
+            return batches
+
+        def instrumented(batches):
+            batches = timed_batches(batches, metrics.read_seconds, **labels)
+            return sizer.sized(batches) if sizer else batches
+
+        same_deployment = spec.source_uri == spec.target_uri
+        latest = None
+        shards = [(start_time, end_time, query)]
+        if spec.aggregation_mode and same_deployment:
+            # Shape and insert server-side, then stream only what the server passed through
+            if spec.rollup:
+                logger.warning(f"{source}: documents merged server-side are not rolled up; use rebuild-rollups")
+            latest = collection.find_one(query, {spec.time_field: 1}, sort=[(spec.time_field, pymongo.DESCENDING)])
+            collection.aggregate(spec.aggregation_pipeline(
+                query, *args, keep_id=True, merge_into={"db": spec.target_db, "coll": spec.target}
+            ), allowDiskUse=True)
+            logger.info(f"{source}: shaped documents merged into {spec.target} server-side")
+            batches = iter_chunks(collection.aggregate(spec.aggregation_pipeline(
+                query, *args, sort={spec.time_field: pymongo.ASCENDING}, passthrough_only=True
+            ), allowDiskUse=True), batch_size)
+        elif spec.aggregation_mode:
+            # Stream documents already shaped by the source server, in time order for checkpointing
+            batches = iter_chunks(collection.aggregate(spec.aggregation_pipeline(
+                query, *args, sort={spec.time_field: pymongo.ASCENDING}, keep_id=True
+            ), allowDiskUse=True), batch_size)
+        else:
+            shards = self.shard_ranges(spec, collection, start_time, end_time, query, logger)
+            batches = read_batches(*shards[0]) if len(shards) == 1 else None
+
+        try:
+            if len(shards) == 1:
+                counts["stages"] = run_pipeline(
+                    instrumented(batches), transform_batch, writer(counts, source, estimate),
+                    queue_depth=spec.queue_depth, label=source, logger=logger
+                )
+            else:
+                # Every shard runs its own read/transform/write pipeline; counts are combined once all are written
+                shard_counts = [{key: 0 for key in counts} for _ in shards]
+                # Sketch documents are read, merged and replaced, so concurrent shards must not store them
+                sketch_buffer = sketches.SketchBuffer(spec.latency_sketches, source) if spec.latency_sketches else None
+
+                def run_shard(number):
+                    label = f"{source} [shard {number + 1}/{len(shards)}]"
+                    shard_counts[number]["stages"] = run_pipeline(
+                        instrumented(read_batches(*shards[number])), transform_batch,
+                        writer(shard_counts[number], label, commit=False, sketch_buffer=sketch_buffer),
+                        queue_depth=spec.queue_depth, label=label, logger=logger
+                    )
+                    return shard_counts[number]
+
+                failures = {}  # shard number -> exception
+                try:
+                    with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix=f"{source}-shard") as executor:
+                        futures = {executor.submit(run_shard, number): number for number in range(len(shards))}
+                        for future in as_completed(futures):
+                            try:
+                                future.result()
+                            except Exception as e:
+                                failures[futures[future]] = e
+                finally:
+                    # Whatever was inserted stays inserted (a re-read rejects it as duplicate), so store its sketches
+                    if sketch_buffer is not None:
+                        started = time.perf_counter()
+                        sketch_buffer.flush(self.target_db(spec), spec.target)
+                        metrics.insert_seconds.observe(
+                            time.perf_counter() - started, target=f"{spec.target}_Sketch", **labels
+                        )
+                for key in ("read", "written", "issues", "skipped", "duplicates"):
+                    counts[key] = sum(shard[key] for shard in shard_counts)
+                for number, shard in enumerate(shard_counts):
+                    status = f" (failed: {failures[number]})" if number in failures else ""
+                    logger.info(
+                        f"{source} shard {number + 1}/{len(shards)}: {shard['read']} read, {shard['written']} written{status}"
+                    )
+                # Only the shards before the first failure are committed: a later shard's rows do not
+                # cover the failed one's, so the retry has to start where it did
+                first_failed = min(failures, default=len(shards))
+                last_keys = [shard["last_key"] for shard in shard_counts[:first_failed] if shard.get("last_key")]
+                if last_keys:
+                    checkpoints.advance(spec.name, source, *max(last_keys))
+                    metrics.watermark_lag.set(lag_seconds(max(last_keys)[0]), **labels)
+                if failures:
+                    if isinstance(query, KeyWindow) and unwritten is not None:
+                        unwritten[source] = shards[first_failed][2].lower
+                    raise failures[first_failed]
+                counts["stages"] = combine_pipeline_stats([shard["stages"] for shard in shard_counts])
+                counts["shards"] = shard_counts
+        finally:
+            if sizer:
+                sizer.close()  # Hand back what a failed pipeline still held against the job's ceiling
+        if latest:
+            checkpoints.advance(spec.name, source, latest[spec.time_field], latest["_id"])
+            metrics.watermark_lag.set(lag_seconds(latest[spec.time_field]), **labels)
+
+        # Summary for this source
+        if counts["read"] == 0:
+            logger.info(f"No documents to process in {source} for the time range")
+        logger.info(f"Collection {source} processed:")
+        logger.info(f" - Successfully stored in {spec.target}: {counts['written']}")
+        if spec.issue_target:
+            logger.info(f" - Stored in {spec.issue_target}: {counts['issues']}")
+        if counts["skipped"]:
+            logger.info(f" - Skipped: {counts['skipped']}")
+        if counts["duplicates"]:
+            logger.info(f" - Already in {spec.target}: {counts['duplicates']}")
+        return counts
+
+    def shard_ranges(self, spec, collection, start_time, end_time, query, logger):
+        """
+        [(start_time, end_time, query)] per shard: the window split into disjoint sub-ranges when it
+        holds at least 2 * shard_min_docs documents, otherwise the window itself. Only time_field
+        windows and clock-index KeyWindows can be split.
+        """
+        whole = [(start_time, end_time, query)]
+        if isinstance(query, KeyWindow):
+            splittable = splits_in_time(query)
+        else:
+            splittable = spec.time_field is not None
+        if spec.shards <= 1 or not splittable:
+            return whole
+        # Counting stops at shards * shard_min_docs keys: enough to decide, never the whole window
+        cap = spec.shards * spec.shard_min_docs
+        num_docs = count_window(collection, spec.time_field, start_time, end_time, query, limit=cap)
+        count = min(spec.shards, num_docs // spec.shard_min_docs)
+        if count <= 1:
+            return whole
+        if isinstance(query, KeyWindow):
+            shards = [(start_time, end_time, window) for window in clock_key_windows(query, count)]
+        elif spec.shard_split == "time":
+            shards = [(start, end, None) for start, end in time_bounds(start_time, end_time, count)]
+        else:
+            shards = [
+                (start, end, None) for start, end in index_time_bounds(
+                    collection, spec.time_field, start_time, end_time, count, spec.shard_min_docs
+                )
+            ]
+        at_least = "at least " if num_docs >= cap else ""
+        logger.info(
+            f"{collection.name}: {at_least}{num_docs} documents in the window; reading {len(shards)} shards concurrently"
+        )
+        return shards
+
+    def check_plan(self, spec, collection, query, logger):
+        """Explain the first windowed query on each source (see JobSpec.plan_check)."""
+        key = (spec.name, collection.name)
+        if spec.plan_check == "off" or key in self._plans_checked:
+            return
+        # The read as process_source runs it: keyset batches in time order, or one cursor over the window
+        sort = [(spec.time_field, pymongo.ASCENDING)] if spec.time_field else None
+        limit = spec.batch_size if spec.time_field else None
+        index_fields = query.fields if isinstance(query, KeyWindow) else [spec.time_field] if spec.time_field else None
+        indexes.check_plan(
+            collection, query, sort, limit, policy=spec.plan_check, logger=logger, index_fields=index_fields
+        )
+        with self._lock:
+            self._plans_checked.add(key)  # Only once it passed or was warned about, so "fail" re-checks
+
+    def index_report(self, spec):
+        """Required indexes, $indexStats usage and windowed query plans for the job's sources and target."""
+        processing_time = datetime.now(pytz.UTC)
+        target = self.target_db(spec)[spec.target]
+        if spec.time_field:
+            query = {spec.time_field: {"$gt": processing_time - spec.interval, "$lte": processing_time}}
+        else:
+            query, _ = spec.window(target, processing_time, job_logger(spec))
+        sort = [(spec.time_field, pymongo.ASCENDING)] if spec.time_field else None
+        result = {"sources": {}, "target": indexes.report(target, [] if spec.storage_layout else spec.target_indexes)}
+        for source in self.sources(spec):
+            result["sources"][source] = indexes.report(
+                self.source_db(spec)[source], spec.source_indexes, query, sort, spec.batch_size if spec.time_field else None
+            )
+        return result
+
+    def insert(self, spec, collection, docs, labels, is_target=False, derived_docs=None, sketch_buffer=None):
+        """
+        insert_new_docs with the insert latency and output bytes recorded; returns the documents inserted.
+        Rows for the job's target are written in its storage layout and folded into its rollups and
+        latency sketches, which read derived_docs (parallel to docs) instead when docs are encoded.
+        With a sketch_buffer the sketches are only collected, to be stored once by its caller.
+        """
+        if not docs:
+            return []
+        started = time.perf_counter()
+        if is_target and spec.storage_layout:
+            inserted = spec.storage_layout.insert(collection, docs)
+        else:
+            inserted = insert_new_docs(collection, docs)
+        self.metrics.insert_seconds.observe(time.perf_counter() - started, target=collection.name, **labels)
+        if spec.measure_bytes:
+            self.metrics.bytes_written.inc(bson_size(docs), **labels)
+        if derived_docs is not None:
+            inserted_ids = {id(doc) for doc in inserted}
+            inserted = [derived for doc, derived in zip(docs, derived_docs) if id(doc) in inserted_ids]
+        if is_target and spec.rollup:
+            started = time.perf_counter()
+            rollups.apply(spec.rollup, self.target_db(spec), spec.target, inserted)
+            self.metrics.insert_seconds.observe(time.perf_counter() - started, target=f"{spec.target}_Rollup", **labels)
+        if is_target and spec.latency_sketches and sketch_buffer is not None:
+            sketch_buffer.add(inserted)
+        elif is_target and spec.latency_sketches:
+            started = time.perf_counter()
+            sketches.apply(spec.latency_sketches, self.target_db(spec), spec.target, labels["source"], inserted)
+            self.metrics.insert_seconds.observe(time.perf_counter() - started, target=f"{spec.target}_Sketch", **labels)
+        return inserted
+
+    def rebuild_rollups(self, spec, start_time, end_time):
+        """Recompute the job's rollups for [start_time, end_time) from its target collection."""
+        if spec.rollup is None:
+            raise ValueError(f"{spec.name} has no rollup")
+        self.prepare(spec)
+        return rollups.rebuild(
+            spec.rollup, self.target_db(spec), spec.target, start_time, end_time, logger=job_logger(spec)
+        )
+
+    def percentiles(self, spec, field, start_time, end_time, grouping, group=None, granularity="Minute",
+                    quantiles=(0.5, 0.9, 0.95, 0.99)):
+        """Percentiles of field over [start_time, end_time) from the job's latency sketches."""
+        if spec.latency_sketches is None:
+            raise ValueError(f"{spec.name} has no latency sketches")
+        sketch = sketches.query(
+            spec.latency_sketches, self.target_db(spec), spec.target, field, start_time, end_time,
+            grouping, group, granularity
+        )
+        result = {f"p{round(q * 100, 1):g}": sketch.quantile(q) for q in quantiles}
+        result.update({"count": sketch.count, "mean": sketch.mean(), "relative_accuracy": sketch.alpha})
+        return result
+
+    def follow(self, spec, stop_event):
+        """Write inserts into the job's sources in micro-batches as they happen, until stop_event is set."""
+        logger = job_logger(spec)
+        self.prepare(spec)
+        sources = self.sources(spec)
+        target = self.target_db(spec)[spec.target]
+        issue_target = self.target_db(spec)[spec.issue_target] if spec.issue_target else None
+        checkpoints = self.checkpoints(spec)
+        completed_until = self.completed_until.setdefault(spec.name, {})
+        window = {"start": datetime.now(pytz.UTC)}
+
+        def handle_batch(changes):
+            processing_time = datetime.now(pytz.UTC)
+            start_time, window["start"] = window["start"], processing_time
+            docs_by_source = {}
+            for change in changes:
+                docs_by_source.setdefault(change["ns"]["coll"], []).append(change["fullDocument"])
+            for source, docs in docs_by_source.items():
+                labels = {"job": spec.name, "source": source}
+                args = spec.transform_args(source, start_time, processing_time, processing_time)
+                target_docs = []
+                issue_docs = []
+                for doc in docs:
+                    result = apply_transform(spec, doc, args)
+                    if result is None:
+                        continue
+                    (target_docs if result[1] else issue_docs).append(result[0])
+                self.metrics.documents_written.inc(len(self.insert(spec, target, target_docs, labels, is_target=True)), **labels)
+                self.metrics.issue_documents.inc(len(self.insert(spec, issue_target, issue_docs, labels)), **labels)
+                self.metrics.documents_read.inc(len(docs), **labels)
+                # Keep the checkpoints current so a fallback to the windowed scan starts from here
+                latest = latest_key(docs, spec.time_field) if spec.time_field else None
+                if latest:
+                    checkpoints.advance(spec.name, source, *latest)
+                    self.metrics.watermark_lag.set(lag_seconds(latest[0]), **labels)
+                completed_until[source] = processing_time
+            logger.info(f"Followed {len(changes)} inserts across {len(docs_by_source)} collections")
+
+        if len(spec.sources) > 1:
+            # One database-wide stream covers every source collection
+            watchable = self.source_db(spec)
+            stream_source = spec.source_db
+            pipeline = insert_pipeline(spec.projection, collections=sources)
+        else:
+            watchable = self.source_db(spec)[spec.sources[0]]
+            stream_source = spec.sources[0]
+            pipeline = insert_pipeline(spec.projection)
+        follow(
+            watchable, pipeline, ResumeTokenStore(self.target_db(spec)), spec.name, stream_source,
+            handle_batch, lambda: self.run(spec, sources=sources), stop_event,
+            max_batch=spec.follow_max_batch, max_wait=spec.follow_max_wait, logger=logger
+        )
+
+    def benchmark_transform(self, spec, num_docs=50000):
+        """Compare docs/sec of the job's reference and compiled transforms on synthetic documents."""
+        if spec.reference_transform is None or spec.synthetic_docs is None:
+            raise ValueError(f"{spec.name} has no reference transform or synthetic documents to benchmark")
+        processing_time = datetime.now(pytz.UTC)
+        args = spec.transform_args(spec.sources[0], processing_time - timedelta(minutes=5), processing_time, processing_time)
+        return benchmark_transforms(spec.reference_transform, spec.transform, spec.synthetic_docs(num_docs), *args)
+
+    def check_aggregation_parity(self, spec, sample_size=1000):
+        """
+        Compare transform with aggregation_pipeline on the last day of documents from every source.
+        `benchmarks.py parity` checks both against reference_transform on synthetic documents instead.
+        """
+        if spec.aggregation_pipeline is None:
+            raise ValueError(f"{spec.name} has no aggregation pipeline")
+        processing_time = datetime.now(pytz.UTC)
+        start_time = processing_time - timedelta(days=1)
+        query = {spec.time_field: {"$gt": start_time, "$lte": processing_time}}
+        results = {}
+        for source in self.sources(spec):
+            args = spec.transform_args(source, start_time, processing_time, processing_time)
+            results[source] = check_shaping_parity(
+                self.source_db(spec)[source], query, spec.projection,
+                lambda sample_query, sort: spec.aggregation_pipeline(sample_query, *args, sort=sort),
+                spec.transform, *args, sample_size=sample_size
+            )
+        return results
+
+
+def load_jobs():
+    """{name: JobSpec} for every registered job."""
+    from jobs import JOBS
+    return JOBS
+
+
+_default_engine = None
+
+
+def default_engine():
+    """The process-wide Engine, so every job started in this process shares its clients."""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = Engine()
+        atexit.register(_default_engine.close)
+    return _default_engine
+
+
+def configure_logging():
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+
+def start_metrics(port=None, path=None):
+    """Expose REGISTRY on an HTTP port and/or rewrite it to a text file; returns a function that stops both."""
+    server = serve(port) if port else None
+    file_writer = write_textfile_every(path, METRICS_FILE_INTERVAL) if path else None
+
+    def stop():
+        if server:
+            server.shutdown()
+            server.server_close()
+        if file_writer:
+            file_writer.set()
+            REGISTRY.write_textfile(path)  # The final values, even if the writer thread is mid-wait
+    return stop
+
+
+def flag_value(argv, flag):
+    """The value given after flag on the command line, or None."""
+    if flag in argv and argv.index(flag) + 1 < len(argv):
+        return argv[argv.index(flag) + 1]
+    return None
+
+
+def run_jobs(engine, specs):
+    """One windowed run of each job in turn; returns the number of jobs that failed."""
+    failures = 0
+    for spec in specs:
+        logger = job_logger(spec)
+        try:
+            engine.run(spec)
+        except Exception as e:
+            logger.error(f"An error occurred: {str(e)}")
+            failures += 1
+        finally:
+            engine.release(spec, logger)
+    return failures
+
+
+def run_daemon(engine, specs):
+    """Run every job on its own interval until SIGTERM/SIGINT."""
+    scheduler = Scheduler()
+    try:
+        for spec in specs:
+            scheduler.add_job(
+                spec.name, lambda spec=spec: engine.run(spec), spec.interval,
+                freshness=lambda spec=spec: engine.freshness(spec), prepare=lambda spec=spec: engine.prepare(spec)
+            )
+        scheduler.install_signal_handlers()
+        return scheduler.run_forever()
+    finally:
+        for spec in specs:
+            engine.release(spec, job_logger(spec))
+
+
+def run_followers(engine, specs):
+    """Tail every job's sources with change streams until SIGTERM/SIGINT."""
+    stop_event = stop_on_signals()
+    held = [spec for spec in specs if engine.acquire(spec, job_logger(spec))]
+
+    def follow_job(spec):
+        try:
+            engine.follow(spec, stop_event)
+        except Exception as e:
+            job_logger(spec).error(f"Following stopped: {str(e)}")
+
+    threads = [threading.Thread(target=follow_job, args=(spec,), name=f"follow-{spec.name}", daemon=True) for spec in held]
+    try:
+        for thread in threads:
+            thread.start()
+        # Wait in short slices so signal handlers run promptly in the main thread
+        while any(thread.is_alive() for thread in threads):
+            stop_event.wait(1)
+            if stop_event.is_set():
+                for thread in threads:
+                    thread.join()
+    finally:
+        for spec in held:
+            engine.release(spec, job_logger(spec))
+
+
+def run_script(job_name, argv):
+    """
+    Entry point for the notebook exports: run one job with the notebooks' command-line flags
+    (--benchmark-transform, --check-aggregation-parity, --daemon JOB, --follow JOB, and
+    --metrics-port PORT / --metrics-file PATH for any of them).
+    """
+    configure_logging()
+    spec = load_jobs()[job_name]
+    engine = default_engine()
+    logger = job_logger(spec)
+    port = flag_value(argv, "--metrics-port")
+    if run_mode(argv, job_name) is None:
+        port = None  # Another job in this script is the one being run and owns the port
+    stop_metrics = start_metrics(int(port) if port else None, flag_value(argv, "--metrics-file"))
+    try:
+        if "--benchmark-transform" in argv:
+            if spec.reference_transform is not None:
+                logger.info(f"Transform benchmark: {engine.benchmark_transform(spec)}")
+        elif "--check-aggregation-parity" in argv:
+            if spec.aggregation_pipeline is not None:
+                logger.info(f"Aggregation parity: {engine.check_aggregation_parity(spec)}")
+        elif run_mode(argv, job_name) == "follow":
+            run_followers(engine, [spec])
+        elif run_mode(argv, job_name) == "daemon":
+            run_daemon(engine, [spec])
+        elif run_mode(argv, job_name) == "once":
+            run_jobs(engine, [spec])
+    except Exception as e:
+        logger.error(f"An error occurred: {str(e)}")
+    finally:
+        stop_metrics()
+
+
+def main(argv=None):
+    jobs = load_jobs()
+    parser = argparse.ArgumentParser(description="Run the ETL jobs registered in jobs.py")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list the registered jobs")
+    metrics_options = argparse.ArgumentParser(add_help=False)
+    metrics_options.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    metrics_options.add_argument("--metrics-file", help="keep Prometheus metrics in this text file")
+    run = subparsers.add_parser("run", help="one windowed run of each job", parents=[metrics_options])
+    run.add_argument("jobs", nargs="+")
+    daemon = subparsers.add_parser(
+        "daemon", help="run jobs on their intervals until SIGTERM (default: all)", parents=[metrics_options]
+    )
+    daemon.add_argument("jobs", nargs="*")
+    follow_parser = subparsers.add_parser(
+        "follow", help="tail the jobs' sources with change streams until SIGTERM", parents=[metrics_options]
+    )
+    follow_parser.add_argument("jobs", nargs="+")
+    benchmark = subparsers.add_parser("benchmark-transform", help="reference vs compiled transform on synthetic docs")
+    benchmark.add_argument(
+        "job", choices=sorted(name for name, spec in jobs.items() if spec.reference_transform and spec.synthetic_docs)
+    )
+    benchmark.add_argument("--docs", type=int, default=50000)
+    parity = subparsers.add_parser("check-aggregation-parity", help="Python vs server-side shaping on recent docs")
+    parity.add_argument("job", choices=sorted(jobs))
+    parity.add_argument("--sample-size", type=int, default=1000)
+    percentiles = subparsers.add_parser("percentiles", help="percentiles of a latency field from the sketches")
+    percentiles.add_argument("job", choices=sorted(name for name, spec in jobs.items() if spec.latency_sketches))
+    percentiles.add_argument("field")
+    percentiles.add_argument("--by", nargs="+", required=True, help="a grouping of the job, e.g. airline_name")
+    percentiles.add_argument("--group", nargs="*", default=[], help="dimension=value filters")
+    percentiles.add_argument("--hours", type=float, default=1)
+    percentiles.add_argument("--granularity", choices=["Minute", "Hour"], default="Minute")
+    index_report = subparsers.add_parser("index-report", help="required indexes, index usage and query plans")
+    index_report.add_argument("jobs", nargs="+")
+    rebuild = subparsers.add_parser("rebuild-rollups", help="recompute a job's rollups from its target (job stopped)")
+    rebuild.add_argument("job", choices=sorted(name for name, spec in jobs.items() if spec.rollup))
+    rebuild.add_argument("--hours", type=int, default=24, help="how far back to rebuild")
+    args = parser.parse_args(argv)
+    unknown = [name for name in getattr(args, "jobs", []) if name not in jobs]
+    if unknown:
+        parser.error(f"unknown job(s): {', '.join(unknown)}; choose from {', '.join(jobs)}")
+
+    configure_logging()
+    engine = default_engine()
+    if args.command == "list":
+        for name, spec in jobs.items():
+            print(f"{name}: {', '.join(spec.sources)} -> {spec.target_db}.{spec.target}")
+    elif args.command in ("run", "daemon", "follow"):
+        stop_metrics = start_metrics(args.metrics_port, args.metrics_file)
+        try:
+            if args.command == "run":
+                return 1 if run_jobs(engine, [jobs[name] for name in args.jobs]) else 0
+            elif args.command == "daemon":
+                run_daemon(engine, [jobs[name] for name in args.jobs or jobs])
+            else:
+                run_followers(engine, [jobs[name] for name in args.jobs])
+        finally:
+            stop_metrics()
+    elif args.command == "benchmark-transform":
+        print(json.dumps(engine.benchmark_transform(jobs[args.job], args.docs), indent=2))
+    elif args.command == "check-aggregation-parity":
+        print(json.dumps(engine.check_aggregation_parity(jobs[args.job], args.sample_size), indent=2, default=str))
+    elif args.command == "percentiles":
+        end_time = datetime.now(pytz.UTC)
+        group = dict(condition.split("=", 1) for condition in args.group)
+        print(json.dumps(engine.percentiles(
+            jobs[args.job], args.field, end_time - timedelta(hours=args.hours), end_time, args.by, group,
+            args.granularity
+        ), indent=2))
+    elif args.command == "index-report":
+        report = {name: engine.index_report(jobs[name]) for name in args.jobs}
+        print(json.dumps(report, indent=2, default=str))
+        collscan = any(
+            source_report["collscan"] for job_report in report.values() for source_report in job_report["sources"].values()
+        )
+        return 1 if collscan else 0
+    elif args.command == "rebuild-rollups":
+        end_time = datetime.now(pytz.UTC)
+        engine.rebuild_rollups(jobs[args.job], end_time - timedelta(hours=args.hours), end_time)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Index management: check the indexes a job's queries rely on, verify the windowed query's plan,
+report index usage and build missing target indexes without holding up ingestion.
+
+Source indexes are only checked and reported, never created: the sources are the production log
+servers. Target indexes are created in a background thread; MongoDB builds them without blocking
+reads or writes on the collection, and the job keeps writing while they build.
+"""
+
+import logging
+import threading
+import time
+
+import pymongo
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+
+from windows import KeyWindow
+
+PLAN_CHECKS = ("off", "warn", "fail")
+
+
+def key_fields(keys):
+    return [field for field, _ in keys]
+
+
+def find_index(collection, keys):
+    """Name of an index whose leading fields are keys' fields, or None."""
+    wanted = key_fields(keys)
+    for name, info in collection.index_information().items():
+        if key_fields(info["key"])[:len(wanted)] == wanted:
+            return name
+    return None
+
+
+def missing_indexes(collection, index_list):
+    """The entries of index_list (lists of (field, direction)) that no index of collection covers."""
+    return [keys for keys in index_list if find_index(collection, keys) is None]
+
+
+def _winning_plan(explain):
+    """Every stage of the winning plan of an explain() result, outermost first."""
+    planner = explain.get("queryPlanner", {})
+    plan = planner.get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)  # Slot-based engine wraps the classic plan shape
+    stages = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop(0)
+        if "stage" in stage:
+            stages.append(stage)
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+    return stages
+
+
+def plan_stages(explain):
+    """Every stage name in the winning plan of an explain() result, outermost first."""
+    return [stage["stage"] for stage in _winning_plan(explain)]
+
+
+def plan_scans(explain):
+    """The index scans of the winning plan: [{"index": name, "fields": [...], "bounds": {...}}]."""
+    return [
+        {"index": stage.get("indexName"), "fields": key_fields(stage.get("keyPattern", {}).items()),
+         "bounds": stage.get("indexBounds", {})}
+        for stage in _winning_plan(explain) if stage["stage"] == "IXSCAN"
+    ]
+
+
+def explain_window(collection, query, sort=None, limit=None):
+    """
+    explain() of a job's windowed find as the engine runs it: a KeyWindow with its hint, min and
+    max, a filter with the read's sort and batch limit.
+    """
+    cursor = query.find(collection, {"_id": 1}) if isinstance(query, KeyWindow) else collection.find(query, {"_id": 1})
+    if sort:
+        cursor = cursor.sort(sort)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor.explain()
+
+
+def unbounded(scan):
+    """
+    True if an index scan covers the whole range of its leading field: per-field interval bounds of
+    [MinKey, MaxKey], or a min()/max() key range from MinKey to MaxKey.
+    """
+    bounds = scan["bounds"]
+    leading = scan["fields"][0] if scan["fields"] else None
+    if "startKey" in bounds or "endKey" in bounds:
+        start = list(bounds.get("startKey", {}).values())[:1]
+        end = list(bounds.get("endKey", {}).values())[:1]
+        return start == [MinKey()] and end == [MaxKey()]
+    return bounds.get(leading) == ["[MinKey, MaxKey]"]
+
+
+def plan_problems(explain, index_fields=None):
+    """
+    What is wrong with a windowed query's plan: a COLLSCAN, an index scan over the whole of its
+    leading field, or (given index_fields) no scan of an index leading with those fields.
+    """
+    stages = plan_stages(explain)
+    scans = plan_scans(explain)
+    problems = []
+    if "COLLSCAN" in stages:
+        problems.append(f"does a COLLSCAN ({' -> '.join(stages)})")
+    for scan in scans:
+        if unbounded(scan):
+            problems.append(f"scans all of index {scan['index']} (no bounds on {scan['fields'][:1]})")
+    if index_fields and scans and not any(scan["fields"][:len(index_fields)] == list(index_fields) for scan in scans):
+        used = ", ".join(f"{scan['index']} {scan['fields']}" for scan in scans)
+        problems.append(f"uses {used} instead of an index on {list(index_fields)}")
+    elif index_fields and not scans and "COLLSCAN" not in stages and "EOF" not in stages:
+        problems.append(f"uses no index on {list(index_fields)} ({' -> '.join(stages)})")
+    return problems
+
+
+def check_plan(collection, query, sort=None, limit=None, policy="warn", logger=None, index_fields=None):
+    """
+    Explain the windowed query and warn or raise (policy "warn"/"fail") when its plan is wrong
+    (see plan_problems). Returns the plan's stages.
+    """
+    logger = logger or logging.getLogger()
+    explain = explain_window(collection, query, sort, limit)
+    problems = plan_problems(explain, index_fields)
+    if problems:
+        message = f"{collection.name}: windowed query {'; '.join(problems)}; query: {query}"
+        if policy == "fail":
+            raise RuntimeError(message)
+        logger.warning(message)
+    return plan_stages(explain)
+
+
+def create_in_background(collection, index_list, logger=None):
+    """Create the missing entries of index_list from a daemon thread; returns the thread (or None)."""
+    logger = logger or logging.getLogger()
+    missing = missing_indexes(collection, index_list)
+    if not missing:
+        return None
+
+    def build():
+        for keys in missing:
+            started = time.monotonic()
+            try:
+                name = collection.create_index(keys)
+            except pymongo.errors.PyMongoError as e:
+                logger.error(f"Could not create index {keys} on {collection.name}: {str(e)}")
+                continue
+            logger.info(f"Created index {name} on {collection.name} in {time.monotonic() - started:.1f}s")
+
+    logger.info(f"Building {len(missing)} missing index(es) on {collection.name} in the background: {missing}")
+    thread = threading.Thread(target=build, name=f"index-{collection.name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def index_usage(collection):
+    """{index name: {"ops": accesses since "since", "since": ...}} from $indexStats."""
+    return {
+        stats["name"]: {"ops": stats["accesses"]["ops"], "since": stats["accesses"]["since"]}
+        for stats in collection.aggregate([{"$indexStats": {}}])
+    }
+
+
+def report(collection, index_list, query=None, sort=None, limit=None):
+    """Required indexes present or missing, index usage and (for a query) its plan, for one collection."""
+    result = {
+        "required": [
+            {"keys": keys, "index": find_index(collection, keys)} for keys in index_list
+        ],
+        "usage": index_usage(collection),
+    }
+    if query is not None:
+        explain = explain_window(collection, query, sort, limit)
+        result["plan"] = plan_stages(explain)
+        result["indexes_used"] = [scan["index"] for scan in plan_scans(explain)]
+        result["collscan"] = "COLLSCAN" in result["plan"]
+    unused = [name for name, usage in result["usage"].items() if usage["ops"] == 0 and name != "_id_"]
+    if unused:
+        result["unused"] = unused
+    return result
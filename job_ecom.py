@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""NewECOMData: ECOMData bookings with class names, DD-MM-YYYY travel dates and upper-case coupons."""
+
+import logging
+from datetime import datetime, timedelta
+
+import pymongo
+
+from dates import DateStandardizer
+from etl_common import format_time_range, synthetic_timestamps
+from etl_engine import JobSpec
+from windows import CLOCK_INDEX, EVENT_TIME_FIELD, IST_OFFSET, WATERMARK_INDEX, clock_strings, clock_window, event_time
+
+logger = logging.getLogger("etl.NewECOMData")
+
+# MongoDB connection details (source and target share one server)
+MONGO_URI = "mongodb://10.240.0.131:27017/"
+
+# List of required columns
+columns_to_extract = [
+    "app", "adt", "triptype", "brand", "room", "bookingDate", "chd", "travelDate",
+    "bookingid", "portal", "inserted_time", "inserted_date", "_id", "utmsource",
+    "inf", "discount", "uid", "class", "timezone", "price", "currcode",
+    "domain", "product", "source", "destination", "location_type", "loginkey",
+    "destination_fullname", "source_fullname",
+    "total_price", "operator_discount", "base_price", "convenience_fee",
+    "addOn_price", "airline_fullname", "tax", "addOn_type",
+    "coupon"
+]
+
+# Projection for MongoDB query
+projection = {col: 1 for col in columns_to_extract}
+
+# travelDate formats the booking front-ends send
+TRAVEL_DATE_FORMATS = [
+    "%a-%d%b%Y",              # 'Sat-12Apr2025'
+    "%m/%d/%Y %I:%M:%S %p",   # '2/17/2025 12:00:00 AM'
+    "%a %b %d %H:%M:%S GMT%z %Y",  # 'Fri Feb 14 00:00:00 GMT+05:30 2025'
+    "%Y-%m-%d",               # '2025-02-02'
+    "%m-%d-%Y",               # '02-13-2025'
+    "%d-%m-%Y"                # '05-07-2025'
+]
+
+# Standardize travelDate to DD-MM-YYYY, choosing the formats to try from the string's shape
+standardize_date = DateStandardizer("travelDate", [
+    (lambda s: "GMT" in s, ["%a %b %d %H:%M:%S GMT%z %Y"]),
+    (lambda s: "/" in s, ["%m/%d/%Y %I:%M:%S %p"]),
+    (lambda s: s[:1].isalpha(), ["%a-%d%b%Y"]),
+    (lambda s: len(s) == 10 and s[4] == "-", ["%Y-%m-%d"]),
+    (lambda s: len(s) == 10 and s[2] == "-" and s[5] == "-", ["%m-%d-%Y", "%d-%m-%Y"]),  # Month first if valid
+], logger=logger)
+
+def reference_standardize_date(date_str):
+    """standardize_date the slow way, trying every format in order; for benchmarks."""
+    if not date_str:
+        return None
+    for fmt in TRAVEL_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt).strftime("%d-%m-%Y")
+        except ValueError:
+            continue
+    return date_str
+
+def clean_ecom_document(doc, processing_time, time_range, record_date):
+    """Clean one ECOMData document, or return None if it has no insertion timestamp."""
+    if not doc.get("inserted_date") or not doc.get("inserted_time"):
+        logger.warning(f"Skipping record with missing timestamp: {doc.get('_id')}")
+        return None
+
+    # Transform the document
+    transformed_doc = {field: doc.get(field) for field in columns_to_extract}
+
+    # Data Cleaning and Preprocessing
+    class_mapping = {"0": "Economy", "4": "Premium Economy", "2": "Business", "1": "First"}
+    if transformed_doc.get("class") in class_mapping:
+        transformed_doc["class"] = class_mapping[transformed_doc["class"]]
+
+    if transformed_doc.get("travelDate"):
+        transformed_doc["travelDate"] = standardize_date(transformed_doc["travelDate"])
+
+    if transformed_doc.get("coupon"):
+        transformed_doc["coupon"] = transformed_doc["coupon"].upper()
+
+    # Add new fields
+    transformed_doc[EVENT_TIME_FIELD] = event_time(doc["inserted_date"], doc["inserted_time"])  # UTC datetime
+    transformed_doc["Processing_Time"] = processing_time  # UTC datetime
+    transformed_doc["time_range"] = time_range  # IST string
+    transformed_doc["record_date"] = record_date  # IST date string
+    return transformed_doc
+
+def reference_clean_ecom_document(doc, processing_time, time_range, record_date):
+    """clean_ecom_document with travelDate parsed by reference_standardize_date; for benchmarks."""
+    if not doc.get("inserted_date") or not doc.get("inserted_time"):
+        return None
+    transformed_doc = {field: doc.get(field) for field in columns_to_extract}
+    class_mapping = {"0": "Economy", "4": "Premium Economy", "2": "Business", "1": "First"}
+    if transformed_doc.get("class") in class_mapping:
+        transformed_doc["class"] = class_mapping[transformed_doc["class"]]
+    if transformed_doc.get("travelDate"):
+        transformed_doc["travelDate"] = reference_standardize_date(transformed_doc["travelDate"])
+    if transformed_doc.get("coupon"):
+        transformed_doc["coupon"] = transformed_doc["coupon"].upper()
+    transformed_doc[EVENT_TIME_FIELD] = event_time(doc["inserted_date"], doc["inserted_time"])
+    transformed_doc["Processing_Time"] = processing_time
+    transformed_doc["time_range"] = time_range
+    transformed_doc["record_date"] = record_date
+    return transformed_doc
+
+def legacy_watermark(target):
+    """(inserted_date, inserted_time) of the latest Processing_Time, for targets written before inserted_at."""
+    latest_record = target.find_one({"Processing_Time": {"$ne": None}}, sort=[("Processing_Time", -1)])
+    return clock_strings(latest_record["Processing_Time"]) if latest_record else None
+
+def window(target, processing_time, logger):
+    """Bookings after the latest (inserted_at, _id) in NewECOMData, as one range of the source's clock index."""
+    return clock_window(target, processing_time, logger, legacy_watermark)
+
+def transform_args(source, start_time, end_time, processing_time):
+    """Arguments after doc for clean_ecom_document."""
+    record_date = (end_time + timedelta(hours=5, minutes=30)).strftime("%Y-%m-%d")  # IST date string
+    return processing_time, format_time_range(start_time, end_time), record_date
+
+# travelDate as the different booking front-ends send it, one per standardize_date format
+SYNTHETIC_TRAVEL_DATES = [
+    "Sat-12Apr2025", "2/17/2025 12:00:00 AM", "Fri Feb 14 00:00:00 GMT+05:30 2025",
+    "2025-02-02", "02-13-2025", "05-07-2025", "",
+]
+
+def synthetic_docs(num_docs):
+    """Synthetic bookings inserted over the last five minutes, with every travelDate format standardize_date handles."""
+    classes = ["0", "4", "2", "1", "Economy"]
+    docs = []
+    for i, inserted in enumerate(synthetic_timestamps(num_docs)):
+        doc = {field: f"{field}-{i % 50}" for field in columns_to_extract}
+        doc.update({
+            "_id": i, "class": classes[i % len(classes)], "coupon": "emtfly" if i % 3 else None,
+            "travelDate": SYNTHETIC_TRAVEL_DATES[i % len(SYNTHETIC_TRAVEL_DATES)],
+            "inserted_date": (inserted + IST_OFFSET).strftime("%Y-%m-%d"),
+            "inserted_time": (inserted + IST_OFFSET).strftime("%H:%M:%S"),
+            "adt": i % 4 + 1, "chd": i % 2, "inf": 0, "price": 4000.0 + i % 3000, "total_price": 4500.0 + i % 3000,
+        })
+        if i % 1000 == 999:
+            del doc["inserted_time"]  # Skipped by clean_ecom_document
+        docs.append(doc)
+    return docs
+
+SPEC = JobSpec(
+    name="NewECOMData",
+    source_uri=MONGO_URI, source_db="DSAnalysis", sources=["ECOMData"],
+    target_uri=MONGO_URI, target_db="CloudLogsDB", target="NewECOMData",
+    window=window, projection=projection,
+    transform=clean_ecom_document, transform_args=transform_args, reference_transform=reference_clean_ecom_document,
+    synthetic_docs=synthetic_docs,
+    dedup="source_id",  # Re-read bookings are rejected by the target's _id index and counted
+    log_file="data_extraction.log",
+    source_indexes=[CLOCK_INDEX], plan_check="fail",  # Each run must read only its slice of the index
+    # window() looks up the latest (inserted_at, _id); Processing_Time for targets from before it existed
+    target_indexes=(WATERMARK_INDEX, [("Processing_Time", pymongo.DESCENDING)]),
+    batch_size=100000, batch_bytes=64 * 1024 * 1024, max_rss_mb=1024,  # Small rows: the byte budget sets the size
+)
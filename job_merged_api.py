@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Merged_API_Airline: the airline _RQ_RS request/response logs, flattened into one collection."""
+
+import logging
+from datetime import datetime
+
+import pymongo
+import pytz
+
+from etl_common import (
+    build_projection, build_shaping_pipeline, compile_extractor, format_record_date, format_time_range,
+    synthetic_payload, synthetic_timestamps
+)
+from etl_engine import JobSpec
+from rollups import Rollup
+from sketches import LatencySketches
+
+logger = logging.getLogger("etl.Merged_API_Airline")
+
+# MongoDB connection details
+SOURCE_MONGO_URI = "mongodb://10.240.0.46:27017/"  # Source server
+TARGET_MONGO_URI = "mongodb://10.240.0.131:27017/"  # Target server
+DATABASE_NAME = "CloudLogsDB"
+
+
+# Airline collections in the source database
+collection_list = [
+    "AirArabia_RQ_RS", "AirArabia3L_RQ_RS", "AirAsiaIntl_RQ_RS", "AirIndiaExpress_RQ_RS",
+    "Akasa_RQ_RS", "AllianceAir_RQ_RS", "Amadeus_RQ_RS", "American_RQ_RS", "Emirates_RQ_RS",
+    "Etihad_RQ_RS", "Fly91_RQ_RS", "FlyArystan_RQ_RS", "FlyToDubai_RQ_RS", "FlyaDeal_RQ_RS",
+    "Flybig_RQ_RS", "Flynas_RQ_RS", "Indigo_RQ_RS", "Jazeera_RQ_RS", "Jetstar_RQ_RS",
+    "Malindo_RQ_RS", "NokAir_RQ_RS", "OmanAir_RQ_RS", "Sabre_RQ_RS", "Salam_RQ_RS",
+    "Scoot_RQ_RS", "Singapore_RQ_RS", "Spicjet_RQ_RS", "StarAir_RQ_RS", "TravelPort_RQ_RS",
+    "Travelopedia_RQ_RS", "TripShope_RQ_RS", "Verteil_RQ_RS"
+]
+
+# Fields to extract from root and Message (flattened)
+FIELDS_TO_EXTRACT = {
+    "root": ["InsertOn", "level"],
+    "message": [
+        "response_time", "segcount", "org", "des", "dep_date", "ret_Date", "paxcount", "cabin",
+        "req_time", "traceid", "request_name", "request", "searchid", "elapsed_time", "exception",
+        "requesttype", "IsIntl", "AgencyID", "Airline_elapsed_time", "Process_elapsed_time",
+        "Cache_elapsed_time", "IsCache", "Remarks"
+    ]
+}
+
+# Fetch only the extracted fields from the source server
+PROJECTION = build_projection(FIELDS_TO_EXTRACT)
+
+def extract_airline_name(collection_name):
+    """Extract airline name by removing '_RQ_RS' suffix."""
+    return collection_name.replace("_RQ_RS", "")
+
+def process_document(doc, airline_name, time_range, processing_time):
+    """Process a document, flatten fields, convert elapsed_time to seconds, and add new fields including FlightType."""
+    try:
+        # Extract root fields
+        new_doc = {field: doc.get(field) for field in FIELDS_TO_EXTRACT["root"]}
+        
+        # Extract and flatten Message fields
+        message = doc.get("Message", {})
+        for field in FIELDS_TO_EXTRACT["message"]:
+            value = message.get(field)
+            # Convert elapsed_time from milliseconds to seconds
+            if field == "elapsed_time" and value is not None:
+                try:
+                    new_doc[field] = float(value) / 1000.0  # Convert ms to seconds
+                except (ValueError, TypeError):
+                    logger.warning(f"Failed to convert elapsed_time to float in document {doc.get('_id', 'unknown')}: {value}")
+                    new_doc[field] = 0.0  # Fallback to 0.0 if conversion fails
+            else:
+                new_doc[field] = value
+        
+        # Add additional fields
+        new_doc["airline_name"] = airline_name
+        new_doc["is_issue"] = False
+        new_doc["issue"] = None
+        new_doc["time_range"] = time_range
+        new_doc["record_date"] = doc["InsertOn"].strftime("%Y-%m-%d")  # Extract date from InsertOn
+        new_doc["Processing_Time"] = processing_time  # Add UTC processing time
+        
+        # Add FlightType based on IsIntl
+        is_intl = new_doc.get("IsIntl", False)  # Default to False if IsIntl is missing
+        new_doc["FlightType"] = "International" if is_intl else "Domestic"
+        
+        return new_doc, True
+    except Exception as e:
+        # If processing fails, mark as issue
+        new_doc = {
+            "_id": doc.get("_id"),
+            "original_doc": doc,
+            "airline_name": airline_name,
+            "is_issue": True,
+            "issue": f"Processing failed: {str(e)}",
+            "time_range": time_range,
+            "record_date": doc.get("InsertOn", datetime.now(pytz.UTC)).strftime("%Y-%m-%d"),  # Fallback to now if InsertOn missing
+            "Processing_Time": processing_time,  # Add UTC processing time even in error case
+            "FlightType": "Domestic"  # Default to Domestic in error case
+        }
+        # Include Message fields with elapsed_time conversion in error case
+        message = doc.get("Message", {})
+        for field in FIELDS_TO_EXTRACT["message"]:
+            value = message.get(field)
+            if field == "elapsed_time" and value is not None:
+                try:
+                    new_doc[field] = float(value) / 1000.0  # Convert ms to seconds
+                except (ValueError, TypeError):
+                    logger.warning(f"Failed to convert elapsed_time to float in error case for document {doc.get('_id', 'unknown')}: {value}")
+                    new_doc[field] = 0.0  # Fallback to 0.0 if conversion fails
+            else:
+                new_doc[field] = value
+        return new_doc, False
+
+def convert_elapsed_time(value, doc):
+    """Convert elapsed_time from milliseconds to seconds, falling back to 0.0 like process_document."""
+    if value is None:
+        return None
+    try:
+        return float(value) / 1000.0
+    except (ValueError, TypeError):
+        logger.warning(f"Failed to convert elapsed_time to float in document {doc.get('_id', 'unknown')}: {value}")
+        return 0.0
+
+# Field extraction compiled once from FIELDS_TO_EXTRACT
+extract_fields = compile_extractor(FIELDS_TO_EXTRACT, converters={"elapsed_time": convert_elapsed_time})
+
+def transform_document(doc, airline_name, time_range, processing_time):
+    """Compiled fast path with the same output as process_document, which still handles documents that fail."""
+    try:
+        new_doc = extract_fields(doc)
+        new_doc["airline_name"] = airline_name
+        new_doc["is_issue"] = False
+        new_doc["issue"] = None
+        new_doc["time_range"] = time_range
+        new_doc["record_date"] = format_record_date(doc["InsertOn"].date())
+        new_doc["Processing_Time"] = processing_time
+        new_doc["FlightType"] = "International" if new_doc["IsIntl"] else "Domestic"
+        return new_doc, True
+    except Exception:
+        return process_document(doc, airline_name, time_range, processing_time)
+
+def aggregation_pipeline(query, airline_name, time_range, processing_time, sort=None, **options):
+    """Server-side equivalent of transform_document; options are passed to build_shaping_pipeline."""
+    elapsed_time_seconds = lambda value: {"$cond": [
+        {"$eq": [value, None]}, None,
+        {"$divide": [{"$convert": {"input": value, "to": "double", "onError": 0.0}}, 1000]},
+    ]}
+    extra_fields = {
+        "airline_name": {"$literal": airline_name},
+        "is_issue": {"$literal": False},
+        "issue": {"$literal": None},
+        "time_range": {"$literal": time_range},
+        "record_date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$InsertOn"}},
+        "Processing_Time": {"$literal": processing_time},
+        "FlightType": {"$cond": [
+            {"$in": ["$IsIntl", {"$literal": [False, None, 0, "", [], {}]}]}, "Domestic", "International"
+        ]},
+    }
+    return build_shaping_pipeline(
+        query, PROJECTION, FIELDS_TO_EXTRACT, extra_fields,
+        converters={"elapsed_time": elapsed_time_seconds}, sort=sort, **options
+    )
+
+def transform_args(source, start_time, end_time, processing_time):
+    """Arguments after doc for transform_document, process_document and aggregation_pipeline."""
+    return extract_airline_name(source), format_time_range(start_time, end_time), processing_time
+
+# Per-minute/hour request counts, mean latencies and exception counts by airline and flight type
+ROLLUP = Rollup(
+    "InsertOn", ["airline_name", "FlightType"], sums=["response_time", "elapsed_time"],
+    flags={"exceptions": ("exception", bool)},
+)
+
+# Mergeable p50..p99 of every latency by airline and by route
+LATENCY_SKETCHES = LatencySketches(
+    "InsertOn", [("airline_name",), ("org", "des")],
+    ["elapsed_time", "Airline_elapsed_time", "Process_elapsed_time", "Cache_elapsed_time"],
+)
+
+def synthetic_docs(num_docs):
+    """Synthetic airline logs over the last five minutes, with request and response bodies of realistic size."""
+    request = synthetic_payload("Segment", 2000)
+    response = synthetic_payload("Offer", 8000)  # Not extracted; left behind by the projection
+    docs = []
+    for i, insert_on in enumerate(synthetic_timestamps(num_docs)):
+        message = {field: f"{field}-{i % 100}" for field in FIELDS_TO_EXTRACT["message"]}
+        message.update({
+            "elapsed_time": i % 5000, "IsIntl": i % 3 == 0, "paxcount": i % 9 + 1,
+            "request": request, "response": response,
+        })
+        docs.append({"_id": i, "InsertOn": insert_on, "level": "Information", "Message": message})
+    return docs
+
+SPEC = JobSpec(
+    name="Merged_API_Airline",
+    source_uri=SOURCE_MONGO_URI, source_db=DATABASE_NAME, sources=collection_list,
+    target_uri=TARGET_MONGO_URI, target_db=DATABASE_NAME, target="Merged_API_Airline",
+    issue_target="Merged_API_Airline_Issue",
+    time_field="InsertOn", projection=PROJECTION, raw_bson=True,
+    transform=transform_document, transform_args=transform_args, reference_transform=process_document,
+    aggregation_pipeline=aggregation_pipeline, synthetic_docs=synthetic_docs,
+    rollup=ROLLUP, latency_sketches=LATENCY_SKETCHES,
+    layout_meta_fields=["airline_name", "record_date"],  # Bucket keys if storage_layout is not "flat"
+    target_indexes=(
+        [("Processing_Time", pymongo.DESCENDING)],
+        [("record_date", pymongo.ASCENDING), ("airline_name", pymongo.ASCENDING)],  # Dashboard filters
+    ),
+    log_file="Merged_API_Airline_processing.log",
+    max_workers=8,  # Airline collections processed concurrently
+    shards=2,  # ...and a heavy collection's large window as two concurrent ranges (16 connections)
+    batch_bytes=32 * 1024 * 1024, max_rss_mb=2048,  # Request payloads make rows large; eight sources read at once
+)
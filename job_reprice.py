@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Processed_Repricing: fare reprice logs with Actual_Reprice and a Portal classified from username."""
+
+import logging
+from datetime import datetime, timedelta
+
+import pymongo
+import pytz
+
+from etl_common import (
+    build_projection, build_shaping_pipeline, compile_extractor, format_record_date, format_time_range,
+    synthetic_payload, synthetic_timestamps
+)
+from etl_engine import JobSpec
+from rollups import Rollup, is_set
+
+logger = logging.getLogger("etl.Processed_Repricing")
+
+# MongoDB connection details
+SOURCE_MONGO_URI = "mongodb://10.240.0.46:27017/"  # Source server
+TARGET_MONGO_URI = "mongodb://10.240.0.131:27017/"  # Target server
+SOURCE_DATABASE_NAME = "IN_logger_flight_data1"
+TARGET_DATABASE_NAME = "CloudLogsDB"
+
+# Collection names
+SOURCE_COLLECTION = "fs_reprice_rs"
+TARGET_COLLECTION = "Processed_Repricing"
+
+
+# Fields to extract from root and Message (flattened)
+FIELDS_TO_EXTRACT = {
+    "root": ["Date", "level", "useragent", "countrycode", "citycode"],
+    "message": [
+        "traceid", "reppos", "response_time", "username", 
+        "requestedfare", "responsefare", "faredifference", "elapsed_time"
+    ]
+}
+
+# Fetch only the extracted fields from the source server
+PROJECTION = build_projection(FIELDS_TO_EXTRACT)
+
+META_SEARCH_USERNAMES = {
+    "acloud", "adcanopus", "adgama", "couponzguru", "google", "googleemt", "grabon",
+    "hexaweb", "hexaweb1", "hexaweb2", "kayak", "OCTAADS", "octaads700", "prudentads",
+    "rag", "reclame", "SEARCHMYJOURNEY", "SNAP", "utmdigital", "wegom", "xlnc", "XLNCECOMMERCE"
+}
+
+def determine_portal(username):
+    """Determine the Portal value based on username."""
+    if not username:  # Handle None or empty username
+        return "B2C"
+    if username == "B2B":
+        return "B2B"
+    if username == "CORPORATE":
+        return "CORPORATE"
+    if username in META_SEARCH_USERNAMES:
+        return "Meta Search"
+    return "B2C"
+
+def process_document(doc, time_range, processing_time):
+    """Process a document, flatten fields, and add new fields including Actual_Reprice, Portal, and Processing_Time."""
+    new_doc = {}
+    try:
+        # Extract root fields
+        new_doc = {field: doc.get(field) for field in FIELDS_TO_EXTRACT["root"]}
+        
+        # Extract and flatten Message fields
+        message = doc.get("Message", {})
+        for field in FIELDS_TO_EXTRACT["message"]:
+            value = message.get(field)
+            # Convert specific fields to numeric format
+            if field in ["requestedfare", "responsefare", "faredifference"]:
+                try:
+                    new_doc[field] = float(value) if value is not None else 0.0
+                except (ValueError, TypeError):
+                    logger.warning(f"Failed to convert {field} to float in document {doc.get('_id', 'unknown')}: {value}")
+                    new_doc[field] = 0.0  # Fallback to 0.0 if conversion fails
+            else:
+                new_doc[field] = value
+        
+        # Add additional fields
+        new_doc["time_range"] = time_range
+        new_doc["Processing_Time"] = processing_time  # UTC processing time
+        
+        # Calculate Actual_Reprice based on faredifference
+        faredifference = new_doc.get("faredifference", 0.0)
+        new_doc["Actual_Reprice"] = bool(faredifference > 0)  # True if faredifference > 0, False otherwise
+        
+        # Add Portal based on username
+        new_doc["Portal"] = determine_portal(new_doc.get("username"))
+        
+        # Adjust record_date to IST (UTC+5:30)
+        if "Date" not in doc or not isinstance(doc["Date"], datetime):
+            raise ValueError(f"Invalid or missing Date field in document {doc.get('_id', 'unknown')}")
+        ist_date = doc["Date"] + timedelta(hours=5, minutes=30)
+        new_doc["record_date"] = ist_date.strftime("%Y-%m-%d")
+        
+    except Exception as e:
+        # Log error and return partial document with fallback values
+        logger.error(f"Error processing document {doc.get('_id', 'unknown')}: {str(e)}")
+        new_doc = {
+            "error": f"Processing failed: {str(e)}",
+            "time_range": time_range,
+            "Processing_Time": processing_time,
+            "record_date": (doc.get("Date", datetime.now(pytz.UTC)) + timedelta(hours=5, minutes=30)).strftime("%Y-%m-%d"),
+            "Actual_Reprice": False,  # Default to False in error case
+            "Portal": determine_portal(message.get("username"))  # Still determine Portal in error case
+        }
+        # Include any available fields from root or Message
+        for field in FIELDS_TO_EXTRACT["root"]:
+            new_doc[field] = doc.get(field)
+        message = doc.get("Message", {})
+        for field in FIELDS_TO_EXTRACT["message"]:
+            value = message.get(field)
+            if field in ["requestedfare", "responsefare", "faredifference"]:
+                try:
+                    new_doc[field] = float(value) if value is not None else 0.0
+                except (ValueError, TypeError):
+                    new_doc[field] = 0.0
+            else:
+                new_doc[field] = value
+        
+    return new_doc
+
+def fare_converter(field):
+    """Build a converter coercing a fare field to float, with 0.0 for missing or invalid values like process_document."""
+    def convert(value, doc):
+        try:
+            return float(value) if value is not None else 0.0
+        except (ValueError, TypeError):
+            logger.warning(f"Failed to convert {field} to float in document {doc.get('_id', 'unknown')}: {value}")
+            return 0.0
+    return convert
+
+# Field extraction compiled once from FIELDS_TO_EXTRACT
+extract_fields = compile_extractor(
+    FIELDS_TO_EXTRACT,
+    converters={field: fare_converter(field) for field in ["requestedfare", "responsefare", "faredifference"]}
+)
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+IST_OFFSET_MS = 19800000  # IST_OFFSET for server-side date arithmetic
+
+def transform_document(doc, time_range, processing_time):
+    """Compiled fast path with the same output as process_document, which still handles documents that fail."""
+    try:
+        new_doc = extract_fields(doc)
+        new_doc["time_range"] = time_range
+        new_doc["Processing_Time"] = processing_time
+        new_doc["Actual_Reprice"] = new_doc["faredifference"] > 0
+        new_doc["Portal"] = determine_portal(new_doc["username"])
+        date = doc["Date"]
+        if not isinstance(date, datetime):
+            raise ValueError("Invalid Date field")
+        new_doc["record_date"] = format_record_date((date + IST_OFFSET).date())
+        return new_doc
+    except Exception:
+        return process_document(doc, time_range, processing_time)
+
+def aggregation_pipeline(query, time_range, processing_time, sort=None, **options):
+    """Server-side equivalent of transform_document; options are passed to build_shaping_pipeline."""
+    float_or_zero = lambda value: {"$convert": {"input": value, "to": "double", "onError": 0.0, "onNull": 0.0}}
+    extra_fields = {
+        "time_range": {"$literal": time_range},
+        "Processing_Time": {"$literal": processing_time},
+        "Actual_Reprice": {"$gt": ["$faredifference", 0]},
+        "Portal": {"$switch": {
+            "branches": [
+                {"case": {"$eq": ["$username", "B2B"]}, "then": "B2B"},
+                {"case": {"$eq": ["$username", "CORPORATE"]}, "then": "CORPORATE"},
+                {"case": {"$in": ["$username", {"$literal": sorted(META_SEARCH_USERNAMES)}]}, "then": "Meta Search"},
+            ],
+            "default": "B2C",
+        }},
+        "record_date": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$add": ["$Date", IST_OFFSET_MS]}}},
+    }
+    return build_shaping_pipeline(
+        query, PROJECTION, FIELDS_TO_EXTRACT, extra_fields,
+        converters={field: float_or_zero for field in ["requestedfare", "responsefare", "faredifference"]},
+        # An unhashable username makes process_document take its error path, so leave it to Python
+        field_types={"username": ["string", "null", "missing"]},
+        sort=sort, **options
+    )
+
+def transform_args(source, start_time, end_time, processing_time):
+    """Arguments after doc for transform_document, process_document and aggregation_pipeline."""
+    return format_time_range(start_time, end_time), processing_time
+
+# Per-minute/hour reprice counts, mean latencies and fare differences, and Actual_Reprice counts by Portal
+ROLLUP = Rollup(
+    "Date", ["Portal"], sums=["response_time", "elapsed_time", "faredifference"],
+    flags={"actual_reprices": ("Actual_Reprice", is_set)},
+)
+
+def synthetic_docs(num_docs):
+    """Synthetic reprice logs over the last five minutes."""
+    usernames = ["B2B", "CORPORATE", "google", "kayak", None, "guest"]
+    fare_rules = synthetic_payload("FareRule", 3000)  # Not extracted; left behind by the projection
+    docs = []
+    for i, date in enumerate(synthetic_timestamps(num_docs)):
+        requested = 4000 + i % 3000
+        docs.append({
+            "_id": i, "Date": date, "level": "Information", "useragent": "Mozilla/5.0",
+            "countrycode": "IN", "citycode": "BOM",
+            "Message": {
+                "traceid": f"trace-{i}", "reppos": i % 4, "response_time": i % 900,
+                "username": usernames[i % len(usernames)], "requestedfare": str(requested),
+                "responsefare": str(requested + i % 7 - 3), "faredifference": str(i % 7 - 3),
+                "elapsed_time": i % 5000, "farerules": fare_rules,
+            },
+        })
+    return docs
+
+SPEC = JobSpec(
+    name=TARGET_COLLECTION,
+    source_uri=SOURCE_MONGO_URI, source_db=SOURCE_DATABASE_NAME, sources=[SOURCE_COLLECTION],
+    target_uri=TARGET_MONGO_URI, target_db=TARGET_DATABASE_NAME, target=TARGET_COLLECTION,
+    time_field="Date", projection=PROJECTION, raw_bson=True,
+    transform=transform_document, transform_args=transform_args, reference_transform=process_document,
+    aggregation_pipeline=aggregation_pipeline, synthetic_docs=synthetic_docs, rollup=ROLLUP,
+    layout_meta_fields=["Portal", "record_date"],  # Bucket keys if storage_layout is not "flat"
+    target_indexes=(
+        [("Processing_Time", pymongo.DESCENDING)],
+        [("record_date", pymongo.ASCENDING), ("Portal", pymongo.ASCENDING)],  # Dashboard filters
+    ),
+    log_file="Processed_Repricing_processing.log",
+    batch_bytes=64 * 1024 * 1024, max_rss_mb=1024,
+)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Newsearchdataa: SearchData click events with defaults for missing fields and an airline_name column."""
+
+import logging
+from functools import lru_cache
+
+import pymongo
+
+from etl_common import compile_cleaner, synthetic_timestamps
+from etl_engine import JobSpec
+from windows import CLOCK_INDEX, EVENT_TIME_FIELD, IST_OFFSET, WATERMARK_INDEX, clock_window, event_time
+
+logger = logging.getLogger("etl.Newsearchdataa")
+
+# MongoDB connection details (source and target share one database)
+MONGO_URI = "mongodb://10.240.0.131:27017/"
+DATABASE_NAME = "DSAnalysis"
+
+# Updated list of required columns
+columns_to_extract = [
+    "triptype", "app", "page", "product", "domain", "class", "_id", "utmmedium",
+    "inserted_date", "inserted_time", "utmcampaign", "currcode", "faretype", "airline",
+    "clicktype", "uid", "coupon", "utmsource", "bookingid", "event",
+    "eventname", "destination", "source", "portal", "loginkey"
+]
+
+# Projection for MongoDB query
+projection = {col: 1 for col in columns_to_extract}
+
+# Default values for missing fields
+DEFAULTS = {
+    "triptype": "unknown",
+    "app": "unknown",
+    "page": "unknown",
+    "product": "unknown",
+    "domain": "unknown",
+    "class": "unknown",
+    "utmmedium": "none",
+    "utmcampaign": "none",
+    "currcode": "USD",
+    "faretype": "unknown",
+    "airline": "unknown",
+    "clicktype": "unknown",
+    "uid": None,
+    "coupon": "none",
+    "utmsource": "none",
+    "bookingid": None,
+    "event": "unknown",
+    "eventname": "unknown",
+    "destination": "unknown",
+    "source": "unknown",
+    "portal": "unknown",
+    "loginkey": None
+}
+
+# A few dozen distinct values each: normalised once and shared by every document
+LOW_CARDINALITY_FIELDS = ["app", "page", "product", "domain", "class", "event", "eventname", "portal", "utmsource"]
+VALUE_CACHE_SIZE = 1024  # Per field; a field with more distinct values only loses cache hits
+
+def normalise_coupon(value):
+    return str(value).strip().upper()
+
+def normalise_value(value):
+    """Strip whitespace and lowercase strings; other values are kept as they are."""
+    return value.strip().lower() if isinstance(value, str) else value
+
+def derive_airline_name(airline_value):
+    """airline_name from a cleaned airline, e.g. "qr 134" -> "QR"."""
+    if isinstance(airline_value, str) and " " in airline_value:
+        return airline_value.split(" ")[0].upper()
+    return airline_value.upper()  # If no space, use the whole value
+
+clean_fields = compile_cleaner(
+    columns_to_extract, DEFAULTS, upper_fields=["coupon"], cached_fields=LOW_CARDINALITY_FIELDS,
+    cache_size=VALUE_CACHE_SIZE,
+)
+cached_airline_name = lru_cache(maxsize=VALUE_CACHE_SIZE)(derive_airline_name)
+
+def clean_document(doc):
+    """
+    Cleans a single document and adds a new 'airline_name' column.
+    Returns the cleaned document or None if it should be skipped.
+    """
+    cleaned_doc = clean_fields(doc)
+    airline_value = cleaned_doc.get("airline", "unknown")
+    cleaned_doc["airline_name"] = (
+        cached_airline_name(airline_value) if type(airline_value) is str else derive_airline_name(airline_value)
+    )
+
+    # Skip if _id is missing
+    if cleaned_doc["_id"] is None:
+        logger.warning(f"Skipping document with missing _id: {doc}")
+        return None
+    return cleaned_doc
+
+def reference_clean_document(doc):
+    """clean_document field by field with no caching; for benchmarks."""
+    cleaned_doc = {}
+    for field in columns_to_extract:
+        value = doc.get(field)
+        if value is None or value == "":
+            cleaned_doc[field] = DEFAULTS.get(field, None)
+        elif field == "coupon":
+            cleaned_doc[field] = normalise_coupon(value)
+        else:
+            cleaned_doc[field] = normalise_value(value)
+    cleaned_doc["airline_name"] = derive_airline_name(cleaned_doc.get("airline", "unknown"))
+    if cleaned_doc["_id"] is None:
+        logger.warning(f"Skipping document with missing _id: {doc}")
+        return None
+    return cleaned_doc
+
+def add_run_fields(cleaned_doc, script_run_time):
+    """The event time and the run's script_run_time on a cleaned document (None passes through)."""
+    if cleaned_doc is not None:
+        cleaned_doc[EVENT_TIME_FIELD] = event_time(cleaned_doc["inserted_date"], cleaned_doc["inserted_time"])
+        cleaned_doc["script_run_time"] = script_run_time
+    return cleaned_doc
+
+def transform_document(doc, script_run_time):
+    """clean_document plus the run's script_run_time; None for documents that are skipped."""
+    return add_run_fields(clean_document(doc), script_run_time)
+
+def reference_transform_document(doc, script_run_time):
+    """transform_document through reference_clean_document; for benchmarks."""
+    return add_run_fields(reference_clean_document(doc), script_run_time)
+
+def legacy_watermark(target):
+    """Latest (inserted_date, inserted_time) in Newsearchdataa, for targets written before inserted_at."""
+    latest_record = target.find_one(sort=[("inserted_date", -1), ("inserted_time", -1)])
+    return (latest_record["inserted_date"], latest_record["inserted_time"]) if latest_record else None
+
+def window(target, processing_time, logger):
+    """Events after the latest (inserted_at, _id) in Newsearchdataa, as one range of the source's clock index."""
+    return clock_window(target, processing_time, logger, legacy_watermark)
+
+def transform_args(source, start_time, end_time, processing_time):
+    """Arguments after doc for transform_document: the run time as a local-time string."""
+    return (processing_time.astimezone().strftime("%Y-%m-%d %H:%M:%S"),)
+
+def synthetic_docs(num_docs):
+    """Synthetic search events inserted over the last five minutes (IST, like the source), in mixed case with blanks."""
+    airlines = ["QR 134", "6E 2031", "AI", " ek 512 ", "", None]
+    docs = []
+    for i, inserted in enumerate(synthetic_timestamps(num_docs)):
+        inserted = inserted + IST_OFFSET
+        doc = {field: f" {field.title()}-{i % 50} " for field in columns_to_extract}
+        doc.update({
+            "_id": i, "airline": airlines[i % len(airlines)], "coupon": "emtfly" if i % 3 else "",
+            "utmmedium": None if i % 4 == 0 else "CPC",
+            "inserted_date": inserted.strftime("%Y-%m-%d"), "inserted_time": inserted.strftime("%H:%M:%S"),
+        })
+        docs.append(doc)
+    return docs
+
+SPEC = JobSpec(
+    name="Newsearchdataa",
+    source_uri=MONGO_URI, source_db=DATABASE_NAME, sources=["SearchData"],
+    target_uri=MONGO_URI, target_db=DATABASE_NAME, target="Newsearchdataa",
+    window=window, projection=projection, raw_bson=True,
+    transform=transform_document, transform_args=transform_args, reference_transform=reference_transform_document,
+    synthetic_docs=synthetic_docs,
+    dedup="source_id",  # Re-read events are rejected by the target's _id index and counted
+    log_file="search_data_extraction.log",
+    source_indexes=[CLOCK_INDEX], plan_check="fail",  # Each run must read only its slice of the index
+    # window() looks up the latest (inserted_at, _id); (inserted_date, inserted_time) for targets from before it
+    target_indexes=(
+        WATERMARK_INDEX, [("inserted_date", pymongo.DESCENDING), ("inserted_time", pymongo.DESCENDING)],
+    ),
+    batch_size=100000, cursor_batch_size=10000, batch_bytes=64 * 1024 * 1024, max_rss_mb=1024,
+)
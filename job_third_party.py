@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Processed_Thirdpary: third-party supplier call logs with a Portal classified from user_name."""
+
+import logging
+from datetime import datetime, timedelta
+
+import pymongo
+import pytz
+
+from etl_common import (
+    build_projection, build_shaping_pipeline, compile_extractor, format_record_date, format_time_range,
+    synthetic_payload, synthetic_timestamps
+)
+from etl_engine import JobSpec
+from rollups import Rollup, is_set
+from sketches import LatencySketches
+
+logger = logging.getLogger("etl.Processed_Thirdpary")
+
+# MongoDB connection details
+SOURCE_MONGO_URI = "mongodb://10.240.0.46:27017/"  # Source server
+TARGET_MONGO_URI = "mongodb://10.240.0.131:27017/"  # Target server
+SOURCE_DATABASE_NAME = "IN_logger_flight_data1"
+TARGET_DATABASE_NAME = "CloudLogsDB"
+
+# Collection names
+SOURCE_COLLECTION = "fs_thirdpary_req_log"
+TARGET_COLLECTION = "Processed_Thirdpary"
+
+
+# Fields to extract from root and Message (flattened)
+FIELDS_TO_EXTRACT = {
+    "root": ["Date", "level", "countrycode", "citycode"],
+    "message": [
+        "method_name", "URL", "traceid", "vid", "req_time", "elapsed_time",
+        "user_name", "apptype", "insertedon", "iserror"
+    ]
+}
+
+# Fetch only the extracted fields from the source server
+PROJECTION = build_projection(FIELDS_TO_EXTRACT)
+
+def determine_portal(user_name):
+    """Determine the Portal value based on user_name."""
+    if not user_name:
+        return "B2C"
+    user_name = user_name.upper()
+    if "B2B" in user_name or "EMTB2BIN" in user_name:
+        return "B2B"
+    elif "CORPORATE" in user_name or "EMTCORPORATEIN" in user_name:
+        return "CORPORATE"
+    else:
+        return "B2C"
+
+def process_document(doc, time_range, processing_time):
+    """Process a document, flatten fields, and add new fields with IST-adjusted record_date and Processing_Time."""
+    new_doc = {}
+    try:
+        # Extract root fields
+        new_doc = {field: doc.get(field) for field in FIELDS_TO_EXTRACT["root"]}
+        
+        # Extract and flatten Message fields
+        message = doc.get("Message")
+        if isinstance(message, dict):
+            for field in FIELDS_TO_EXTRACT["message"]:
+                new_doc[field] = message.get(field)
+        elif isinstance(message, list) and message:
+            for field in FIELDS_TO_EXTRACT["message"]:
+                new_doc[field] = message[0].get(field) if message else None
+        else:
+            # If Message is missing or invalid, set fields to None
+            for field in FIELDS_TO_EXTRACT["message"]:
+                new_doc[field] = None
+        
+        # Convert elapsed_time from milliseconds to seconds
+        if new_doc.get("elapsed_time") is not None:
+            new_doc["elapsed_time"] = new_doc["elapsed_time"] / 1000.0
+        
+        # Add additional fields
+        new_doc["Portal"] = determine_portal(new_doc.get("user_name"))
+        new_doc["time_range"] = time_range
+        new_doc["Processing_Time"] = processing_time  # Add UTC processing time
+        
+        # Adjust record_date to IST (UTC+5:30)
+        if "Date" not in doc or not isinstance(doc["Date"], datetime):
+            raise ValueError(f"Invalid or missing Date field in document {doc.get('_id', 'unknown')}")
+        ist_date = doc["Date"] + timedelta(hours=5, minutes=30)
+        new_doc["record_date"] = ist_date.strftime("%Y-%m-%d")
+        
+    except Exception as e:
+        # Log error and return partial document with fallback values
+        logger.error(f"Error processing document {doc.get('_id', 'unknown')}: {str(e)}")
+        new_doc["error"] = f"Processing failed: {str(e)}"
+        new_doc["time_range"] = time_range
+        new_doc["Processing_Time"] = processing_time  # Add UTC processing time even in error case
+        new_doc["record_date"] = (doc.get("Date", datetime.now(pytz.UTC)) + timedelta(hours=5, minutes=30)).strftime("%Y-%m-%d")
+        new_doc["Portal"] = determine_portal(new_doc.get("user_name"))
+        
+    return new_doc
+
+def convert_elapsed_time(value, doc):
+    """Convert elapsed_time from milliseconds to seconds; a non-numeric value raises like process_document."""
+    return value / 1000.0 if value is not None else None
+
+# Field extraction compiled once from FIELDS_TO_EXTRACT
+extract_fields = compile_extractor(
+    FIELDS_TO_EXTRACT, converters={"elapsed_time": convert_elapsed_time}, message_shape="dict_or_list"
+)
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+IST_OFFSET_MS = 19800000  # IST_OFFSET for server-side date arithmetic
+
+def transform_document(doc, time_range, processing_time):
+    """Compiled fast path with the same output as process_document, which still handles documents that fail."""
+    try:
+        new_doc = extract_fields(doc)
+        new_doc["Portal"] = determine_portal(new_doc["user_name"])
+        new_doc["time_range"] = time_range
+        new_doc["Processing_Time"] = processing_time
+        date = doc["Date"]
+        if not isinstance(date, datetime):
+            raise ValueError("Invalid Date field")
+        new_doc["record_date"] = format_record_date((date + IST_OFFSET).date())
+        return new_doc
+    except Exception:
+        return process_document(doc, time_range, processing_time)
+
+def aggregation_pipeline(query, time_range, processing_time, sort=None, **options):
+    """Server-side equivalent of transform_document; options are passed to build_shaping_pipeline."""
+    user_name = {"$toUpper": {"$ifNull": ["$user_name", ""]}}
+    extra_fields = {
+        "Portal": {"$switch": {
+            "branches": [
+                {"case": {"$gte": [{"$indexOfCP": [user_name, "B2B"]}, 0]}, "then": "B2B"},
+                {"case": {"$gte": [{"$indexOfCP": [user_name, "CORPORATE"]}, 0]}, "then": "CORPORATE"},
+            ],
+            "default": "B2C",
+        }},
+        "time_range": {"$literal": time_range},
+        "Processing_Time": {"$literal": processing_time},
+        "record_date": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$add": ["$Date", IST_OFFSET_MS]}}},
+    }
+    return build_shaping_pipeline(
+        query, PROJECTION, FIELDS_TO_EXTRACT, extra_fields,
+        converters={"elapsed_time": lambda value: {"$cond": [{"$eq": [value, None]}, None, {"$divide": [value, 1000]}]}},
+        # Anything else makes process_document take its error path, so leave it to Python
+        field_types={
+            "elapsed_time": ["int", "long", "double", "null", "missing"],
+            "user_name": ["string", "null", "missing"],
+        },
+        message_shape="dict_or_list", sort=sort, **options
+    )
+
+def transform_args(source, start_time, end_time, processing_time):
+    """Arguments after doc for transform_document, process_document and aggregation_pipeline."""
+    return format_time_range(start_time, end_time), processing_time
+
+# Per-minute/hour call counts, mean elapsed_time and iserror counts by Portal and method_name
+ROLLUP = Rollup("Date", ["Portal", "method_name"], sums=["elapsed_time"], flags={"errors": ("iserror", is_set)})
+
+# Mergeable p50..p99 of elapsed_time by method_name
+LATENCY_SKETCHES = LatencySketches("Date", [("method_name",)], ["elapsed_time"])
+
+def synthetic_docs(num_docs):
+    """Synthetic third-party logs over the last five minutes; half have a list-shaped Message."""
+    user_names = ["EMTB2BIN_agent", "EMTCORPORATEIN_acme", "guest", None]
+    response = synthetic_payload("Result", 4000)  # Not extracted; left behind by the projection
+    docs = []
+    for i, date in enumerate(synthetic_timestamps(num_docs)):
+        message = {field: f"{field}-{i % 100}" for field in FIELDS_TO_EXTRACT["message"]}
+        message.update({
+            "elapsed_time": i % 5000, "user_name": user_names[i % 4], "iserror": i % 20 == 0, "response": response
+        })
+        docs.append({
+            "_id": i, "Date": date, "level": "Information", "countrycode": "IN", "citycode": "DEL",
+            "Message": [message] if i % 2 else message
+        })
+    return docs
+
+SPEC = JobSpec(
+    name=TARGET_COLLECTION,
+    source_uri=SOURCE_MONGO_URI, source_db=SOURCE_DATABASE_NAME, sources=[SOURCE_COLLECTION],
+    target_uri=TARGET_MONGO_URI, target_db=TARGET_DATABASE_NAME, target=TARGET_COLLECTION,
+    time_field="Date", projection=PROJECTION, raw_bson=True,
+    transform=transform_document, transform_args=transform_args, reference_transform=process_document,
+    aggregation_pipeline=aggregation_pipeline, synthetic_docs=synthetic_docs,
+    rollup=ROLLUP, latency_sketches=LATENCY_SKETCHES,
+    layout_meta_fields=["Portal", "record_date"],  # Bucket keys if storage_layout is not "flat"
+    target_indexes=(
+        [("Processing_Time", pymongo.DESCENDING)],
+        [("record_date", pymongo.ASCENDING), ("Portal", pymongo.ASCENDING)],  # Dashboard filters
+    ),
+    log_file="Processed_Thirdpary_processing.log",
+    batch_bytes=64 * 1024 * 1024, max_rss_mb=1024,
+    shards=4,  # The single source dominates each run; large windows are read as four concurrent ranges
+)
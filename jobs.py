@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Registry of every ETL job the engine can run, by name."""
+
+import job_ecom
+import job_merged_api
+import job_reprice
+import job_search_data
+import job_third_party
+
+JOBS = {
+    spec.name: spec for spec in (
+        job_merged_api.SPEC,
+        job_third_party.SPEC,
+        job_reprice.SPEC,
+        job_ecom.SPEC,
+        job_search_data.SPEC,
+    )
+}
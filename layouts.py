@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Storage layouts for a job's target collection. The default flat layout writes one document per
+processed log row; the two bucketed layouts store the fields that repeat across rows once per
+bucket instead of once per row:
+
+- "timeseries": a MongoDB time-series collection (5.0+) with the layout's meta_fields as its
+  metaField, so the server groups rows into compressed columnar buckets per meta value.
+- "buckets": our own bucket documents per meta value per minute, holding a column (array) per
+  field, written with one idempotent pipeline upsert per bucket. A bucket takes rows until it
+  holds MAX_BUCKET_BYTES of them; the rows after that start another bucket for the same minute,
+  so a busy airline's minute never reaches MongoDB's 16 MB document limit:
+
+    {"_id": ObjectId(...), "airline_name": "Indigo", "minute": ISODate("2025-04-12T10:05:00Z"),
+     "count": 812, "bytes": 2095431, "Processing_Time": <latest run>,
+     "time_ranges": ["15:33:00 - 15:35:00 (IST)"], "_ids": [...], "InsertOn": [...], "elapsed_time": [...]}
+
+Neither layout has a unique index on the rows' _id, so re-read rows are filtered out against the
+target before they are written; rollups and sketches see only the rows actually added.
+
+Flat stays the default. `benchmarks.py layouts JOB --offline --docs 100000` on synthetic rows
+(one airline or portal per source, 20,000 rows a minute) gives, per row:
+
+    job                  bytes stored        bytes sent              encode us    index entries
+                         flat    buckets     flat   buckets  ts      flat  bkt  ts   flat  buckets
+    Merged_API_Airline   2837    2559        2837   2734     2848    10    41   23   3     1.0
+    Processed_Thirdpary   425     257         425    331      436     7    25   16   3     1.0
+    Processed_Repricing   409     207         409    314      420     7    25   16   3     1.0
+
+Buckets cut the two narrow targets' uncompressed size by 40-50% and their index entries to a third,
+at three to four times the client-side cost per row. Merged_API_Airline's rows are mostly
+extracted payload, so buckets save only 10% there, and at this rate each airline's minute fills
+seven capped buckets (the largest 7.6 MB). Time-series rows cost as much to send as flat
+ones and are only smaller once the server has compressed them.
+
+Compressed storage, write throughput and dashboard latency have not been measured on a server
+yet (`benchmarks.py layouts JOB --uri ...`); no bucketed layout should be enabled before they are.
+"""
+
+import bson
+import pymongo
+from pymongo import UpdateOne
+
+from rollups import truncate
+
+LAYOUTS = ("timeseries", "buckets")
+PER_RUN_FIELDS = ("time_range", "Processing_Time")  # Same for every row of a run; kept once per bucket
+# Row bytes per bucket: half the 16 MB document limit, leaving room for the column arrays' index keys
+MAX_BUCKET_BYTES = 8 * 1024 * 1024
+
+
+class StorageLayout:
+    """
+    How to store a job's target rows: kind is one of LAYOUTS, time_field the rows' event time and
+    meta_fields the low-cardinality fields rows are bucketed by.
+    """
+
+    def __init__(self, kind, time_field, meta_fields):
+        if kind not in LAYOUTS:
+            raise ValueError(f"Unknown storage layout {kind!r}; choose from {', '.join(LAYOUTS)}")
+        self.kind = kind
+        self.time_field = time_field
+        self.meta_fields = list(meta_fields)
+
+    def latest_processing_time(self, collection):
+        """Processing_Time of the latest run stored in the target, or None."""
+        path = "meta.Processing_Time" if self.kind == "timeseries" else "Processing_Time"
+        latest = collection.find_one({path: {"$ne": None}}, {path: 1}, sort=[(path, pymongo.DESCENDING)])
+        if not latest:
+            return None
+        return latest["meta"]["Processing_Time"] if self.kind == "timeseries" else latest["Processing_Time"]
+
+    def prepare(self, db, target):
+        """Create the target collection with this layout, refusing to reuse a flat collection."""
+        existing = {info["name"]: info for info in db.list_collections(filter={"name": target})}
+        if self.kind == "timeseries":
+            if target not in existing:
+                db.create_collection(target, timeseries={
+                    "timeField": self.time_field, "metaField": "meta", "granularity": "seconds"
+                })
+            elif existing[target].get("type") != "timeseries":
+                raise ValueError(f"{target} exists and is not a time-series collection; choose another target")
+            db[target].create_index([("meta.Processing_Time", pymongo.DESCENDING)])
+        else:
+            db[target].create_index([(field, pymongo.ASCENDING) for field in self.meta_fields] + [("minute", 1)])
+            db[target].create_index([("minute", pymongo.ASCENDING)])
+            db[target].create_index([("_ids", pymongo.ASCENDING)])
+            db[target].create_index([("Processing_Time", pymongo.DESCENDING)])
+
+    def new_docs(self, collection, docs):
+        """docs whose _id is not stored yet, looked up within the batch's time range only."""
+        times = [doc[self.time_field] for doc in docs]
+        ids = [doc["_id"] for doc in docs]
+        if self.kind == "timeseries":
+            query = {self.time_field: {"$gte": min(times), "$lte": max(times)}, "_id": {"$in": ids}}
+            stored = {doc["_id"] for doc in collection.find(query, {"_id": 1})}
+        else:
+            query = {"minute": {"$gte": truncate(min(times), "Minute"), "$lte": max(times)}, "_ids": {"$in": ids}}
+            stored = set()
+            for bucket in collection.find(query, {"_ids": 1}):
+                stored.update(bucket["_ids"])
+        return [doc for doc in docs if doc["_id"] not in stored]
+
+    def insert(self, collection, docs):
+        """Write target rows in this layout; returns the rows actually added."""
+        docs = [doc for doc in docs if doc.get(self.time_field) is not None]
+        if not docs:
+            return []
+        docs = self.new_docs(collection, docs)
+        if not docs:
+            return []
+        if self.kind == "timeseries":
+            collection.insert_many([self._timeseries_doc(doc) for doc in docs], ordered=False)
+        else:
+            collection.bulk_write(self._bucket_updates(docs), ordered=False)
+        return docs
+
+    def _timeseries_doc(self, doc):
+        meta_doc = {"meta": {field: doc.get(field) for field in self.meta_fields + list(PER_RUN_FIELDS)}}
+        meta_doc.update((field, value) for field, value in doc.items() if field not in meta_doc["meta"])
+        return meta_doc
+
+    def _bucket_updates(self, docs):
+        """
+        One pipeline upsert per bucket and up to MAX_BUCKET_BYTES of rows, appending only rows whose
+        _id the bucket does not hold yet. It goes to a bucket of the same meta values and minute with
+        room for the rows, or starts a new one.
+        """
+        buckets = {}
+        for doc in docs:
+            key = tuple(doc.get(field) for field in self.meta_fields) + (truncate(doc[self.time_field], "Minute"),)
+            buckets.setdefault(key, []).append(doc)
+
+        requests = []
+        for key, key_rows in buckets.items():
+            for rows, sizes in chunks_by_bytes(key_rows, MAX_BUCKET_BYTES):
+                requests.append(self._bucket_update(key, rows, sizes))
+        return requests
+
+    def _bucket_update(self, key, rows, sizes):
+        """The upsert of rows (with their BSON sizes) into a bucket of key with room for them."""
+        bucket = dict(zip(self.meta_fields, key[:-1]), minute=key[-1])
+        columns = []
+        for row in rows:
+            for field in row:
+                if field not in columns and field not in self.meta_fields and field not in PER_RUN_FIELDS:
+                    columns.append(field)
+        new_rows = {"$filter": {
+            "input": {"$literal": [
+                dict({field: row.get(field) for field in columns}, _bytes=size) for row, size in zip(rows, sizes)
+            ]},
+            "cond": {"$not": [{"$in": ["$$this._id", {"$ifNull": ["$_ids", []]}]}]},
+        }}
+        # Every column stays as long as _ids: a column new to the bucket starts with nulls for
+        # the rows already stored, and a stored column these rows lack gets nulls for them
+        names = ["_ids" if field == "_id" else field for field in columns]
+        stored_rows_nulls = {"$map": {"input": {"$ifNull": ["$_ids", []]}, "in": None}}
+        pad_missing = {"$replaceWith": {"$arrayToObject": {"$map": {"input": {"$objectToArray": "$$ROOT"}, "in": {
+            "$cond": [
+                {"$and": [{"$isArray": "$$this.v"}, {"$not": [{"$in": ["$$this.k", names + ["_new", "time_ranges"]]}]}]},
+                {"k": "$$this.k", "v": {"$concatArrays": ["$$this.v", {"$map": {"input": "$_new", "in": None}}]}},
+                "$$this",
+            ]
+        }}}}}
+        append = {
+            name: {"$concatArrays": [
+                {"$ifNull": ["$" + name, stored_rows_nulls]},
+                {"$map": {"input": "$_new", "in": f"$$this.{field}"}},
+            ]}
+            for field, name in zip(columns, names)
+        }
+        processing_time = max((row["Processing_Time"] for row in rows if row.get("Processing_Time")), default=None)
+        time_ranges = sorted({row["time_range"] for row in rows if row.get("time_range")})
+        pipeline = [
+            {"$set": {"_new": new_rows}},
+            pad_missing,
+            {"$set": dict(
+                append,
+                **{field: {"$literal": value} for field, value in bucket.items()},
+                count={"$add": [{"$ifNull": ["$count", 0]}, {"$size": "$_new"}]},
+                bytes={"$add": [{"$ifNull": ["$bytes", 0]}, {"$sum": "$_new._bytes"}]},
+                Processing_Time={"$max": ["$Processing_Time", {"$literal": processing_time}]},
+                time_ranges={"$setUnion": [
+                    {"$ifNull": ["$time_ranges", []]}, {"$literal": time_ranges}
+                ]},
+            )},
+            {"$unset": "_new"},
+        ]
+        room = {"bytes": {"$lte": MAX_BUCKET_BYTES - sum(sizes)}}
+        return UpdateOne(dict(bucket, **room), pipeline, upsert=True)
+
+
+def chunks_by_bytes(rows, max_bytes):
+    """(rows, their BSON sizes) in runs of at most max_bytes (a larger row goes alone)."""
+    chunk, sizes, total = [], [], 0
+    for row in rows:
+        size = len(bson.encode(row))
+        if chunk and total + size > max_bytes:
+            yield chunk, sizes
+            chunk, sizes, total = [], [], 0
+        chunk.append(row)
+        sizes.append(size)
+        total += size
+    if chunk:
+        yield chunk, sizes
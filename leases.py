@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Leases in MongoDB, so any number of worker processes on any hosts can share the jobs without
+overlapping and without lock files that outlive a crash.
+
+A lease is one document per (job, source collection), owned by one worker until expires_at.
+The owner's heartbeat thread extends every lease it holds every ttl / 3. A worker that dies
+stops renewing, and once its leases expire any other worker claims them. Expiry is decided on
+the server clock ($$NOW), so worker clocks never need to agree.
+
+Each worker taking part in a job also holds a "member" lease. Per run a worker claims up to its
+fair share of the job's sources, ceil(sources / live members), keeps the ones it already holds
+and gives back any above its share, so the 32 airline collections spread across however many
+workers are running and move to the survivors when one dies.
+
+    {"_id": "Merged_API_Airline:Indigo_RQ_RS", "kind": "source", "job": "Merged_API_Airline",
+     "owner": "etl-2:4121:9f3c01ab", "acquired_at": ..., "heartbeat_at": ..., "expires_at": ...}
+"""
+
+import logging
+import math
+import os
+import socket
+import threading
+import uuid
+import zlib
+from datetime import timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+LEASE_COLLECTION = "ETL_Leases"
+LEASE_TTL = timedelta(seconds=60)
+
+
+def worker_id():
+    """host:pid:random, unique per process even when a pid is reused."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseStore:
+    """Leases in one database, held on behalf of owner and kept alive by a heartbeat thread."""
+
+    def __init__(self, db, owner=None, ttl=LEASE_TTL, collection_name=LEASE_COLLECTION, logger=None):
+        self.collection = db[collection_name]
+        self.owner = owner or worker_id()
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger()
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat = None
+        # Expired leases are claimable straight away; the TTL index only clears them out later
+        self.collection.create_index("expires_at", expireAfterSeconds=int(ttl.total_seconds()) * 10)
+        self.collection.create_index([("kind", 1), ("job", 1), ("expires_at", 1)])
+
+    @staticmethod
+    def source_key(job, source):
+        return f"{job}:{source}"
+
+    def _renewal(self, **fields):
+        ttl_ms = int(self.ttl.total_seconds() * 1000)
+        return [{"$set": dict(
+            fields,
+            owner=self.owner,
+            acquired_at={"$cond": [{"$eq": ["$owner", self.owner]}, "$acquired_at", "$$NOW"]},
+            heartbeat_at="$$NOW",
+            expires_at={"$add": ["$$NOW", ttl_ms]},
+        )}]
+
+    def acquire(self, name, kind, job):
+        """Take or renew lease name; False while another worker holds it unexpired."""
+        claimable = {"_id": name, "$or": [
+            {"owner": self.owner}, {"$expr": {"$lt": ["$expires_at", "$$NOW"]}},
+        ]}
+        try:
+            previous = self.collection.find_one_and_update(
+                claimable, self._renewal(kind=kind, job=job), upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            return False  # The upsert raced a live lease's _id: someone else holds it
+        if previous and previous.get("owner") not in (None, self.owner):
+            self.logger.warning(
+                f"Took over lease {name} from {previous['owner']} (expired {previous.get('expires_at')})"
+            )
+        with self._lock:
+            self._held.add(name)
+        self._start_heartbeat()
+        return True
+
+    def release(self, name):
+        with self._lock:
+            self._held.discard(name)
+        self.collection.delete_one({"_id": name, "owner": self.owner})
+
+    def holds(self, name):
+        """Whether this worker still holds name (False once a renewal has failed)."""
+        with self._lock:
+            return name in self._held
+
+    def held(self, kind=None, job=None):
+        """Names of this worker's leases, from the server (kind and job narrow them)."""
+        query = {"owner": self.owner}
+        if kind:
+            query["kind"] = kind
+        if job:
+            query["job"] = job
+        return [doc["_id"] for doc in self.collection.find(query, {"_id": 1})]
+
+    def live_members(self, job):
+        return self.collection.count_documents({
+            "kind": "member", "job": job, "$expr": {"$gt": ["$expires_at", "$$NOW"]},
+        })
+
+    def claim_sources(self, job, sources):
+        """
+        The sources of job this worker should process now: the ones it already holds plus unclaimed
+        or expired ones, up to its fair share; holdings above the share are released.
+        """
+        self.acquire(f"{job}:member:{self.owner}", "member", job)
+        share = math.ceil(len(sources) / max(1, self.live_members(job)))
+        keys = {self.source_key(job, source): source for source in sources}
+        already = [key for key in self.held("source", job) if key in keys]
+        claimed = [keys[key] for key in already[:share] if self.acquire(key, "source", job)]
+        for key in already[share:]:
+            self.release(key)  # Another member's share now
+        # Start at a per-worker offset so workers do not all race for the same first sources
+        offset = zlib.crc32(self.owner.encode()) % max(1, len(sources))
+        for source in sources[offset:] + sources[:offset]:
+            if len(claimed) >= share:
+                break
+            if source not in claimed and self.acquire(self.source_key(job, source), "source", job):
+                claimed.append(source)
+        return claimed
+
+    def claim_all(self, job, sources):
+        """Every source of job, or none (False) if another worker holds any of them."""
+        claimed = []
+        for source in sources:
+            if not self.acquire(self.source_key(job, source), "source", job):
+                for key in claimed:
+                    self.release(key)
+                return False
+            claimed.append(self.source_key(job, source))
+        return True
+
+    def release_job(self, job):
+        for name in self.held(job=job):
+            self.release(name)
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(target=self._beat, name="lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stop_event.wait(self.ttl.total_seconds() / 3):
+            with self._lock:
+                names = list(self._held)
+            for name in names:
+                try:
+                    renewed = self.collection.update_one(
+                        {"_id": name, "owner": self.owner}, self._renewal()
+                    ).matched_count
+                except Exception as e:
+                    self.logger.error(f"Could not renew lease {name}: {str(e)}")
+                    continue  # Still ours until it expires; the next beat retries
+                if not renewed:
+                    self.logger.error(f"Lost lease {name}; another worker has taken it over")
+                    with self._lock:
+                        self._held.discard(name)
+
+    def close(self):
+        """Stop the heartbeat and hand back every lease, so other workers need not wait for expiry."""
+        self._stop_event.set()
+        for name in self.held():
+            self.release(name)
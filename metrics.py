@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Per-stage ETL metrics in the Prometheus text exposition format.
+
+The engine records counters, gauges and histograms tagged by job and source collection into the
+process-wide REGISTRY. They can be scraped from a local HTTP endpoint or written to a text file
+for node_exporter's textfile collector:
+
+    python etl_engine.py daemon --metrics-port 9108
+    python etl_engine.py run Processed_Thirdpary --metrics-file /var/lib/node_exporter/etl.prom
+"""
+
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a single small batch to a multi-minute outage catch-up
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+PER_DOC_BUCKETS = (1e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3)
+BATCH_SIZE_BUCKETS = (1, 10, 100, 1000, 5000, 10000, 25000, 50000, 100000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names, lock):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = lock
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines += self._render_sample(key, value)
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names, lock, buckets):
+        super().__init__(name, help_text, label_names, lock)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """Named metrics of one process; re-registering a name returns the existing metric."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, help_text, label_names, **options):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help_text, label_names, self._lock, **options)
+            metric = self._metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError(f"{name} is already registered as a {metric.kind}")
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter, name, help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Gauge, name, help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def render(self):
+        """Every metric in the text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write render() to path atomically, so a collector never reads a half-written file."""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+
+class ETLMetrics:
+    """The engine's metrics, all labelled by job and source collection."""
+
+    def __init__(self, registry=REGISTRY):
+        labels = ("job", "source")
+        self.read_seconds = registry.histogram(
+            "etl_read_seconds", "Time to read one source batch", labels)
+        self.transform_seconds_per_doc = registry.histogram(
+            "etl_transform_seconds_per_document", "Transform time per document, averaged over a batch", labels,
+            buckets=PER_DOC_BUCKETS)
+        self.insert_seconds = registry.histogram(
+            "etl_insert_seconds", "insert_many latency per batch and target collection", labels + ("target",))
+        self.batch_documents = registry.histogram(
+            "etl_batch_documents", "Source documents per batch", labels, buckets=BATCH_SIZE_BUCKETS)
+        self.documents_read = registry.counter(
+            "etl_documents_read_total", "Source documents read", labels)
+        self.documents_written = registry.counter(
+            "etl_documents_written_total", "Documents inserted into the job's target", labels)
+        self.issue_documents = registry.counter(
+            "etl_issue_documents_total", "Documents that failed to transform and went to the issue target", labels)
+        self.skipped_documents = registry.counter(
+            "etl_skipped_documents_total", "Source documents skipped as duplicates or unusable", labels)
+        self.duplicate_documents = registry.counter(
+            "etl_duplicate_documents_total", "Target documents not inserted because their _id was already there",
+            labels)
+        self.bytes_read = registry.counter(
+            "etl_bytes_read_total", "BSON bytes of the (projected) source documents read", labels)
+        self.bytes_written = registry.counter(
+            "etl_bytes_written_total", "BSON bytes of the documents inserted", labels)
+        self.watermark_lag = registry.gauge(
+            "etl_watermark_lag_seconds", "Time between now and the source's committed checkpoint", labels)
+        self.source_failures = registry.counter(
+            "etl_source_failures_total", "Runs in which a source collection failed", labels)
+        self.batch_budget_bytes = registry.gauge(
+            "etl_batch_budget_bytes", "Current byte budget of the source's adaptively sized batches", labels)
+        self.rss_bytes = registry.gauge(
+            "etl_rss_bytes", "Resident memory of the process, sampled after each adaptively sized batch", ("job",))
+        self.sources_claimed = registry.gauge(
+            "etl_sources_claimed", "Source collections this worker holds leases on in its latest run", ("job",))
+        self.runs = registry.counter(
+            "etl_runs_total", "Windowed runs by outcome", ("job", "status"))
+        self.run_seconds = registry.histogram(
+            "etl_run_seconds", "Duration of a windowed run", ("job",))
+
+
+def timed_batches(batches, histogram, **labels):
+    """Pass batches through unchanged, observing how long each one took to produce."""
+    iterator = iter(batches)
+    while True:
+        started = time.perf_counter()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - started, **labels)
+        yield batch
+
+
+def serve(port, registry=REGISTRY, host="0.0.0.0", logger=None):
+    """Serve registry at http://host:port/metrics from a daemon thread; returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Scrapes every few seconds would drown the job logs
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    (logger or logging.getLogger()).info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def write_textfile_every(path, seconds, registry=REGISTRY, logger=None):
+    """Rewrite path from registry every `seconds` from a daemon thread; returns an Event that stops it."""
+    logger = logger or logging.getLogger()
+    stop_event = threading.Event()
+
+    def write():
+        try:
+            registry.write_textfile(path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {str(e)}")
+
+    def loop():
+        write()
+        while not stop_event.wait(seconds):
+            write()
+        write()  # Final values once the caller has finished
+    threading.Thread(target=loop, name="metrics-textfile", daemon=True).start()
+    return stop_event
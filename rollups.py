@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Dashboard rollups: per-minute and per-hour aggregates of a job's target documents, maintained as
+part of ingest so the dashboard reads a few thousand pre-aggregated rows instead of raw logs.
+
+Each rollup document covers one bucket and one combination of the job's dimensions:
+
+    {"_id": {"bucket": <minute or hour start>, "airline_name": "Indigo", "FlightType": "Domestic"},
+     "bucket": ..., "airline_name": "Indigo", "FlightType": "Domestic",
+     "count": 1200, "response_time_sum": 3.4e5, "response_time_count": 1180, "exceptions": 7}
+
+The mean of a measure over any range is sum(<field>_sum) / sum(<field>_count). Only documents the
+engine actually inserted are counted, so re-reading an overlap never double counts; a crash between
+an insert and its rollup update loses that batch's contribution, which rebuild() recomputes.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+import pymongo
+from pymongo import UpdateOne
+
+from etl_common import iter_chunks
+
+GRANULARITIES = ("Minute", "Hour")
+
+
+def truncate(moment, granularity):
+    """Start of the minute or hour containing moment."""
+    if granularity == "Minute":
+        return moment.replace(second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_set(value):
+    """True for flags the source logs as True, 1, "true" or "1"."""
+    return value is True or value == 1 or (isinstance(value, str) and value.strip().lower() in ("true", "1"))
+
+
+class Rollup:
+    """
+    What to aggregate for one job: target documents are bucketed on time_field and grouped by
+    dimensions; each numeric field in sums gets a <field>_sum and <field>_count, and each
+    flags entry name -> (field, predicate) counts the documents whose field value it is true for.
+    """
+
+    def __init__(self, time_field, dimensions, sums=(), flags=None):
+        self.time_field = time_field
+        self.dimensions = list(dimensions)
+        self.sums = list(sums)
+        self.flags = dict(flags or {})
+
+    def collection_names(self, target):
+        """{granularity: rollup collection name} for a target collection."""
+        return {granularity: f"{target}_Rollup_{granularity}" for granularity in GRANULARITIES}
+
+    def accumulate(self, docs, granularity, totals=None):
+        """Add docs into totals, {(bucket, dimension values): {counter: increment}}; returns totals."""
+        totals = {} if totals is None else totals
+        for doc in docs:
+            moment = doc.get(self.time_field)
+            if not isinstance(moment, datetime):
+                continue  # Error documents without a usable timestamp
+            key = (truncate(moment, granularity),) + tuple(doc.get(field) for field in self.dimensions)
+            counters = totals.get(key)
+            if counters is None:
+                counters = totals[key] = {"count": 0}
+            counters["count"] += 1
+            for field in self.sums:
+                value = doc.get(field)
+                if is_number(value):
+                    counters[f"{field}_sum"] = counters.get(f"{field}_sum", 0) + value
+                    counters[f"{field}_count"] = counters.get(f"{field}_count", 0) + 1
+            for name, (field, predicate) in self.flags.items():
+                if predicate(doc.get(field)):
+                    counters[name] = counters.get(name, 0) + 1
+        return totals
+
+    def updates(self, totals):
+        """One $inc upsert per (bucket, dimension values)."""
+        requests = []
+        for key, counters in totals.items():
+            group = {"bucket": key[0]}
+            group.update(zip(self.dimensions, key[1:]))
+            requests.append(UpdateOne(
+                {"_id": group}, {"$setOnInsert": group, "$inc": counters}, upsert=True
+            ))
+        return requests
+
+    def fields(self):
+        """Every target field the rollup reads, as a find() projection."""
+        fields = [self.time_field] + self.dimensions + self.sums + [field for field, _ in self.flags.values()]
+        return {field: 1 for field in fields}
+
+    def indexes(self):
+        """Indexes for the dashboard's range-by-bucket queries, optionally narrowed by dimension."""
+        return [[("bucket", pymongo.ASCENDING)] + [(field, pymongo.ASCENDING) for field in self.dimensions]]
+
+
+def apply(rollup, db, target, docs):
+    """Fold freshly inserted target docs into every granularity's rollup collection."""
+    if not docs:
+        return
+    for granularity, name in rollup.collection_names(target).items():
+        requests = rollup.updates(rollup.accumulate(docs, granularity))
+        if requests:
+            db[name].bulk_write(requests, ordered=False)
+
+
+def prepare(rollup, db, target):
+    for name in rollup.collection_names(target).values():
+        for keys in rollup.indexes():
+            db[name].create_index(keys)
+
+
+def rebuild(rollup, db, target, start_time, end_time, batch_size=50000, logger=None):
+    """
+    Recompute every bucket from start_time to end_time (widened to whole hours) from the target
+    collection. Run it while the job is stopped, or ingest during the rebuild is counted twice.
+    """
+    logger = logger or logging.getLogger()
+    start_time = truncate(start_time, "Hour")
+    if truncate(end_time, "Hour") != end_time:
+        end_time = truncate(end_time, "Hour") + timedelta(hours=1)
+    names = rollup.collection_names(target)
+    for name in names.values():
+        db[name].delete_many({"bucket": {"$gte": start_time, "$lt": end_time}})
+    query = {rollup.time_field: {"$gte": start_time, "$lt": end_time}}
+    cursor = db[target].find(query, rollup.fields()).batch_size(batch_size)
+    totals = {granularity: {} for granularity in names}
+    rebuilt = 0
+    for docs in iter_chunks(cursor, batch_size):
+        for granularity in names:
+            rollup.accumulate(docs, granularity, totals[granularity])
+        rebuilt += len(docs)
+    for granularity, name in names.items():
+        requests = rollup.updates(totals[granularity])
+        if requests:
+            db[name].bulk_write(requests, ordered=False)
+    logger.info(f"Rebuilt {target} rollups from {rebuilt} documents since {start_time.isoformat()}")
+    return rebuilt
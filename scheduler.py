@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Resident scheduler: run ETL jobs on fixed intervals in one long-lived process.
+
+Connection pools, compiled transforms and one-time setup (indexes) stay warm between runs instead of
+being rebuilt by every cron launch. SIGTERM/SIGINT stop the scheduler after in-flight runs finish.
+"""
+
+import logging
+import signal
+import threading
+import time
+from datetime import datetime
+
+import pytz
+
+
+def daemon_job(argv, flag="--daemon"):
+    """Return the job name given after flag (--daemon, --follow) on the command line, or None without the flag."""
+    if flag not in argv:
+        return None
+    position = argv.index(flag) + 1
+    return argv[position] if position < len(argv) else ""
+
+
+def run_mode(argv, job):
+    """
+    How this process should run job: "once" without --daemon/--follow, "daemon" or "follow" when
+    job is the one named after that flag, or None when another job was named.
+    """
+    daemon, following = daemon_job(argv), daemon_job(argv, "--follow")
+    if daemon is None and following is None:
+        return "once"
+    if following == job:
+        return "follow"
+    if daemon == job:
+        return "daemon"
+    return None
+
+
+def stop_on_signals(logger=None):
+    """Return an Event that SIGTERM/SIGINT set, for long-running loops that stop at a safe point."""
+    logger = logger or logging.getLogger()
+    stop_event = threading.Event()
+
+    def stop(*_):
+        logger.info("Stop requested; finishing the current batch")
+        stop_event.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    return stop_event
+
+
+def refresh_every(seconds):
+    """Cache a no-argument function's result and recompute it at most once every `seconds`."""
+    def decorator(fn):
+        cached = {}
+        lock = threading.Lock()
+
+        def wrapper():
+            with lock:
+                now = time.monotonic()
+                if "value" not in cached or now - cached["at"] >= seconds:
+                    cached["value"] = fn()
+                    cached["at"] = now
+                return cached["value"]
+        return wrapper
+    return decorator
+
+
+class Scheduler:
+    """Runs each registered job in its own thread on its own interval until stopped."""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger()
+        self.jobs = []
+        self.status = {}
+        self.stop_event = threading.Event()
+
+    def add_job(self, name, run, interval, freshness=None, prepare=None):
+        """
+        Register run() to be called every `interval` (a timedelta), measured from the start of each run.
+
+        prepare() is called once before the first run. freshness() returns the UTC time the job's
+        output is complete up to; the lag behind now is logged after every run. Without it the start
+        of the last successful run is used.
+        """
+        self.jobs.append({"name": name, "run": run, "interval": interval, "freshness": freshness, "prepare": prepare})
+        self.status[name] = {"runs": 0, "failures": 0, "last_success": None, "lag_seconds": None}
+
+    def stop(self, *_):
+        if not self.stop_event.is_set():
+            self.logger.info("Stop requested; waiting for running jobs to finish")
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def _run_job(self, job):
+        name = job["name"]
+        status = self.status[name]
+        try:
+            if job["prepare"]:
+                job["prepare"]()
+        except Exception as e:
+            self.logger.error(f"{name}: setup failed, job not started: {str(e)}")
+            return
+        interval = job["interval"].total_seconds()
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            started_at = datetime.now(pytz.UTC)
+            try:
+                job["run"]()
+                status["last_success"] = started_at
+            except Exception as e:
+                status["failures"] += 1
+                self.logger.error(f"{name}: run failed: {str(e)}")
+            status["runs"] += 1
+            try:
+                fresh_until = job["freshness"]() if job["freshness"] else status["last_success"]
+            except Exception as e:
+                fresh_until = None
+                self.logger.warning(f"{name}: could not read freshness: {str(e)}")
+            if fresh_until is not None:
+                status["lag_seconds"] = round((datetime.now(pytz.UTC) - fresh_until).total_seconds(), 1)
+            lag = f"{status['lag_seconds']}s" if status["lag_seconds"] is not None else "unknown"
+            self.logger.info(
+                f"{name}: run {status['runs']} took {time.monotonic() - started:.1f}s, "
+                f"freshness lag {lag}, failures {status['failures']}"
+            )
+            self.stop_event.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def run_forever(self):
+        """Start every job and block until stop() (or SIGTERM/SIGINT) and all in-flight runs finish."""
+        threads = [
+            threading.Thread(target=self._run_job, args=(job,), name=f"job-{job['name']}", daemon=True)
+            for job in self.jobs
+        ]
+        for thread in threads:
+            thread.start()
+        self.logger.info(f"Scheduler started with jobs: {', '.join(job['name'] for job in self.jobs)}")
+        # Wait in short slices so signal handlers run promptly in the main thread
+        while any(thread.is_alive() for thread in threads):
+            self.stop_event.wait(1)
+            if self.stop_event.is_set():
+                for thread in threads:
+                    thread.join()
+        self.logger.info("Scheduler stopped")
+        return self.status
+
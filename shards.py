@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Splitting one source's window into disjoint sub-ranges ("shards") that are read, transformed and
+written concurrently, so a single heavy collection is not limited to one reader.
+
+Whether to split is decided by a bounded count: the index is counted only up to shards *
+shard_min_docs keys, never across the whole window. The split points come from the window's
+bounds, not from a count:
+
+- "time" cuts the window into equal slices of time;
+- "index" (time_field windows only) reads split points from the time index, so the slices hold
+  about equal numbers of documents. The size of a slice comes from estimate_window_count's short
+  probe, and each split point is a covered, skipped scan starting from the previous one.
+
+A KeyWindow over the (inserted_date, inserted_time, ...) clock index is always cut in time, at
+second boundaries of its clock strings. Time shards are (start, end] like the window itself and
+KeyWindow shards are [lower, upper) like KeyWindow, so together they cover the window exactly once.
+"""
+
+from bson.min_key import MinKey
+
+from etl_common import estimate_window_count
+from windows import CLOCK_INDEX, KeyWindow, clock_strings, event_time
+
+SHARD_SPLITS = ("index", "time")
+
+
+def count_window(collection, time_field, start_time, end_time, window=None, limit=None):
+    """
+    Source documents in the window, (start_time, end_time] of time_field or a KeyWindow, counted
+    on the index and only up to limit.
+    """
+    options = {"limit": limit} if limit else {}
+    if isinstance(window, KeyWindow):
+        return collection.count_documents(window.as_query(), hint=window.index, **options)
+    return collection.count_documents({time_field: {"$gt": start_time, "$lte": end_time}}, **options)
+
+
+def time_bounds(start_time, end_time, count):
+    """count equal (start, end] slices of (start_time, end_time]."""
+    step = (end_time - start_time) / count
+    bounds = [start_time + step * i for i in range(count)] + [end_time]
+    return list(zip(bounds, bounds[1:]))
+
+
+def index_time_bounds(collection, time_field, start_time, end_time, count, min_docs):
+    """
+    Up to count (start, end] slices of (start_time, end_time] with about equal numbers of
+    documents (at least min_docs each), split at time_field values read from its index.
+    Documents sharing a split point's time all fall in the slice it ends.
+    """
+    step = max(min_docs, estimate_window_count(collection, time_field, start_time, end_time) // count)
+    bounds = [start_time]
+    for _ in range(count - 1):
+        split = next(
+            collection.find({time_field: {"$gt": bounds[-1], "$lte": end_time}}, {time_field: 1, "_id": 0})
+            .sort(time_field, 1)
+            .skip(step - 1)
+            .limit(1),
+            None,
+        )
+        if split is None or split[time_field] >= end_time.replace(tzinfo=None):
+            break
+        bounds.append(split[time_field])
+    bounds.append(end_time)
+    return list(zip(bounds, bounds[1:]))
+
+
+def splits_in_time(window):
+    """True if window's index starts with the clock fields, so it can be cut with clock_key_windows."""
+    return window.fields[:2] == [field for field, _ in CLOCK_INDEX[:2]]
+
+
+def clock_key_windows(window, count):
+    """Up to count KeyWindows covering a clock-index window, cut into equal whole-second slices of time."""
+    start, end = event_time(*window.lower[:2]), event_time(*window.upper[:2])
+    if start is None or end is None or end <= start:
+        return [window]
+    bounds = [window.lower]
+    for _, split in time_bounds(start, end, count)[:-1]:
+        key = clock_strings(split) + (MinKey(),) * (len(window.fields) - 2)
+        if bounds[-1][:2] < key[:2] < window.upper[:2]:
+            bounds.append(key)
+    bounds.append(window.upper)
+    return [KeyWindow(window.index, lower, upper) for lower, upper in zip(bounds, bounds[1:])]
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Mergeable latency sketches for percentile charts.
+
+A DDSketch keeps counts in logarithmically sized bins, so every quantile it returns is within a
+relative error of ALPHA (1%) of the exact value: p99 = 2.00s is reported as 1.98s..2.02s. Sketches
+of any two buckets merge by adding bin counts, with the same guarantee, so a p99 over a day is the
+merge of its minute or hour buckets rather than a scan of the raw rows. A serialised sketch is a
+few hundred bytes (a 1ms..100s spread needs at most ~580 bins).
+
+The engine stores one document per granularity bucket, source collection and group, holding a
+sketch per latency field:
+
+    {"_id": {"bucket": <minute or hour>, "source": "Indigo_RQ_RS", "org": "DEL", "des": "BOM"},
+     "bucket": ..., "source": "Indigo_RQ_RS", "org": "DEL", "des": "BOM",
+     "sketches": {"elapsed_time": BinData(...), "Airline_elapsed_time": BinData(...)}}
+
+Documents are updated by read, merge and replace, which is only safe with one writer per source
+collection at a time. A source read as one pipeline applies each batch as it is inserted; a source
+read as concurrent shards collects its sketches in a SketchBuffer and stores them once, after every
+shard has finished. Queries merge across sources and buckets.
+"""
+
+import math
+import struct
+import threading
+from datetime import datetime
+
+import pymongo
+from bson.binary import Binary
+from pymongo import ReplaceOne
+
+from rollups import GRANULARITIES, truncate
+
+ALPHA = 0.01  # Relative accuracy of every quantile
+MAX_BINS = 2048  # Beyond this the lowest bins are collapsed, so only the lowest quantiles lose accuracy
+MIN_INDEXABLE = 1e-9  # Smaller values (and negatives) are counted as zero
+
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct(">Bd")
+_STATS = struct.Struct(">ddd")
+
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+class DDSketch:
+    """Quantile sketch with relative accuracy alpha; see the module docstring."""
+
+    def __init__(self, alpha=ALPHA, max_bins=MAX_BINS):
+        self.alpha = alpha
+        self.max_bins = max_bins
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        if value > MIN_INDEXABLE:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        else:
+            self.zero_count += weight
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self):
+        """Fold the lowest bins into one so at most max_bins remain."""
+        indexes = sorted(self.bins)
+        excess = indexes[:len(indexes) - self.max_bins + 1]
+        self.bins[excess[-1]] = sum(self.bins.pop(index) for index in excess)
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError(f"Cannot merge sketches with accuracy {other.alpha} into {self.alpha}")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Value at quantile q (0..1), within alpha relative error; None for an empty sketch."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        cumulative = self.zero_count
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def to_bytes(self):
+        out = bytearray(_HEADER.pack(_FORMAT_VERSION, self.alpha))
+        out += _STATS.pack(self.sum, self.min, self.max)
+        _write_varint(out, self.zero_count)
+        _write_varint(out, len(self.bins))
+        previous = 0
+        for index in sorted(self.bins):
+            _write_varint(out, _zigzag(index - previous))  # Deltas between neighbouring bins stay small
+            _write_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, alpha = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format version {version}")
+        sketch = cls(alpha)
+        sketch.sum, sketch.min, sketch.max = _STATS.unpack_from(data, _HEADER.size)
+        offset = _HEADER.size + _STATS.size
+        sketch.zero_count, offset = _read_varint(data, offset)
+        num_bins, offset = _read_varint(data, offset)
+        index = 0
+        for _ in range(num_bins):
+            delta, offset = _read_varint(data, offset)
+            count, offset = _read_varint(data, offset)
+            index += _unzigzag(delta)
+            sketch.bins[index] = count
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        return sketch
+
+
+def to_float(value):
+    """A latency as float: numbers as they are, numeric strings parsed, anything else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+        return value if math.isfinite(value) else None
+    return None
+
+
+class LatencySketches:
+    """
+    Which latencies to sketch for one job: target documents are bucketed on time_field, and for
+    each grouping (a tuple of dimension fields) every field in fields gets a sketch per group.
+    """
+
+    def __init__(self, time_field, groupings, fields, alpha=ALPHA):
+        self.time_field = time_field
+        self.groupings = [tuple(grouping) for grouping in groupings]
+        self.fields = list(fields)
+        self.alpha = alpha
+
+    def collection_names(self, target):
+        """{granularity: sketch collection name} for a target collection."""
+        return {granularity: f"{target}_Sketch_{granularity}" for granularity in GRANULARITIES}
+
+    def accumulate(self, docs, source, granularity):
+        """[(document _id, {field: DDSketch})] for docs, one _id per (bucket, source, group)."""
+        sketches = {}
+        for doc in docs:
+            moment = doc.get(self.time_field)
+            if not isinstance(moment, datetime):
+                continue
+            bucket = truncate(moment, granularity)
+            values = [(field, to_float(doc.get(field))) for field in self.fields]
+            values = [(field, value) for field, value in values if value is not None]
+            if not values:
+                continue
+            for grouping in self.groupings:
+                key = (bucket,) + tuple((dimension, doc.get(dimension)) for dimension in grouping)
+                by_field = sketches.get(key)
+                if by_field is None:
+                    by_field = sketches[key] = {}
+                for field, value in values:
+                    sketch = by_field.get(field)
+                    if sketch is None:
+                        sketch = by_field[field] = DDSketch(self.alpha)
+                    sketch.add(value)
+        return [(self._id(key, source), by_field) for key, by_field in sketches.items()]
+
+    @staticmethod
+    def _id(key, source):
+        _id = {"bucket": key[0], "source": source}
+        _id.update(key[1:])
+        return _id
+
+    def indexes(self):
+        """One index per grouping, for range-by-bucket queries narrowed by group."""
+        return [
+            [("bucket", pymongo.ASCENDING)] + [(dimension, pymongo.ASCENDING) for dimension in grouping]
+            for grouping in self.groupings
+        ]
+
+
+class SketchBuffer:
+    """
+    Sketches of one source's inserted target docs, merged in memory from any number of threads
+    (add) and stored with a single read, merge and replace per bucket (flush).
+    """
+
+    def __init__(self, spec, source):
+        self.spec = spec
+        self.source = source
+        self._updates = {granularity: {} for granularity in GRANULARITIES}  # {_key: (_id, {field: DDSketch})}
+        self._lock = threading.Lock()
+
+    def add(self, docs):
+        if not docs:
+            return
+        accumulated = {
+            granularity: self.spec.accumulate(docs, self.source, granularity) for granularity in GRANULARITIES
+        }
+        with self._lock:
+            for granularity, updates in accumulated.items():
+                pending = self._updates[granularity]
+                for _id, by_field in updates:
+                    held = pending.get(_key(_id))
+                    if held is None:
+                        pending[_key(_id)] = (_id, by_field)
+                        continue
+                    for field, sketch in by_field.items():
+                        if field in held[1]:
+                            held[1][field].merge(sketch)
+                        else:
+                            held[1][field] = sketch
+
+    def flush(self, db, target):
+        with self._lock:
+            updates, self._updates = self._updates, {granularity: {} for granularity in GRANULARITIES}
+        names = self.spec.collection_names(target)
+        for granularity, pending in updates.items():
+            _store(db[names[granularity]], list(pending.values()))
+
+
+def apply(spec, db, target, source, docs):
+    """Merge sketches of freshly inserted target docs into the stored ones for their buckets."""
+    if not docs:
+        return
+    for granularity, name in spec.collection_names(target).items():
+        _store(db[name], spec.accumulate(docs, source, granularity))
+
+
+def _store(collection, updates):
+    """Merge [(_id, {field: DDSketch})] into the stored sketch documents."""
+    if not updates:
+        return
+    stored = {
+        _key(doc["_id"]): doc.get("sketches", {})
+        for doc in collection.find({"_id": {"$in": [_id for _id, _ in updates]}}, {"sketches": 1})
+    }
+    requests = []
+    for _id, by_field in updates:
+        blobs = dict(stored.get(_key(_id), {}))
+        for field, sketch in by_field.items():
+            if field in blobs:
+                sketch.merge(DDSketch.from_bytes(blobs[field]))
+            blobs[field] = Binary(sketch.to_bytes())
+        requests.append(ReplaceOne({"_id": _id}, dict(_id, _id=_id, sketches=blobs), upsert=True))
+    collection.bulk_write(requests, ordered=False)
+
+
+def _key(_id):
+    """Hashable form of a sketch document _id."""
+    return tuple(sorted(_id.items()))
+
+
+def prepare(spec, db, target):
+    for name in spec.collection_names(target).values():
+        for keys in spec.indexes():
+            db[name].create_index(keys)
+
+
+def query(spec, db, target, field, start_time, end_time, grouping, group=None, granularity="Minute"):
+    """
+    DDSketch of field over buckets starting in [start_time, end_time), merged across sources and
+    every group of grouping; group narrows it to some dimension values, e.g. grouping ("org", "des")
+    with group {"org": "DEL", "des": "BOM"}.
+    """
+    grouping = tuple(grouping)
+    if grouping not in spec.groupings:
+        raise ValueError(f"grouping must be one of {spec.groupings}, got {grouping}")
+    group = group or {}
+    # Each document belongs to one grouping: it has exactly that grouping's dimensions
+    conditions = {dimension: group.get(dimension, {"$exists": True}) for dimension in grouping}
+    conditions.update({
+        dimension: {"$exists": False}
+        for other in spec.groupings if other != grouping for dimension in other if dimension not in grouping
+    })
+    conditions["bucket"] = {"$gte": start_time, "$lt": end_time}
+    conditions[f"sketches.{field}"] = {"$exists": True}
+    merged = DDSketch(spec.alpha)
+    for doc in db[spec.collection_names(target)[granularity]].find(conditions, {f"sketches.{field}": 1}):
+        merged.merge(DDSketch.from_bytes(doc["sketches"][field]))
+    return merged
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Windows over sources whose only clock is a pair of IST strings, inserted_date ("2025-04-12")
+and inserted_time ("15:33:07"), as in ECOMData and SearchData.
+
+A "$or" over the two strings needs a separate index scan per branch and cannot break ties
+between rows stamped with the same second. Instead a window is one range of the compound
+index (inserted_date, inserted_time, _id), read with hint() and min()/max() so the server walks
+exactly that slice of the index in key order.
+
+Each target row stores its event time as a real UTC datetime in inserted_at. The watermark of
+the next window is the target's largest (inserted_at, _id), found through a (inserted_at, _id)
+index, so it is on the same clock as the source rather than compared with Processing_Time.
+"""
+
+from datetime import datetime, timedelta
+
+import pymongo
+import pytz
+from bson.min_key import MinKey
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+EVENT_TIME_FIELD = "inserted_at"
+CLOCK_INDEX = [("inserted_date", pymongo.ASCENDING), ("inserted_time", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+WATERMARK_INDEX = [(EVENT_TIME_FIELD, pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+
+
+def event_time(inserted_date, inserted_time):
+    """Naive UTC datetime of an IST date and time string pair, or None if they are missing or malformed."""
+    if not isinstance(inserted_date, str) or not isinstance(inserted_time, str):
+        return None
+    try:
+        return datetime.fromisoformat(f"{inserted_date} {inserted_time}") - IST_OFFSET
+    except ValueError:
+        return None
+
+
+def clock_strings(moment):
+    """(inserted_date, inserted_time) of a UTC datetime (naive or aware)."""
+    ist = moment.replace(tzinfo=None) + IST_OFFSET
+    return ist.strftime("%Y-%m-%d"), ist.strftime("%H:%M:%S")
+
+
+def _beyond(fields, values, operator, inclusive):
+    """Filter for keys lexicographically after ($gt) or before ($lt) values, optionally including them."""
+    branches = []
+    for position, field in enumerate(fields):
+        branch = dict(zip(fields[:position], values[:position]))
+        branch[field] = {operator: values[position]}
+        branches.append(branch)
+    if inclusive:
+        branches.append(dict(zip(fields, values)))
+    return {"$or": branches}
+
+
+class KeyWindow:
+    """Source rows whose keys in index (a list of (field, direction)) are in [lower, upper)."""
+
+    def __init__(self, index, lower, upper):
+        self.index = list(index)
+        self.fields = [field for field, _ in self.index]
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+
+    def find(self, collection, projection=None):
+        """The window as a single index range scan; the index must exist with exactly these keys."""
+        return (
+            collection.find({}, projection)
+            .hint(self.index)
+            .min(list(zip(self.fields, self.lower)))
+            .max(list(zip(self.fields, self.upper)))
+        )
+
+    def usable(self, collection):
+        """True if collection has an index with exactly this window's keys, as find() requires."""
+        wanted = [(field, int(direction)) for field, direction in self.index]
+        return any(
+            [(field, int(direction)) for field, direction in info["key"]] == wanted
+            for info in collection.index_information().values()
+        )
+
+    def as_query(self):
+        """The same window as a filter, for sources that lack the index."""
+        return {"$and": [
+            _beyond(self.fields, self.lower, "$gt", inclusive=True),
+            _beyond(self.fields, self.upper, "$lt", inclusive=False),
+        ]}
+
+    def __repr__(self):
+        return f"KeyWindow({self.fields}, {self.lower!r} .. {self.upper!r})"
+
+
+def clock_window(target, processing_time, logger, legacy_watermark=None, first_run=timedelta(minutes=10)):
+    """
+    (KeyWindow, start_time) from the target's latest (inserted_at, _id) up to the second of
+    processing_time. The watermark row itself is inside the window (min() is inclusive) and is
+    rejected again as a duplicate. Targets written before inserted_at existed fall back to
+    legacy_watermark(target) -> (inserted_date, inserted_time) or None; a first run reads the last
+    first_run of events.
+    """
+    latest = target.find_one(
+        {EVENT_TIME_FIELD: {"$ne": None}}, {EVENT_TIME_FIELD: 1}, sort=WATERMARK_INDEX
+    )
+    if latest:
+        start_time = latest[EVENT_TIME_FIELD]
+        lower = clock_strings(start_time) + (latest["_id"],)
+        logger.info(f"Resuming after event time {start_time.isoformat()} UTC (_id {latest['_id']})")
+    else:
+        legacy = legacy_watermark(target) if legacy_watermark else None
+        if legacy:
+            lower = tuple(legacy) + (MinKey(),)
+            start_time = event_time(*legacy) or processing_time.replace(tzinfo=None) - first_run
+            logger.info(f"No {EVENT_TIME_FIELD} in the target yet; resuming from {legacy[0]} {legacy[1]} IST")
+        else:
+            start_time = processing_time.replace(tzinfo=None) - first_run
+            lower = clock_strings(start_time) + (MinKey(),)
+            logger.info(f"No records in the target yet; starting from {lower[0]} {lower[1]} IST")
+    upper = clock_strings(processing_time) + (MinKey(),)  # Up to, not including, the current second
+    return KeyWindow(CLOCK_INDEX, lower, upper), start_time.replace(tzinfo=pytz.UTC)